@@ -6,12 +6,15 @@ from flask import Flask
 from flask_migrate import Migrate
 import os
 
+from app.cli import fixtures_cli
 from app.load_env import load_env
 from app.routes.main import main_bp
 from app.routes.creator import creator_bp
 from app.utils.logging import setup_logging
 from .extensions import db
 from .routes.api import api_bp
+from .routes.metrics import metrics_bp
+from .routes.debug import debug_bp
 
 migrate = Migrate()
 
@@ -69,6 +72,7 @@ def create_app_admin():
 
     app.register_blueprint(main_bp)
     app.register_blueprint(creator_bp)
+    app.cli.add_command(fixtures_cli)
 
     return app
 
@@ -80,5 +84,7 @@ def create_app_api():
     CORS(app, origins=origins)
 
     app.register_blueprint(api_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(debug_bp)
 
     return app
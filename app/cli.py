@@ -0,0 +1,44 @@
+import sys
+
+import click
+from flask.cli import AppGroup
+
+fixtures_cli = AppGroup("fixtures", help="Import and export cluster definitions.")
+
+
+@fixtures_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--skip-file-checks", is_flag=True, help="Do not require base images locally."
+)
+def import_fixtures(path: str, skip_file_checks: bool):
+    from app.routes.creator import fixtures
+
+    with open(path, encoding="utf-8") as f:
+        report = fixtures.import_stream(f, check_files=not skip_file_checks)
+
+    for error in report.errors:
+        click.echo(error, err=True)
+    if report.errors:
+        raise click.ClickException(
+            f"{len(report.errors)} invalid definitions, nothing imported"
+        )
+    click.echo(
+        f"clusters: {report.clusters_created} created, {report.clusters_updated} updated; "
+        f"environments: {report.environments_created} created, "
+        f"{report.environments_updated} updated"
+    )
+
+
+@fixtures_cli.command("export")
+@click.argument("path", type=click.Path(dir_okay=False, allow_dash=True), default="-")
+def export_fixtures(path: str):
+    from app.routes.creator import fixtures
+
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        for chunk in fixtures.export():
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
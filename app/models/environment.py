@@ -7,6 +7,8 @@ class Cluster(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False, unique=True, index=True)
+    net_ingress_kbit = db.Column(db.Integer, nullable=True)
+    net_egress_kbit = db.Column(db.Integer, nullable=True)
 
     environment_links = db.relationship(
         "ClusterEnvironment",
@@ -22,17 +24,39 @@ class Cluster(db.Model):
         viewonly=True,
     )
 
+    @validates("net_ingress_kbit", "net_egress_kbit")
+    def _validate_bandwidth(self, key, value):
+        if value is not None and value <= 0:
+            raise ValueError(f"{key} must be positive")
+        return value
+
     def __repr__(self):
         return f"<Cluster id={self.id} name={self.name!r}>"
 
 
 class Environment(db.Model):
     __tablename__ = "environments"
+    __table_args__ = (db.Index("ix_environments_name_id", "name", "id"),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False, index=True)
     ports = db.Column(db.JSON, nullable=True, default=list)
     access_info = db.Column(db.String(256), nullable=True, default=list)
+    shared = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=db.false()
+    )
+
+    cpu_limit = db.Column(db.Float, nullable=True)
+    cpu_shares = db.Column(db.Integer, nullable=True)
+    memory_limit_mb = db.Column(db.Integer, nullable=True)
+    pids_limit = db.Column(db.Integer, nullable=True)
+    io_weight = db.Column(db.Integer, nullable=True)
+    io_read_bps = db.Column(db.BigInteger, nullable=True)
+    io_write_bps = db.Column(db.BigInteger, nullable=True)
+    io_read_iops = db.Column(db.Integer, nullable=True)
+    io_write_iops = db.Column(db.Integer, nullable=True)
+    net_ingress_kbit = db.Column(db.Integer, nullable=True)
+    net_egress_kbit = db.Column(db.Integer, nullable=True)
 
     cluster_links = db.relationship(
         "ClusterEnvironment",
@@ -78,6 +102,24 @@ class Environment(db.Model):
             cleaned.append(p)
         return cleaned
 
+    @validates(
+        "cpu_limit",
+        "cpu_shares",
+        "memory_limit_mb",
+        "pids_limit",
+        "io_weight",
+        "io_read_bps",
+        "io_write_bps",
+        "io_read_iops",
+        "io_write_iops",
+        "net_ingress_kbit",
+        "net_egress_kbit",
+    )
+    def _validate_limit(self, key, value):
+        if value is not None and value <= 0:
+            raise ValueError(f"{key} must be positive")
+        return value
+
 
 class ClusterEnvironment(db.Model):
     __tablename__ = "cluster_environments"
@@ -126,5 +168,8 @@ class VMEnvironment(db.Model):
     )
     template = db.Column(db.JSON, nullable=False)
     base_image_path = db.Column(db.String(512), nullable=False)
+    tuning_profile = db.Column(
+        db.String(32), nullable=False, default="none", server_default="none"
+    )
 
     environment = db.relationship("Environment", back_populates="vm")
@@ -1,22 +1,124 @@
+import math
 import os
-from flask import blueprints, request, jsonify
+import time
+from flask import blueprints, current_app, request, jsonify
 
+from app.services.balloon import BalloonController
+from app.services.blueprint_cache import BlueprintCache, create_invalidation_bus
 from app.services.cluster import ClusterService, NotFoundError, ValidationError
+from app.services.cpu_placement import CpuPlacer
 from app.services.ports import PortPool, NoAvailablePortsError
 from app.services.registry import ClusterRegistry
-from app.services.clients import create_docker_client, create_libvirt_client
+from app.services.sampler import ResourceSampler
+from app.services.shared_envs import SharedEnvironmentPool
+from app.services.timeseries import Resolution, TimeSeriesStore
+from app.services.clients import get_clients
+from app.services.images import ImageManager, ImagePullError
+from app.services.overlay_gc import OverlayCollector
+from app.utils.base_image_cache import BaseImageCache
+from app.utils.domain_tuning import capabilities_loader
+from app.utils.overlay_placement import OverlayPlacer
+from app.utils.metrics import (
+    BOOTING_VMS,
+    FREE_PORTS,
+    LIVE_SESSIONS,
+    REGISTRY_ENVIRONMENTS,
+    SOCAT_PROCESSES,
+)
+from app.utils.tracing import TRACER
 
 api_bp = blueprints.Blueprint("api", __name__, url_prefix="/api")
 
+TRACER.configure(
+    max_sessions=int(os.getenv("TRACE_MAX_SESSIONS", "1000")),
+    traces_per_session=int(os.getenv("TRACE_PER_SESSION", "10")),
+    export_path=os.getenv("TRACE_EXPORT_PATH"),
+)
+
 _registry = ClusterRegistry()
 _port_pool = PortPool(
     range(int(os.getenv("ENV_PORTS_BEGIN")), int(os.getenv("ENV_PORTS_END")))
 )
+_sample_interval = float(os.getenv("RESOURCE_SAMPLE_INTERVAL_SECONDS", "5"))
+_history = TimeSeriesStore(
+    resolutions=Resolution.parse_many(
+        os.getenv("RESOURCE_HISTORY_RESOLUTIONS", "5:600,60:86400"),
+        min_step_seconds=math.ceil(_sample_interval),
+    ),
+    max_series=int(os.getenv("RESOURCE_HISTORY_MAX_SERIES", "500")),
+)
+_images = ImageManager.from_env(get_clients())
+_shared_envs = SharedEnvironmentPool.from_env(
+    clients=get_clients(), port_pool=_port_pool, images=_images
+)
+_sampler = ResourceSampler(
+    registry=_registry,
+    interval_seconds=_sample_interval,
+    max_workers=int(os.getenv("RESOURCE_SAMPLE_WORKERS", "16")),
+    history=_history,
+    shared_envs=_shared_envs,
+)
+_blueprints = BlueprintCache(
+    host_capabilities=capabilities_loader(get_clients().libvirt),
+    balloon_stats_seconds=int(os.getenv("VM_BALLOON_STATS_SECONDS", "0")),
+)
+_invalidation_bus = create_invalidation_bus()
+_invalidation_bus.subscribe(_blueprints.on_notification)
+
+_overlays = OverlayPlacer.from_env()
+_base_images = BaseImageCache.from_env(
+    overlay_dirs=tuple(root.path for root in _overlays.roots)
+)
 _service = ClusterService(
     registry=_registry,
     port_pool=_port_pool,
-    docker_client=create_docker_client(),
-    libvirt_client=create_libvirt_client(),
+    sampler=_sampler,
+    blueprints=_blueprints,
+    clients=get_clients(),
+    images=_images,
+    base_images=_base_images,
+    overlays=_overlays,
+    cpu_placer=CpuPlacer.from_env(),
+    shared_envs=_shared_envs,
+)
+_overlay_gc = OverlayCollector.from_env(
+    registry=_registry, overlays=_overlays, clients=get_clients()
+)
+_balloons = BalloonController.from_env(registry=_registry)
+
+
+@api_bp.before_app_request
+def _start_background_workers():
+    # Deferred to the first request so threads and backend connections
+    # belong to the serving process rather than a pre-fork parent.
+    _sampler.start()
+    _service.start()
+    _invalidation_bus.listen(current_app.config["SQLALCHEMY_DATABASE_URI"])
+    _images.start(current_app._get_current_object())
+    _overlay_gc.start()
+    _balloons.start()
+
+
+def _registered_environments():
+    for _, (cluster, _, _) in _registry.items():
+        yield from cluster.environments
+
+
+LIVE_SESSIONS.set_function(lambda: len(_registry.items()))
+REGISTRY_ENVIRONMENTS.set_function(lambda: sum(1 for _ in _registered_environments()))
+FREE_PORTS.set_function(_port_pool.available_count)
+BOOTING_VMS.set_function(
+    lambda: sum(
+        1 for env in _registered_environments() if getattr(env, "booting", False)
+    )
+)
+SOCAT_PROCESSES.set_function(
+    lambda: sum(
+        1
+        for env in _registered_environments()
+        for proc in getattr(env, "forwarded_ports", [])
+        if proc.poll() is None
+    )
 )
 
 
@@ -42,7 +144,13 @@ def run(cluster_id: int):
             if not isinstance(k, str) or not isinstance(v, str):
                 raise ValidationError("All variables must be string->string.")
 
-        result = _service.run(cluster_id, variables, session_id)
+        ttl_seconds = payload.get("ttl_seconds")
+        if ttl_seconds is not None and (
+            not isinstance(ttl_seconds, int) or isinstance(ttl_seconds, bool)
+        ):
+            raise ValidationError("'ttl_seconds' must be an integer.")
+
+        result = _service.run(cluster_id, variables, session_id, ttl_seconds)
         return jsonify(
             {"status": result.status, "access_info": result.access_info}
         ), 200
@@ -51,7 +159,7 @@ def run(cluster_id: int):
         return jsonify({"error": str(e)}), 400
     except NotFoundError as e:
         return jsonify({"error": str(e)}), 404
-    except NoAvailablePortsError as e:
+    except (NoAvailablePortsError, ImagePullError) as e:
         return jsonify({"error": str(e)}), 500
 
 
@@ -122,4 +230,49 @@ def running_clusters():
 
 @api_bp.route("/resources/summary", methods=["GET"])
 def resources_summary():
-    return jsonify(_service.resources_summary()), 200
+    summary = _service.resources_summary()
+    summary["overlay_gc"] = _overlay_gc.report()
+    summary["memory"] = _balloons.report()
+    return jsonify(summary), 200
+
+
+@api_bp.route("/resources/history", methods=["GET"])
+def resources_history():
+    try:
+        now = time.time()
+        try:
+            end = float(request.args.get("end", now))
+            start = float(request.args.get("start", end - 600))
+        except ValueError:
+            raise ValidationError("start and end must be unix timestamps")
+        step = request.args.get("step")
+        if step is not None:
+            if not step.isdigit() or int(step) <= 0:
+                raise ValidationError("step must be a positive number of seconds")
+            step = int(step)
+
+        result = _service.resources_history(
+            scope=request.args.get("scope", "host"),
+            key=request.args.get("key"),
+            metric=request.args.get("metric"),
+            start=start,
+            end=end,
+            agg=request.args.get("agg", "avg"),
+            step=step,
+        )
+        return jsonify(result), 200
+
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except NotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@api_bp.route("/sessions/<string:session_id>/trace", methods=["GET"])
+def session_trace(session_id: str):
+    try:
+        return jsonify(_service.session_trace(session_id)), 200
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except NotFoundError as e:
+        return jsonify({"error": str(e)}), 404
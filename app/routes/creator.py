@@ -1,9 +1,18 @@
+import io
 import os
-from flask import Blueprint, render_template, request, abort, redirect, url_for, flash
-from sqlalchemy.exc import IntegrityError
 
-import docker
-import libvirt
+from flask import (
+    Blueprint,
+    Response,
+    render_template,
+    request,
+    abort,
+    redirect,
+    url_for,
+    flash,
+    stream_with_context,
+)
+from sqlalchemy.exc import IntegrityError
 
 from app.services.creator import (
     CreatorService,
@@ -20,18 +29,30 @@ from app.services.repository import (
     ClusterEnvironmentRepository,
 )
 from app.services.environment_catalog import EnvironmentCatalog
+from app.services.blueprint_cache import create_invalidation_bus
+from app.services.clients import get_clients
+from app.services.fixtures import FixtureService
+from app.services.images import ImageManager
+from app.utils.domain_tuning import NO_TUNING, PROFILE_NAMES
+from app.utils.resource_limits import LimitsError, ResourceLimits
 
 
 creator_bp = Blueprint("creator", __name__, url_prefix="/creator")
 
-docker_client = docker.from_env()
-libvirt_client = libvirt.open(os.getenv("LIBVIRT_CLIENT"))
-
-catalog = EnvironmentCatalog(docker_client=docker_client, libvirt_client=libvirt_client)
+catalog = EnvironmentCatalog.from_env(get_clients())
+images = ImageManager.from_env(get_clients())
 service = CreatorService(
     clusters=ClusterRepository(),
     envs=EnvironmentRepository(),
     links=ClusterEnvironmentRepository(),
+    notifier=create_invalidation_bus(),
+    images=images,
+)
+fixtures = FixtureService(
+    clusters=ClusterRepository(),
+    notifier=create_invalidation_bus(),
+    images=images,
+    batch_size=int(os.getenv("FIXTURE_BATCH_SIZE", "100")),
 )
 
 
@@ -40,6 +61,15 @@ def _ports_from_form() -> list[int]:
     return [int(p) for p in internal_ports if (p or "").strip()]
 
 
+def _limits_from_form() -> ResourceLimits:
+    return ResourceLimits.from_mapping(request.form)
+
+
+def _optional_int(field: str) -> int | None:
+    value = (request.form.get(field) or "").strip()
+    return int(value) if value else None
+
+
 @creator_bp.route("/docker", methods=["GET", "POST"])
 def make_docker():
     if request.method == "POST":
@@ -49,10 +79,12 @@ def make_docker():
                 image=request.form.get("docker_image") or "",
                 ports=_ports_from_form(),
                 access_info=request.form.get("access_info") or "",
+                limits=_limits_from_form(),
+                shared=request.form.get("shared") == "on",
             )
             env = service.create_docker_env(cmd)
             flash(f"Docker environment '{env.name}' created successfully!", "success")
-        except ValidationError as e:
+        except (ValidationError, LimitsError) as e:
             flash(str(e), "danger")
         except Exception as e:
             flash(f"Failed to create Docker environment: {e}", "danger")
@@ -60,6 +92,7 @@ def make_docker():
     return render_template(
         "creator/docker.html",
         images=catalog.list_docker_image_tags(),
+        image_statuses=images.statuses(ImageManager.referenced_images()),
     )
 
 
@@ -73,15 +106,21 @@ def make_vm():
                 template=request.form.get("template") or "",
                 ports=_ports_from_form(),
                 access_info=request.form.get("access_info") or "",
+                tuning_profile=request.form.get("tuning_profile") or NO_TUNING,
+                limits=_limits_from_form(),
             )
             env = service.create_vm_env(cmd)
             flash(f"VM environment '{env.name}' created successfully!", "success")
-        except ValidationError as e:
+        except (ValidationError, LimitsError) as e:
             flash(str(e), "danger")
         except Exception as e:
             flash(f"Failed to create VM environment: {e}", "danger")
 
-    return render_template("creator/vm.html", images=catalog.list_vm_images())
+    return render_template(
+        "creator/vm.html",
+        images=catalog.list_vm_images(),
+        tuning_profiles=PROFILE_NAMES,
+    )
 
 
 @creator_bp.route("/cluster", methods=["GET", "POST"])
@@ -91,7 +130,12 @@ def make_cluster():
             name = (request.form.get("name") or "").strip()
             env_ids = [int(x) for x in request.form.getlist("environment_ids")]
 
-            cmd = CreateClusterCmd(name=name, environment_ids=env_ids)
+            cmd = CreateClusterCmd(
+                name=name,
+                environment_ids=env_ids,
+                net_ingress_kbit=_optional_int("net_ingress_kbit"),
+                net_egress_kbit=_optional_int("net_egress_kbit"),
+            )
             cluster = service.create_cluster_with_envs(cmd)
             flash(f"Cluster '{cluster.name}' created successfully!", "success")
 
@@ -149,3 +193,42 @@ def delete_cluster(cluster_id: int, callback: str):
         abort(400)
 
     return redirect(url_for(callback))
+
+
+@creator_bp.route("/fixtures/import", methods=["POST"])
+def import_fixtures():
+    upload = request.files.get("fixture")
+    if upload is None:
+        abort(400, description="No fixture file uploaded")
+
+    stream = io.TextIOWrapper(upload.stream, encoding="utf-8")
+    try:
+        report = fixtures.import_stream(
+            stream, check_files=request.form.get("skip_file_checks") != "1"
+        )
+    except Exception as e:
+        flash(f"Failed to import fixtures: {e}", "danger")
+        return redirect(url_for("main.clusters"))
+
+    if report.errors:
+        flash(
+            f"Fixture rejected, nothing imported: {'; '.join(report.errors[:5])}",
+            "danger",
+        )
+    else:
+        flash(
+            f"Imported {report.clusters_created} new and {report.clusters_updated} "
+            f"updated clusters ({report.environments_created} new, "
+            f"{report.environments_updated} updated environments).",
+            "success",
+        )
+    return redirect(url_for("main.clusters"))
+
+
+@creator_bp.route("/fixtures/export", methods=["GET"])
+def export_fixtures():
+    return Response(
+        stream_with_context(fixtures.export()),
+        mimetype="application/json",
+        headers={"Content-Disposition": "attachment; filename=clusters.json"},
+    )
@@ -0,0 +1,52 @@
+import hmac
+import os
+from flask import Blueprint, Response, abort, jsonify, request
+
+from app.utils.profiling import AllocationProfiler, ProfilerBusy, SamplingProfiler
+
+debug_bp = Blueprint("debug", __name__, url_prefix="/api/debug")
+
+MAX_PROFILE_SECONDS = 60.0
+
+_sampler = SamplingProfiler()
+_allocations = AllocationProfiler()
+
+
+@debug_bp.before_request
+def _require_admin_token():
+    expected = os.getenv("ADMIN_API_TOKEN")
+    if not expected:
+        abort(404)
+    provided = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(provided.encode(), expected.encode()):
+        abort(403)
+
+
+def _seconds_arg(default: float) -> float:
+    seconds = request.args.get("seconds", default, type=float)
+    return min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+
+
+@debug_bp.route("/profile", methods=["GET"])
+def profile():
+    interval = request.args.get("interval", 0.01, type=float)
+    try:
+        collapsed = _sampler.profile(
+            duration=_seconds_arg(5.0), interval=max(interval, 0.001)
+        )
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    return Response(collapsed, mimetype="text/plain")
+
+
+@debug_bp.route("/allocations", methods=["GET"])
+def allocations():
+    top = request.args.get("top", 25, type=int)
+    frames = request.args.get("frames", 5, type=int)
+    try:
+        stats = _allocations.diff(
+            duration=_seconds_arg(10.0), top=max(top, 1), frames=max(frames, 1)
+        )
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"top": stats}), 200
@@ -1,37 +1,70 @@
-from flask import Blueprint, render_template
-from sqlalchemy.orm import joinedload
+import os
 
-from app.models import Cluster, Environment
+from flask import Blueprint, abort, render_template, request
+
+from app.services.repository import (
+    ClusterRepository,
+    EnvironmentRepository,
+    InvalidCursorError,
+)
 
 main_bp = Blueprint("main", __name__)
 
+PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+
+clusters_repo = ClusterRepository()
+envs_repo = EnvironmentRepository()
+
+
+def _filters(*names: str) -> dict:
+    return {n: v for n in names if (v := (request.args.get(n) or "").strip())}
+
 
 @main_bp.route("/")
 def index():
-    clusters = Cluster.query.join(Cluster.environments).all()
-    return render_template("index.html", clusters=clusters)
+    return render_template("index.html")
 
 
 @main_bp.route("/environments")
 def environments():
-    existing_environments = (
-        Environment.query.options(
-            joinedload(Environment.docker),
-            joinedload(Environment.vm),
+    filters = _filters("name", "type", "image")
+    try:
+        page = envs_repo.list_page(
+            name=filters.get("name"),
+            kind=filters.get("type"),
+            image=filters.get("image"),
+            after=request.args.get("after"),
+            limit=PAGE_SIZE,
         )
-        .order_by(Environment.name.asc())
-        .all()
-    )
+    except InvalidCursorError as e:
+        abort(400, str(e))
 
     return render_template(
-        "environments.html", existing_environments=existing_environments
+        "environments.html",
+        existing_environments=page.items,
+        next_cursor=page.next_cursor,
+        filters=filters,
     )
 
 
 @main_bp.route("/clusters")
 def clusters():
-    existing_clusters = Cluster.query.join(Cluster.environments).all()
-    return render_template("clusters.html", existing_clusters=existing_clusters)
+    filters = _filters("name")
+    try:
+        page = clusters_repo.list_page(
+            name=filters.get("name"),
+            after=request.args.get("after"),
+            limit=PAGE_SIZE,
+        )
+    except InvalidCursorError as e:
+        abort(400, str(e))
+
+    return render_template(
+        "clusters.html",
+        existing_clusters=page.items,
+        next_cursor=page.next_cursor,
+        filters=filters,
+    )
 
 
 @main_bp.route("/base")
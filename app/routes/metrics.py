@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+
+from app.utils.metrics import REGISTRY
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -2,3 +2,4 @@ from .environment import Environment  # noqa: F401
 from .docker_env import DockerEnvironment  # noqa: F401
 from .vm_env import VMEnvironment  # noqa: F401
 from .cluster import Cluster  # noqa: F401
+from .vm_stats import VMStatsCollector  # noqa: F401
@@ -1,9 +1,11 @@
-import os
-import libvirt
-import docker
+import logging
+
+from docker import DockerClient
 
 from app.runtime.environment import Environment
 from app.models.status import EnvStatus
+from app.utils.tracing import phase, span
+from app.utils.traffic_control import clear_shaping, shape_interface
 from app.utils.networking import (
     create_docker_network,
     remove_docker_network,
@@ -11,31 +13,51 @@ from app.utils.networking import (
     remove_network,
 )
 
-docker_client = docker.from_env()
-libvirt_client = libvirt.open(os.getenv("LIBVIRT_CLIENT"))
+logger = logging.getLogger(__name__)
 
 
 class Cluster:
-    def __init__(self, name: str, cluster_id: int, cluster_db_id: int = None):
+    def __init__(
+        self,
+        docker_client: DockerClient,
+        name: str,
+        cluster_id: int,
+        cluster_db_id: int = None,
+        cluster_db_name: str = None,
+        net_ingress_kbit: int | None = None,
+        net_egress_kbit: int | None = None,
+    ):
         self.name = name
         self.id = cluster_id
         self.db_id = cluster_db_id
+        self.db_name = cluster_db_name
         self.environments = []
 
         self.network_name = f"venvbr{self.id}"
 
-        create_network(self.network_name, cluster_id)
+        with phase("network_create"):
+            create_network(self.network_name, cluster_id)
+
+        with phase("docker_network_create"):
+            self.docker_network = create_docker_network(
+                docker_client, self.network_name, self.id
+            )
 
-        self.docker_network = create_docker_network(
-            docker_client, self.network_name, self.id
-        )
+        # Only routed traffic crosses the bridge device itself, so this caps
+        # the session's uplink while traffic between its environments stays
+        # unshaped.
+        self.shaped = False
+        if net_ingress_kbit or net_egress_kbit:
+            with phase("network_shape"):
+                self.shaped = shape_interface(
+                    self.network_name, net_ingress_kbit, net_egress_kbit
+                )
 
     def _all_env_running(self):
         for env in self.environments:
-            print(env.status())
-            if env.status() == EnvStatus.RUNNING:
-                continue
-            else:
+            status = env.status()
+            logger.debug("Environment %s status: %s", env.name, status)
+            if status != EnvStatus.RUNNING:
                 return False
         return True
 
@@ -44,7 +66,8 @@ class Cluster:
 
     def start(self):
         for env in self.environments:
-            env.start()
+            with span("env_start", environment=env.display_name):
+                env.start()
 
     def restart(self):
         for env in self.environments:
@@ -60,20 +83,38 @@ class Cluster:
         return {env.display_name: env.get_access_info() for env in self.environments}
 
     def get_resource_usage(self) -> dict:
-        total = {"memory": 0, "network": {"rx": 0, "tx": 0}}
+        total = {
+            "cpu": 0.0,
+            "memory": 0,
+            "network": {"rx": 0, "tx": 0},
+            "io": {"read": 0, "write": 0},
+        }
 
         per_env = {}
         for env in self.environments:
             r = env.get_resource_usage()
             per_env[env.display_name] = r
+            total["cpu"] += float(r.get("cpu", 0.0))
             total["memory"] += int(r.get("memory", 0))
             total["network"]["rx"] += int(r.get("network", {}).get("rx", 0))
             total["network"]["tx"] += int(r.get("network", {}).get("tx", 0))
+            total["io"]["read"] += int(r.get("io", {}).get("read", 0))
+            total["io"]["write"] += int(r.get("io", {}).get("write", 0))
         return {"total": total, "environments": per_env}
 
     def destroy(self):
         for env in self.environments:
-            env.destroy()
-
-        remove_docker_network(self.docker_network)
-        remove_network(self.network_name)
+            with span("env_destroy", environment=env.display_name):
+                try:
+                    env.destroy()
+                except Exception as e:
+                    # The networks below must go even if one environment sticks.
+                    logger.error(f"Failed to destroy environment {env.name}: {e}")
+
+        if self.shaped:
+            with span("clear_shaping"):
+                clear_shaping(self.network_name)
+        with span("remove_docker_network"):
+            remove_docker_network(self.docker_network)
+        with span("remove_network"):
+            remove_network(self.network_name)
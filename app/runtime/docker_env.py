@@ -5,6 +5,21 @@ from app.models.status import EnvStatus
 from docker.errors import ImageNotFound, APIError, DockerException, ContainerError
 from docker.models.networks import Network
 import logging
+import os
+import time
+
+from app.services.cpu_placement import CpuAssignment
+from app.utils.cgroups import CgroupStatsReader, CgroupUnavailable
+from app.utils.resource_limits import ResourceLimits
+from app.utils.tracing import phase, span
+from app.utils.traffic_control import host_veth, shape_interface
+
+logger = logging.getLogger(__name__)
+
+PID_RETRY_SECONDS = 30
+# Consecutive failed cgroup reads before falling back to the Docker API.
+CGROUP_READ_FAILURE_LIMIT = 3
+EMPTY_USAGE = {"cpu": 0.0, "memory": 0, "network": {"rx": 0, "tx": 0}}
 
 
 class DockerEnvException(Exception):
@@ -28,6 +43,8 @@ class DockerEnvironment(Environment):
         variables: dict[str, str],
         access_info: str,
         docker_network: Network,
+        placement: CpuAssignment | None = None,
+        limits: ResourceLimits | None = None,
     ):
         super().__init__(
             name, display_name, internal_ports, published_ports, access_info
@@ -36,9 +53,17 @@ class DockerEnvironment(Environment):
         self.image = image
         self.variables = variables
         self.docker_network = docker_network
+        self.placement = placement
+        self.limits = limits
 
         self.container = None
-        logging.info(f"Created docker environment {name}")
+        self._stats_reader = None
+        self._use_cgroups = True
+        self._pid_retry_at = 0.0
+        self._cgroup_failures = 0
+        self._last_status = None
+        self._previous_cpu_stats = None
+        logger.info(f"Created docker environment {name}")
 
     def _get_container_ip(self) -> str | None:
         if self.container is None:
@@ -56,56 +81,88 @@ class DockerEnvironment(Environment):
 
     def _on_started(self):
         self.ip = self._get_container_ip() or "unknown"
+        self._shape_network()
+
+    def _shape_network(self):
+        if self.limits is None or not self.limits.has_bandwidth():
+            return
+        pid = int((self.container.attrs.get("State", {}) or {}).get("Pid") or 0)
+        dev = host_veth(pid) if pid > 0 else None
+        if dev is None:
+            logger.warning(f"No host interface found to shape {self.name}")
+            return
+        with span("shape_network", device=dev):
+            shape_interface(
+                dev, self.limits.net_ingress_kbit, self.limits.net_egress_kbit
+            )
 
     def start(self):
-        try:
-            self.container = self.docker_client.containers.run(
-                self.image,
-                detach=True,
-                ports={
-                    f"{internal}/tcp": published
-                    for internal, published in zip(
-                        self.internal_ports, self.published_ports
-                    )
-                },
-                network=self.docker_network.name,
-                name=self.name,
-                environment=self.variables,
+        options = {}
+        if self.limits is not None:
+            options.update(
+                self.limits.docker_run_options(os.getenv("DOCKER_IO_DEVICE"))
+            )
+        if self.placement is not None:
+            options.update(
+                cpuset_cpus=self.placement.cpuset, cpuset_mems=self.placement.mems
             )
-            logging.info(f"Started docker environment {self.name}")
+        try:
+            with phase("container_run"):
+                self.container = self.docker_client.containers.run(
+                    self.image,
+                    detach=True,
+                    ports={
+                        f"{internal}/tcp": published
+                        for internal, published in zip(
+                            self.internal_ports, self.published_ports
+                        )
+                    },
+                    network=self.docker_network.name,
+                    name=self.name,
+                    environment=self.variables,
+                    **options,
+                )
+            logger.info(f"Started docker environment {self.name}")
 
             self._on_started()
 
         except ImageNotFound:
             msg = f"Docker environment {self.image} not found"
-            logging.error(msg)
+            logger.error(msg)
             raise DockerEnvException(msg)
         except ContainerError as e:
             msg = f"Docker environment {self.name} failed: {e}"
-            logging.error(msg)
+            logger.error(msg)
             raise DockerEnvException(msg)
         except APIError as e:
             msg = f"Docker environment {self.name} API error: {e}"
-            logging.error(msg)
+            logger.error(msg)
             raise DockerEnvException(msg)
         except DockerException as e:
             msg = f"Docker environment {self.name} error: {e}"
-            logging.error(msg)
+            logger.error(msg)
             raise DockerEnvException(msg)
 
     def restart(self):
         if self.container is None:
-            logging.warning(
+            logger.warning(
                 f"Tried to restart {self.name}, but environment was not started"
             )
             raise DockerEnvException(f"Docker {self.name} has not started yet")
 
         try:
             self.container.restart()
-            logging.info(f"Restarted docker environment {self.name}")
+            self._stats_reader = None
+            self._use_cgroups = True
+            self._pid_retry_at = 0.0
+            self._cgroup_failures = 0
+            # A restart gives the container a new veth pair.
+            self.container.reload()
+            self._shape_network()
+            logger.info(f"Restarted docker environment {self.name}")
 
         except ImageNotFound as e:
-            logging.error(f"Docker environment {self.name} not found: {e}")
+            logger.error(f"Docker environment {self.name} not found: {e}")
             raise DockerEnvException(f"Docker environment {self.name} not found: {e}")
 
     def status(self) -> EnvStatus:
@@ -113,42 +170,122 @@ class DockerEnvironment(Environment):
             return EnvStatus.UNKNOWN
 
         docker_status = self.docker_client.containers.get(self.container.id).status
-        logging.debug(f"Checked docker {self.name} status: {docker_status}")
+        logger.debug("Checked docker %s status: %s", self.name, docker_status)
+        if docker_status != self._last_status:
+            # A container that just started has a pid worth looking up again.
+            self._last_status = docker_status
+            self._pid_retry_at = 0.0
         return (
             EnvStatus(docker_status)
             if docker_status in EnvStatus._value2member_map_
             else EnvStatus.UNKNOWN
         )
 
-    def get_resource_usage(self) -> dict:
-        if self.container is None:
-            return {"cpu": 0.0, "memory": 0, "network": {"rx": 0, "tx": 0}}
+    def _cgroup_reader(self) -> CgroupStatsReader | None:
+        if self._stats_reader is not None or not self._use_cgroups:
+            return self._stats_reader
+        if time.monotonic() < self._pid_retry_at:
+            return None
 
+        self.container.reload()
+        pid = int((self.container.attrs.get("State", {}) or {}).get("Pid") or 0)
+        if pid <= 0:
+            # Not running (yet); don't ask the daemon again every sample.
+            self._pid_retry_at = time.monotonic() + PID_RETRY_SECONDS
+            return None
         try:
-            stats = self.container.stats(stream=False)
+            self._stats_reader = CgroupStatsReader(pid)
+        except CgroupUnavailable as e:
+            logger.debug("Falling back to docker stats for %s: %s", self.name, e)
+            self._use_cgroups = False
+            return None
+        return self._stats_reader
+
+    def _docker_api_usage(self) -> dict:
+        stats = self.container.stats(stream=False, one_shot=True)
+
+        # --- CPU (percent of one core, from deltas between our own samples) ---
+        cpu_stats = stats.get("cpu_stats", {}) or {}
+        cpu_total = int((cpu_stats.get("cpu_usage", {}) or {}).get("total_usage", 0))
+        system_total = int(cpu_stats.get("system_cpu_usage", 0) or 0)
+        online_cpus = int(cpu_stats.get("online_cpus", 0) or 1)
+
+        cpu = 0.0
+        if self._previous_cpu_stats is not None:
+            cpu_delta = cpu_total - self._previous_cpu_stats[0]
+            system_delta = system_total - self._previous_cpu_stats[1]
+            if cpu_delta > 0 and system_delta > 0:
+                cpu = cpu_delta / system_delta * online_cpus * 100.0
+        self._previous_cpu_stats = (cpu_total, system_total)
+
+        # --- Memory (bytes) ---
+        mem_stats = stats.get("memory_stats", {}) or {}
+        mem_usage = int(mem_stats.get("usage", 0) or 0)
+        inner = mem_stats.get("stats", {}) or {}
+        mem_cache = int(inner.get("inactive_file", inner.get("cache", 0)) or 0)
+        mem_real = max(0, mem_usage - mem_cache)
 
-            # --- Memory (bytes) ---
-            mem_stats = stats.get("memory_stats", {}) or {}
-            mem_usage = int(mem_stats.get("usage", 0) or 0)
-            mem_cache = int((mem_stats.get("stats", {}) or {}).get("cache", 0) or 0)
-            mem_real = max(0, mem_usage - mem_cache)
+        # --- Network (bytes) ---
+        networks = stats.get("networks") or {}
+        rx = sum(int(v.get("rx_bytes", 0) or 0) for v in networks.values())
+        tx = sum(int(v.get("tx_bytes", 0) or 0) for v in networks.values())
 
-            # --- Network (bytes) ---
-            networks = stats.get("networks") or {}
-            rx = sum(int(v.get("rx_bytes", 0) or 0) for v in networks.values())
-            tx = sum(int(v.get("tx_bytes", 0) or 0) for v in networks.values())
+        # --- Block IO (bytes) ---
+        io_read = io_write = 0
+        blkio = (stats.get("blkio_stats", {}) or {}).get("io_service_bytes_recursive")
+        for entry in blkio or []:
+            op = (entry.get("op") or "").lower()
+            if op == "read":
+                io_read += int(entry.get("value", 0) or 0)
+            elif op == "write":
+                io_write += int(entry.get("value", 0) or 0)
+
+        return {
+            "cpu": round(cpu, 2),
+            "memory": mem_real,
+            "network": {"rx": rx, "tx": tx},
+            "io": {"read": io_read, "write": io_write},
+        }
+
+    def get_resource_usage(self) -> dict:
+        if self.container is None:
+            return dict(EMPTY_USAGE)
+
+        try:
+            reader = self._cgroup_reader()
+            if reader is not None:
+                try:
+                    usage = reader.read()
+                    self._cgroup_failures = 0
+                    return usage
+                except CgroupUnavailable as e:
+                    # The container may have been restarted under a new pid.
+                    logger.debug("cgroup read failed for %s: %s", self.name, e)
+                    self._stats_reader = None
+                    self._pid_retry_at = 0.0
+                    self._cgroup_failures += 1
+                    if self._cgroup_failures >= CGROUP_READ_FAILURE_LIMIT:
+                        logger.warning(
+                            f"cgroup stats for {self.name} failed "
+                            f"{self._cgroup_failures} times in a row, "
+                            "falling back to docker stats"
+                        )
+                        self._use_cgroups = False
 
-            return {"memory": mem_real, "network": {"rx": rx, "tx": tx}}
+            if self._use_cgroups:
+                # No running process to sample; the API would report zeros too.
+                return dict(EMPTY_USAGE)
+            return self._docker_api_usage()
 
         except Exception as e:
-            logging.exception(
+            logger.exception(
                 f"Failed to read docker resources for {getattr(self, 'name', 'unknown')}: {e}"
             )
-            return {"cpu": 0.0, "memory": 0, "network": {"rx": 0, "tx": 0}}
+            return dict(EMPTY_USAGE)
 
     def destroy(self):
         if self.container is None:
-            logging.warning(
+            logger.warning(
                 f"Tried to remove {self.name}, but environment was not started"
             )
             return
@@ -156,4 +293,4 @@ class DockerEnvironment(Environment):
         self.container.stop()
         self.container.remove()
 
-        logging.info(f"Removed docker environment {self.name}")
+        logger.info(f"Removed docker environment {self.name}")
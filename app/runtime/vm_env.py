@@ -1,16 +1,39 @@
+import contextvars
 import os
 import threading
 import time
-import uuid
 
+from app.services.clients import LibvirtPool
+from app.services.cpu_placement import CpuAssignment
+from app.utils.base_image_cache import BaseImageCache
 from app.utils.networking import forward_port
+from app.utils.overlay_placement import OverlayPlacer
 import xml.etree.ElementTree as ET
+from app.utils.domain_template import (
+    CompiledTemplate,
+    TemplateError,
+    compile_template,
+    render,
+)
+from app.utils.domain_tuning import apply_placement
 from app.utils.vm_overlay import create_overlay, remove_overlay
+from app.utils.metrics import PHASE_SECONDS
+from app.utils.tracing import Span, enter_span, open_span, phase, span
 from app.runtime.environment import Environment
 from app.models.status import EnvStatus
 import libvirt
 import logging
 
+logger = logging.getLogger(__name__)
+
+VM_STATS = (
+    libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+    | libvirt.VIR_DOMAIN_STATS_BALLOON
+    | libvirt.VIR_DOMAIN_STATS_VCPU
+    | libvirt.VIR_DOMAIN_STATS_INTERFACE
+    | libvirt.VIR_DOMAIN_STATS_BLOCK
+)
+
 
 class VMEnvException(Exception):
     def __init__(self, message: str):
@@ -24,83 +47,163 @@ class VMEnvException(Exception):
 class VMEnvironment(Environment):
     def __init__(
         self,
-        libvirt_client: libvirt.virConnect,
+        libvirt_pool: LibvirtPool,
+        base_images: BaseImageCache,
+        overlays: OverlayPlacer,
         name: str,
         display_name: str,
-        template: str,
+        template: CompiledTemplate | str,
         base_image_name: str,
         internal_ports: list,
         published_ports: list,
         access_info: str,
         network_name: str,
+        ttl_seconds: int | None = None,
+        placement: CpuAssignment | None = None,
     ):
         super().__init__(
             name, display_name, internal_ports, published_ports, access_info
         )
-        self.libvirt_client = libvirt_client
+        self.libvirt_pool = libvirt_pool
+        self._conn = libvirt_pool.get()
+        self.base_images = base_images
+        self.overlays = overlays
         self.template = template
-        self.base_image_path = os.path.join(
-            os.getenv("VM_BASE_IMAGES_PATH"), base_image_name
-        )
         self.network_name = network_name
+        self.placement = placement
         self.forwarded_ports = []
+        self.transient = bool(int(os.getenv("VM_TRANSIENT_DOMAINS", "0")))
+        self._storage_released = False
 
-        self.image_path = f"{os.getenv('VM_OVERLAYS_PATH')}{name}.qcow2"
-        create_overlay(self.base_image_path, self.image_path)
+        with span("base_image_cache"):
+            self.base_image_path = base_images.acquire(
+                os.path.join(os.getenv("VM_BASE_IMAGES_PATH"), base_image_name)
+            )
+        try:
+            with span("overlay_placement"):
+                self.image_path = overlays.place(name, ttl_seconds)
+        except Exception:
+            base_images.release(self.base_image_path)
+            raise
+        try:
+            with phase("overlay_create"):
+                create_overlay(
+                    self.base_image_path,
+                    self.image_path,
+                    clone=overlays.can_reflink(self.image_path, self.base_image_path),
+                )
+        except Exception:
+            self._release_storage()
+            raise
 
         self.domain = None
-        logging.info(f"Created vm environment {self.name}")
+        self.booting = False
+        self._interface_cache: list[tuple[str, str | None]] = []
+        self._previous_cpu_time: tuple[float, int] | None = None
+        logger.info(f"Created vm environment {self.name}")
+
+    def _ensure_connection(self) -> libvirt.virConnect:
+        conn = self._conn
+        if conn.isAlive():
+            return conn
+
+        # Domain handles die with their connection, so re-bind by name.
+        conn = self._conn = self.libvirt_pool.get()
+        if self._domain is not None:
+            try:
+                self._domain = conn.lookupByName(self.name)
+            except libvirt.libvirtError as e:
+                # A transient domain vanishes on its own when the guest powers off.
+                if (
+                    not self.transient
+                    or e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN
+                ):
+                    raise
+                logger.info(f"Transient domain {self.name} is gone")
+                self._domain = None
+        logger.info(f"Rebound vm environment {self.name} to a new libvirt connection")
+        return conn
+
+    @property
+    def libvirt_client(self) -> libvirt.virConnect:
+        return self._ensure_connection()
+
+    @property
+    def domain(self) -> libvirt.virDomain | None:
+        if self._domain is not None:
+            self._ensure_connection()
+        return self._domain
+
+    @domain.setter
+    def domain(self, value: libvirt.virDomain | None):
+        self._domain = value
+
+    def _release_storage(self):
+        if self._storage_released:
+            return
+        self._storage_released = True
+        remove_overlay(self.image_path)
+        self.overlays.release(self.image_path)
+        self.base_images.release(self.base_image_path)
 
     def _on_started(self):
-        logging.debug(f"VM {self.name} booted successfully")
+        logger.debug("VM %s booted successfully", self.name)
 
         for internal_port, published_port in zip(
             self.internal_ports, self.published_ports
         ):
-            self.forwarded_ports.append(
-                forward_port(self.ip, internal_port, published_port)
-            )
+            with span("forward_port", internal=internal_port, published=published_port):
+                self.forwarded_ports.append(
+                    forward_port(self.ip, internal_port, published_port)
+                )
 
     def _render_xml(self):
-        required_placeholders = [
-            "{{VM_NAME}}",
-            "{{DISK_IMAGE}}",
-            "{{VM_UUID}}",
-            "{{NETWORK_NAME}}",
-        ]
-
-        xml = self.template
-
-        missing = [ph for ph in required_placeholders if ph not in xml]
-        if missing:
-            logging.error(
-                f"Missing placeholders in XML template for {self.name}: {missing}"
+        template = self.template
+        if isinstance(template, str):
+            try:
+                template = compile_template(template)
+            except TemplateError as e:
+                logger.error(f"Invalid XML template for {self.name}: {e}")
+                raise VMEnvException(str(e))
+        xml = render(template, self.name, self.image_path, self.network_name)
+        if self.placement is None:
+            return xml
+        try:
+            return apply_placement(xml, self.placement.cpus, self.placement.node)
+        except ET.ParseError as e:
+            logger.warning(
+                f"Starting {self.name} unpinned, domain XML is not parseable: {e}"
             )
-            raise VMEnvException(f"XML template is missing placeholders: {missing}")
-        logging.debug(
-            f"All required placeholders are present in the XML template for {self.name}"
-        )
+            return xml
+
+    def _interfaces(self) -> list[tuple[str, str | None]]:
+        if self._interface_cache:
+            return self._interface_cache
+
+        root = ET.fromstring(self.domain.XMLDesc())
+        interfaces = []
+        for interface in root.findall(".//devices/interface"):
+            mac_elem = interface.find("mac")
+            target = interface.find("target")
+            mac = (
+                mac_elem.attrib.get("address", "").lower()
+                if mac_elem is not None
+                else ""
+            )
+            dev = target.attrib.get("dev") if target is not None else None
+            interfaces.append((mac, dev))
 
-        xml = xml.replace("{{VM_NAME}}", self.name)
-        xml = xml.replace("{{DISK_IMAGE}}", self.image_path)
-        xml = xml.replace("{{VM_UUID}}", str(uuid.uuid4()))
-        xml = xml.replace("{{NETWORK_NAME}}", self.network_name)
-        return xml
+        # Target devices are only assigned once the domain is running.
+        if interfaces and all(dev for _, dev in interfaces):
+            self._interface_cache = interfaces
+        return interfaces
 
     def _get_ip(self) -> str | None:
         if not self.domain:
             raise VMEnvException(f"VM domain {self.name} was not created")
 
         try:
-            xml_desc = self.domain.XMLDesc()
-            root = ET.fromstring(xml_desc)
-
-            mac = None
-            for interface in root.findall(".//devices/interface"):
-                mac_elem = interface.find("mac")
-                if mac_elem is not None:
-                    mac = mac_elem.attrib.get("address", "").lower()
-                    break
+            mac = next((mac for mac, _ in self._interfaces() if mac), None)
             if not mac:
                 return None
 
@@ -116,61 +219,92 @@ class VMEnvironment(Environment):
         except Exception as e:
             raise VMEnvException(f"Failed to retrieve IP address via DHCP leases: {e}")
 
-        except Exception as e:
-            raise VMEnvException(f"Failed to retrieve IP address: {e}")
-
-    def _poll_until_booted(self):
-        logging.debug(f"Waiting for VM {self.name} to finish booting...")
+    def _poll_until_booted(self, boot_span: Span | None, timeout: int):
+        logger.debug("Waiting for VM %s to finish booting...", self.name)
 
-        timeout = int(os.getenv("VM_BOOT_TIMEOUT"))
         interval = int(os.getenv("ENV_BOOT_POLL_INTERVAL"))
 
         start = time.time()
-        while time.time() - start < timeout:
-            if self.status() != EnvStatus.BOOTING:
-                logging.debug(f"VM {self.name} has booted with IP.")
+        booted = False
+        # Everything after boot stays under one span so the trace is only
+        # exported once the port forwards or the timeout teardown are done.
+        with enter_span(boot_span):
+            try:
+                with span("boot_polling"):
+                    while time.time() - start < timeout:
+                        if self.status() != EnvStatus.BOOTING:
+                            booted = True
+                            break
+                        time.sleep(interval)
+            finally:
+                self.booting = False
+
+            if booted:
+                logger.debug("VM %s has booted with IP.", self.name)
+                PHASE_SECONDS.observe(time.time() - start, phase="boot_to_lease")
                 self._on_started()
                 return
 
-            time.sleep(interval)
-
-        self.destroy()
-        logging.error(
-            f"VM {self.name} did not finish booting within {timeout} seconds."
-        )
-        raise VMEnvException(
-            f"VM {self.name} did not finish booting within {timeout} seconds."
-        )
+            with span("boot_timeout_destroy"):
+                self.destroy()
+            logger.error(
+                f"VM {self.name} did not finish booting within {timeout} seconds."
+            )
+            raise VMEnvException(
+                f"VM {self.name} did not finish booting within {timeout} seconds."
+            )
 
     def start(self):
         try:
-            xml = self._render_xml()
+            with span("render_xml"):
+                xml = self._render_xml()
         except VMEnvException as e:
-            logging.error(e)
-            remove_overlay(self.image_path)
+            logger.error(e)
+            self._release_storage()
             raise VMEnvException(f"Failed to start VM {self.name}: {e}")
 
         try:
-            self.domain = self.libvirt_client.defineXML(xml)
-            self.domain.create()
+            with phase("domain_define"):
+                if self.transient:
+                    # No persistent config to write now or undefine later.
+                    self.domain = self.libvirt_client.createXML(xml, 0)
+                else:
+                    self.domain = self.libvirt_client.defineXML(xml)
+                    self.domain.create()
         except libvirt.libvirtError as e:
-            logging.error(f"Failed to start VM {self.name}: {e}")
-            remove_overlay(self.image_path)
+            logger.error(f"Failed to start VM {self.name}: {e}")
+            self._release_storage()
             raise VMEnvException(f"Failed to start VM {self.name}: {e}")
 
-        logging.info(f"Created vm domain {self.name}")
+        logger.info(f"Created vm domain {self.name}")
 
-        threading.Thread(target=self._poll_until_booted, daemon=True).start()
+        self.booting = True
+        timeout = int(os.getenv("VM_BOOT_TIMEOUT"))
+        # Opened here so the trace cannot complete before the thread runs;
+        # the copied context records boot polling in the session's trace.
+        boot_span = open_span("vm_boot", timeout=timeout)
+        thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._poll_until_booted, boot_span, timeout),
+            name=f"vm-boot-{self.name}",
+            daemon=True,
+        )
+        try:
+            thread.start()
+        except RuntimeError:
+            self.booting = False
+            with enter_span(boot_span):
+                raise
 
     def restart(self):
         if not self.domain:
-            logging.error(
+            logger.error(
                 f"Tried to restart domain {self.name} but domain was not created"
             )
             raise VMEnvException(f"VM domain {self.name} was not created")
 
         self.domain.reboot()
-        logging.info(f"Restarted vm domain {self.name}")
+        logger.info(f"Restarted vm domain {self.name}")
 
     def status(self) -> EnvStatus:
         if not self.domain:
@@ -195,70 +329,79 @@ class VMEnvironment(Environment):
             libvirt.VIR_DOMAIN_PMSUSPENDED: EnvStatus.PAUSED,
         }
 
-        logging.debug(f"Checking vm {self.name} status: {state}")
+        logger.debug("Checking vm %s status: %s", self.name, state)
         return state_mapping.get(state, EnvStatus.UNKNOWN)
 
+    def usage_from_stats(self, stats: dict) -> dict:
+        # --- CPU (percent of one core, from cpu.time deltas) ---
+        now = time.monotonic()
+        cpu_time = int(stats.get("cpu.time", 0) or 0)
+        cpu = 0.0
+        if self._previous_cpu_time is not None:
+            elapsed_ns = (now - self._previous_cpu_time[0]) * 1_000_000_000
+            if elapsed_ns > 0:
+                cpu = max(0.0, (cpu_time - self._previous_cpu_time[1]) / elapsed_ns)
+        self._previous_cpu_time = (now, cpu_time)
+
+        # --- Memory (bytes) ---
+        rss_kib = stats.get("balloon.rss")
+        if rss_kib is None:
+            rss_kib = stats.get("balloon.current", 0)
+        mem_bytes = int(rss_kib or 0) * 1024
+
+        # --- Network / Block IO (bytes) ---
+        rx_total = tx_total = 0
+        for i in range(int(stats.get("net.count", 0) or 0)):
+            rx_total += int(stats.get(f"net.{i}.rx.bytes", 0) or 0)
+            tx_total += int(stats.get(f"net.{i}.tx.bytes", 0) or 0)
+
+        rd_total = wr_total = 0
+        for i in range(int(stats.get("block.count", 0) or 0)):
+            rd_total += int(stats.get(f"block.{i}.rd.bytes", 0) or 0)
+            wr_total += int(stats.get(f"block.{i}.wr.bytes", 0) or 0)
+
+        return {
+            "cpu": round(cpu * 100.0, 2),
+            "memory": mem_bytes,
+            "network": {"rx": rx_total, "tx": tx_total},
+            "io": {"read": rd_total, "write": wr_total},
+            "vcpus": int(stats.get("vcpu.current", 0) or 0),
+        }
+
     def get_resource_usage(self) -> dict:
         if not getattr(self, "domain", None):
             return {"cpu": 0.0, "memory": 0, "network": {"rx": 0, "tx": 0}}
 
         try:
-            # --- Memory (bytes) ---
-            mem_stats = self.domain.memoryStats() or {}
-            rss_kib = mem_stats.get("rss")
-            actual_kib = mem_stats.get("actual")
-
-            if rss_kib is not None:
-                mem_bytes = int(rss_kib) * 1024
-            elif actual_kib is not None:
-                mem_bytes = int(actual_kib) * 1024
-            else:
-                try:
-                    info = self.domain.info()
-                    mem_bytes = int(info[2]) * 1024
-                except Exception:
-                    mem_bytes = 0
-
-            # --- Network (bytes) ---
-            rx_total = tx_total = 0
-            try:
-                xml_desc = self.domain.XMLDesc()
-                root = ET.fromstring(xml_desc)
-                for target in root.findall(".//devices/interface/target"):
-                    dev = target.attrib.get("dev")
-                    if not dev:
-                        continue
-                    try:
-                        stats = self.domain.interfaceStats(dev)
-                        rx_total += int(stats[0] or 0)
-                        tx_total += int(stats[4] or 0)
-                    except Exception:
-                        continue
-            except Exception:
-                pass
-
-            return {
-                "memory": int(mem_bytes),
-                "network": {"rx": int(rx_total), "tx": int(tx_total)},
-            }
+            records = self.libvirt_client.domainListGetStats([self.domain], VM_STATS)
+            stats = records[0][1] if records else {}
+            return self.usage_from_stats(stats)
 
         except Exception as e:
-            logging.exception(
+            logger.exception(
                 f"Failed to read VM resources for {getattr(self, 'name', 'unknown')}: {e}"
             )
             return {"cpu": 0.0, "memory": 0, "network": {"rx": 0, "tx": 0}}
 
     def destroy(self):
+        for forwarded_port in self.forwarded_ports:
+            forwarded_port.terminate()
+        self.forwarded_ports = []
+
         if not self.domain:
-            logging.warning(
+            logger.warning(
                 f"Tried to destroy domain {self.name} but domain was not created"
             )
+            self._release_storage()
             return
 
-        for forwarded_port in self.forwarded_ports:
-            forwarded_port.terminate()
-
-        self.domain.destroy()
-        self.domain.undefine()
-        remove_overlay(self.image_path)
-        logging.info(f"Removed vm environment {self.name}")
+        try:
+            self.domain.destroy()
+        except libvirt.libvirtError as e:
+            # Gone between the lookup above and this call.
+            if not self.transient or e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+        if not self.transient:
+            self.domain.undefine()
+        self._release_storage()
+        logger.info(f"Removed vm environment {self.name}")
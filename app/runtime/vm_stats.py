@@ -0,0 +1,34 @@
+import logging
+from typing import Dict, Iterable
+
+import libvirt
+
+from app.runtime.vm_env import VM_STATS, VMEnvironment
+
+logger = logging.getLogger(__name__)
+
+
+class VMStatsCollector:
+    def collect(self, envs: Iterable[VMEnvironment]) -> Dict[str, dict]:
+        by_name = {env.name: env for env in envs if env.domain is not None}
+        if not by_name:
+            return {}
+
+        # Domain handles are bound to the connection that looked them up, and
+        # environments are spread over the pool. Asking one pooled connection
+        # for every active domain keeps this to a single RPC per cycle.
+        conn = next(iter(by_name.values())).libvirt_client
+        try:
+            records = conn.getAllDomainStats(
+                VM_STATS, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE
+            )
+        except libvirt.libvirtError as e:
+            logger.warning(f"Bulk VM stats failed, falling back per domain: {e}")
+            return {name: env.get_resource_usage() for name, env in by_name.items()}
+
+        usage = {}
+        for dom, stats in records:
+            env = by_name.get(dom.name())
+            if env is not None:
+                usage[env.name] = env.usage_from_stats(stats)
+        return usage
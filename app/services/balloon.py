@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+import libvirt
+
+from app.runtime import VMEnvironment
+from app.services.registry import ClusterRegistry
+from app.utils.ksm import KsmTuner
+from app.utils.metrics import BALLOON_ADJUSTMENTS, BALLOON_RECLAIMED, KSM_SAVED
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BalloonReport:
+    finished_at: float
+    domains: int
+    shrunk: int
+    grown: int
+    reclaimed_bytes: int
+
+
+def balloon_target(
+    stats: dict, headroom_ratio: float, floor_ratio: float, step_ratio: float
+) -> Optional[int]:
+    current = stats.get("balloon.current")
+    maximum = stats.get("balloon.maximum")
+    usable = stats.get("balloon.usable")
+    # Without the guest driver there is no usable figure to act on.
+    if not current or not maximum or usable is None:
+        return None
+
+    working_set = max(0, current - usable)
+    target = int(working_set * (1 + headroom_ratio))
+    target = min(maximum, max(target, int(maximum * floor_ratio)))
+    step = max(1, int(maximum * step_ratio))
+
+    if target > current:
+        # Grow at once so a busy guest never waits on the next cycle.
+        return min(maximum, max(target, current + step))
+    if current - target >= step // 2:
+        return max(target, current - step)
+    return None
+
+
+class BalloonController:
+    def __init__(
+        self,
+        *,
+        registry: ClusterRegistry,
+        ksm: KsmTuner,
+        enabled: bool,
+        interval_seconds: float,
+        headroom_ratio: float,
+        floor_ratio: float,
+        step_ratio: float,
+    ):
+        self.registry = registry
+        self.ksm = ksm
+        self.enabled = enabled
+        self.interval_seconds = interval_seconds
+        self.headroom_ratio = headroom_ratio
+        self.floor_ratio = floor_ratio
+        self.step_ratio = step_ratio
+
+        self._lock = threading.Lock()
+        self._started = False
+        self.last_report: Optional[BalloonReport] = None
+
+    @classmethod
+    def from_env(cls, *, registry: ClusterRegistry) -> "BalloonController":
+        return cls(
+            registry=registry,
+            ksm=KsmTuner.from_env(),
+            enabled=bool(int(os.getenv("BALLOON_ENABLED", "0"))),
+            interval_seconds=float(os.getenv("BALLOON_INTERVAL_SECONDS", "15")),
+            headroom_ratio=float(os.getenv("BALLOON_HEADROOM_RATIO", "0.25")),
+            floor_ratio=float(os.getenv("BALLOON_FLOOR_RATIO", "0.25")),
+            step_ratio=float(os.getenv("BALLOON_STEP_RATIO", "0.1")),
+        )
+
+    def _vm_environments(self) -> List[VMEnvironment]:
+        return [
+            env
+            for _, (cluster, _, _) in self.registry.items()
+            for env in cluster.environments
+            if isinstance(env, VMEnvironment)
+            and env.domain is not None
+            and not env.booting
+        ]
+
+    def _records(self, envs: List[VMEnvironment]) -> list:
+        by_connection: Dict[int, List[VMEnvironment]] = {}
+        for env in envs:
+            by_connection.setdefault(id(env.libvirt_client), []).append(env)
+
+        records = []
+        for group in by_connection.values():
+            try:
+                records.extend(
+                    group[0].libvirt_client.domainListGetStats(
+                        [env.domain for env in group],
+                        libvirt.VIR_DOMAIN_STATS_BALLOON,
+                    )
+                )
+            except libvirt.libvirtError as e:
+                logger.warning(f"Balloon stats failed for {len(group)} domains: {e}")
+        return records
+
+    def adjust(self) -> BalloonReport:
+        records = self._records(self._vm_environments())
+        shrunk = grown = reclaimed_kib = 0
+        for dom, stats in records:
+            current = stats.get("balloon.current", 0)
+            target = balloon_target(
+                stats, self.headroom_ratio, self.floor_ratio, self.step_ratio
+            )
+            if target is not None and target != current:
+                try:
+                    dom.setMemoryFlags(target, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+                except libvirt.libvirtError as e:
+                    logger.warning(f"Could not resize balloon of {dom.name()}: {e}")
+                else:
+                    direction = "shrink" if target < current else "grow"
+                    BALLOON_ADJUSTMENTS.inc(direction=direction)
+                    logger.debug(
+                        "Balloon %s %s: %s -> %s KiB",
+                        direction,
+                        dom.name(),
+                        current,
+                        target,
+                    )
+                    if target < current:
+                        shrunk += 1
+                    else:
+                        grown += 1
+                    current = target
+            reclaimed_kib += max(0, stats.get("balloon.maximum", 0) - current)
+
+        report = BalloonReport(
+            finished_at=time.time(),
+            domains=len(records),
+            shrunk=shrunk,
+            grown=grown,
+            reclaimed_bytes=reclaimed_kib * 1024,
+        )
+        self.last_report = report
+        BALLOON_RECLAIMED.set(report.reclaimed_bytes)
+        return report
+
+    def report(self) -> Dict[str, Any]:
+        balloon = asdict(self.last_report) if self.last_report else None
+        ksm = self.ksm.stats()
+        if ksm is not None:
+            KSM_SAVED.set(ksm["saved_bytes"])
+        return {
+            "balloon": balloon,
+            "ksm": ksm,
+            "saved_bytes": (balloon or {}).get("reclaimed_bytes", 0)
+            + (ksm or {}).get("saved_bytes", 0),
+        }
+
+    def _loop(self):
+        while True:
+            try:
+                self.adjust()
+            except Exception as e:
+                logger.exception(f"Balloon controller cycle failed: {e}")
+            time.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.ksm.apply()
+        if self.enabled:
+            threading.Thread(
+                target=self._loop, name="balloon-controller", daemon=True
+            ).start()
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import logging
+import os
+import select
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db
+from app.models import Cluster, Environment
+from app.utils.domain_template import TemplateError, compile_template
+from app.utils.resource_limits import ResourceLimits
+from app.utils.domain_tuning import (
+    HostCapabilities,
+    TuningError,
+    apply_limits,
+    apply_profile,
+    enable_ballooning,
+    vcpu_count,
+)
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = "venvmanager_catalog"
+
+
+@dataclass(frozen=True)
+class EnvironmentBlueprint:
+    id: int
+    name: str
+    kind: str
+    ports: Tuple[int, ...]
+    access_info: str
+    image: Optional[str] = None
+    template: Any = None
+    base_image_name: Optional[str] = None
+    vcpus: int = 1
+    limits: ResourceLimits = ResourceLimits()
+    shared: bool = False
+
+
+@dataclass(frozen=True)
+class ClusterBlueprint:
+    id: int
+    name: str
+    environments: Tuple[EnvironmentBlueprint, ...]
+    net_ingress_kbit: Optional[int] = None
+    net_egress_kbit: Optional[int] = None
+
+
+def _compile_environment(
+    env: Environment,
+    capabilities: Optional[HostCapabilities] = None,
+    balloon_stats_seconds: int = 0,
+) -> Optional[EnvironmentBlueprint]:
+    common = dict(
+        id=env.id,
+        name=env.name,
+        ports=tuple(env.ports or ()),
+        access_info=env.access_info,
+        limits=ResourceLimits.from_model(env),
+    )
+    if env.docker:
+        return EnvironmentBlueprint(
+            kind="docker", image=env.docker.image, shared=bool(env.shared), **common
+        )
+    if env.vm:
+        try:
+            # Tuned and compiled once per blueprint; sessions only fill the slots.
+            template = apply_profile(
+                env.vm.template, env.vm.tuning_profile, capabilities
+            )
+            template = apply_limits(template, common["limits"])
+            if balloon_stats_seconds > 0:
+                template = enable_ballooning(template, balloon_stats_seconds)
+            template = compile_template(template)
+        except (TemplateError, TuningError) as e:
+            # Left raw so template errors surface when a session starts.
+            logger.warning(f"Using untuned template for environment {env.id}: {e}")
+            template = env.vm.template
+        return EnvironmentBlueprint(
+            kind="vm",
+            template=template,
+            base_image_name=env.vm.base_image_path.split("/")[-1],
+            vcpus=vcpu_count(env.vm.template),
+            **common,
+        )
+    return None
+
+
+def compile_blueprint(
+    cluster: Cluster,
+    capabilities: Optional[HostCapabilities] = None,
+    balloon_stats_seconds: int = 0,
+) -> ClusterBlueprint:
+    envs = (
+        _compile_environment(e, capabilities, balloon_stats_seconds)
+        for e in cluster.environments
+    )
+    return ClusterBlueprint(
+        id=cluster.id,
+        name=cluster.name,
+        environments=tuple(e for e in envs if e is not None),
+        net_ingress_kbit=cluster.net_ingress_kbit,
+        net_egress_kbit=cluster.net_egress_kbit,
+    )
+
+
+class BlueprintCache:
+    def __init__(
+        self,
+        host_capabilities: Optional[Callable[[], Optional[HostCapabilities]]] = None,
+        balloon_stats_seconds: int = 0,
+    ):
+        self.host_capabilities = host_capabilities
+        self.balloon_stats_seconds = balloon_stats_seconds
+        self._lock = threading.Lock()
+        self._blueprints: Dict[int, ClusterBlueprint] = {}
+        self._clusters_by_env: Dict[int, Set[int]] = {}
+        self._generation = 0
+
+    def _load(self, cluster_id: int) -> Optional[ClusterBlueprint]:
+        cluster = (
+            Cluster.query.options(
+                selectinload(Cluster.environments).selectinload(Environment.docker),
+                selectinload(Cluster.environments).selectinload(Environment.vm),
+            )
+            .filter_by(id=cluster_id)
+            .first()
+        )
+        if cluster is None:
+            return None
+        capabilities = self.host_capabilities() if self.host_capabilities else None
+        return compile_blueprint(cluster, capabilities, self.balloon_stats_seconds)
+
+    def get(self, cluster_id: int) -> Optional[ClusterBlueprint]:
+        with self._lock:
+            blueprint = self._blueprints.get(cluster_id)
+            generation = self._generation
+        if blueprint is not None:
+            return blueprint
+
+        blueprint = self._load(cluster_id)
+        if blueprint is None:
+            return None
+
+        with self._lock:
+            # An invalidation raced with the load; serve it but do not cache.
+            if generation != self._generation:
+                return blueprint
+            self._blueprints[cluster_id] = blueprint
+            for env in blueprint.environments:
+                self._clusters_by_env.setdefault(env.id, set()).add(cluster_id)
+        return blueprint
+
+    def invalidate_cluster(self, cluster_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            self._blueprints.pop(cluster_id, None)
+
+    def invalidate_environment(self, env_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            for cluster_id in self._clusters_by_env.pop(env_id, ()):
+                self._blueprints.pop(cluster_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._blueprints.clear()
+            self._clusters_by_env.clear()
+
+    def on_notification(self, payload: str) -> None:
+        kind, _, ident = (payload or "").partition(":")
+        try:
+            if kind == "cluster":
+                self.invalidate_cluster(int(ident))
+                return
+            if kind == "environment":
+                self.invalidate_environment(int(ident))
+                return
+        except ValueError:
+            pass
+        self.clear()
+
+
+class LocalInvalidationBus:
+    def __init__(self):
+        self._subscribers: List[Callable[[str], None]] = []
+
+    def subscribe(self, callback: Callable[[str], None]) -> None:
+        self._subscribers.append(callback)
+
+    def publish(self, payload: str) -> None:
+        for callback in list(self._subscribers):
+            callback(payload)
+
+    def listen(self, database_url: str) -> None:
+        pass
+
+
+class PostgresInvalidationBus(LocalInvalidationBus):
+    def __init__(self, channel: str = CATALOG_CHANNEL, reconnect_seconds: int = 5):
+        super().__init__()
+        self.channel = channel
+        self.reconnect_seconds = reconnect_seconds
+        self._started = False
+
+    def publish(self, payload: str) -> None:
+        # Delivered by Postgres to listeners only when the transaction commits.
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": self.channel, "payload": payload},
+        )
+
+    def listen(self, database_url: str) -> None:
+        if self._started:
+            return
+        self._started = True
+        dsn = make_url(database_url).set(drivername="postgresql")
+        threading.Thread(
+            target=self._listen_loop,
+            args=(dsn.render_as_string(hide_password=False),),
+            name="catalog-listener",
+            daemon=True,
+        ).start()
+
+    def _dispatch(self, payload: str) -> None:
+        for callback in list(self._subscribers):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.exception(f"Catalog invalidation handler failed: {e}")
+
+    def _listen_loop(self, dsn: str):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                # Anything may have changed while we were not listening.
+                self._dispatch("*")
+                logger.info(f"Listening for catalog changes on {self.channel}")
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+
+            except Exception as e:
+                logger.error(f"Catalog listener connection lost: {e}")
+                time.sleep(self.reconnect_seconds)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+def create_invalidation_bus() -> LocalInvalidationBus:
+    if os.getenv("CATALOG_INVALIDATION", "postgres") == "local":
+        return LocalInvalidationBus()
+    return PostgresInvalidationBus()
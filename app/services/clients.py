@@ -1,11 +1,132 @@
+import logging
 import os
+import threading
+
 import docker
 import libvirt
 
+from app.utils.libvirt_events import ensure_event_loop
+
+logger = logging.getLogger(__name__)
+
+
+class LibvirtPool:
+    def __init__(
+        self,
+        uri: str,
+        size: int,
+        keepalive_interval: int,
+        keepalive_count: int,
+    ):
+        self.uri = uri
+        self.size = max(1, size)
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._connections: list[libvirt.virConnect | None] = [None] * self.size
+        self._next = 0
+
+    def _open(self) -> libvirt.virConnect:
+        ensure_event_loop()
+        conn = libvirt.open(self.uri)
+        if self.keepalive_interval > 0:
+            conn.setKeepAlive(self.keepalive_interval, self.keepalive_count)
+        logger.info(f"Opened libvirt connection to {self.uri}")
+        return conn
+
+    def get(self) -> libvirt.virConnect:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sockets inherited from the parent process must not be shared.
+                self._pid = os.getpid()
+                self._connections = [None] * self.size
+
+            i = self._next
+            self._next = (self._next + 1) % self.size
+
+            conn = self._connections[i]
+            if conn is not None and conn.isAlive():
+                return conn
+            if conn is not None:
+                logger.warning(f"libvirt connection {i} to {self.uri} lost, reopening")
+                try:
+                    conn.close()
+                except libvirt.libvirtError:
+                    pass
+
+            conn = self._connections[i] = self._open()
+            return conn
+
+
+class ClientProvider:
+    def __init__(
+        self,
+        *,
+        libvirt_uri: str,
+        libvirt_pool_size: int,
+        libvirt_keepalive_interval: int,
+        libvirt_keepalive_count: int,
+        docker_pool_size: int,
+    ):
+        self.libvirt_uri = libvirt_uri
+        self.libvirt_pool_size = libvirt_pool_size
+        self.libvirt_keepalive_interval = libvirt_keepalive_interval
+        self.libvirt_keepalive_count = libvirt_keepalive_count
+        self.docker_pool_size = docker_pool_size
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._docker = None
+        self._libvirt_pool = None
+
+    @classmethod
+    def from_env(cls) -> "ClientProvider":
+        return cls(
+            libvirt_uri=os.getenv("LIBVIRT_CLIENT"),
+            libvirt_pool_size=int(os.getenv("LIBVIRT_POOL_SIZE", "4")),
+            libvirt_keepalive_interval=int(
+                os.getenv("LIBVIRT_KEEPALIVE_INTERVAL", "5")
+            ),
+            libvirt_keepalive_count=int(os.getenv("LIBVIRT_KEEPALIVE_COUNT", "3")),
+            docker_pool_size=int(os.getenv("DOCKER_POOL_SIZE", "32")),
+        )
+
+    def _reset_after_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._docker = None
+
+    def docker(self) -> docker.DockerClient:
+        with self._lock:
+            self._reset_after_fork()
+            if self._docker is None:
+                self._docker = docker.from_env(max_pool_size=self.docker_pool_size)
+            return self._docker
+
+    def libvirt_pool(self) -> LibvirtPool:
+        with self._lock:
+            if self._libvirt_pool is None:
+                self._libvirt_pool = LibvirtPool(
+                    self.libvirt_uri,
+                    size=self.libvirt_pool_size,
+                    keepalive_interval=self.libvirt_keepalive_interval,
+                    keepalive_count=self.libvirt_keepalive_count,
+                )
+            return self._libvirt_pool
+
+    def libvirt(self) -> libvirt.virConnect:
+        return self.libvirt_pool().get()
+
 
-def create_docker_client():
-    return docker.from_env()
+_provider: ClientProvider | None = None
+_provider_lock = threading.Lock()
 
 
-def create_libvirt_client():
-    return libvirt.open(os.getenv("LIBVIRT_CLIENT"))
+def get_clients() -> ClientProvider:
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = ClientProvider.from_env()
+        return _provider
@@ -1,17 +1,32 @@
 from __future__ import annotations
 
+import logging
+import math
 import os
 import threading
 import time
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any, Dict, List
-import psutil
 
-from app.models import Cluster as ClusterModel
 from app.runtime import Cluster, DockerEnvironment, VMEnvironment
+from app.services.blueprint_cache import BlueprintCache, ClusterBlueprint
+from app.services.clients import ClientProvider
+from app.services.cpu_placement import CpuPlacer
+from app.services.images import ImageManager
+from app.utils.base_image_cache import BaseImageCache
+from app.utils.overlay_placement import OverlayPlacer
 from app.services.ports import PortPool
 from app.services.registry import ClusterRegistry
+from app.services.sampler import ResourceSampler
+from app.services.shared_envs import SharedEnvironmentPool
+from app.utils.metrics import instrumented
+from app.utils.tracing import TRACER, phase, span
+
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SCOPES = ("host", "session", "environment")
 
 
 class NotFoundError(RuntimeError):
@@ -34,23 +49,46 @@ class ClusterService:
         *,
         registry: ClusterRegistry,
         port_pool: PortPool,
-        docker_client,
-        libvirt_client,
+        sampler: ResourceSampler,
+        blueprints: BlueprintCache,
+        clients: ClientProvider,
+        images: ImageManager,
+        base_images: BaseImageCache,
+        overlays: OverlayPlacer,
+        cpu_placer: CpuPlacer,
+        shared_envs: SharedEnvironmentPool,
     ):
         self.registry = registry
         self.port_pool = port_pool
-        self.docker_client = docker_client
-        self.libvirt_client = libvirt_client
+        self.sampler = sampler
+        self.blueprints = blueprints
+        self.clients = clients
+        self.images = images
+        self.base_images = base_images
+        self.overlays = overlays
+        self.cpu_placer = cpu_placer
+        self.shared_envs = shared_envs
 
         self.ttl_seconds = int(os.getenv("CLUSTER_TTL_SECONDS"))
         self._ttl_check_interval = int(os.getenv("CLUSTER_TTL_POLL_SECONDS"))
-        threading.Thread(target=self._cleanup_loop, daemon=True).start()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(
+            target=self._cleanup_loop, name="ttl-cleanup", daemon=True
+        ).start()
 
     def _cleanup_loop(self):
         while True:
             for session_id in self.registry.expired_sessions():
                 try:
-                    self.stop(session_id)
+                    with TRACER.trace(session_id, "ttl_expiry"):
+                        self.stop(session_id)
                 except NotFoundError:
                     pass
             time.sleep(self._ttl_check_interval)
@@ -62,61 +100,143 @@ class ClusterService:
         now = now or datetime.now()
         return max(0, int((expires_at - now).total_seconds()))
 
+    @instrumented("run")
     def run(
-        self, cluster_db_id: int, variables: dict[str, str], session_id: str
+        self,
+        cluster_db_id: int,
+        variables: dict[str, str],
+        session_id: str,
+        ttl_seconds: int | None = None,
     ) -> RunResult:
         if not session_id:
             raise ValidationError("session_id is required")
+        if ttl_seconds is not None and not 0 < ttl_seconds <= self.ttl_seconds:
+            raise ValidationError(
+                f"ttl_seconds must be between 1 and {self.ttl_seconds}"
+            )
 
-        cluster_db = ClusterModel.query.filter_by(id=cluster_db_id).first()
-        if not cluster_db:
-            raise NotFoundError("Cluster not found")
+        with TRACER.trace(session_id, "run", cluster_id=cluster_db_id):
+            return self._run(
+                cluster_db_id, variables, session_id, ttl_seconds or self.ttl_seconds
+            )
 
-        envs_db = cluster_db.environments
+    def _run(
+        self,
+        cluster_db_id: int,
+        variables: dict[str, str],
+        session_id: str,
+        ttl_seconds: int,
+    ) -> RunResult:
+        with span("blueprint_lookup"):
+            blueprint = self.blueprints.get(cluster_db_id)
+            if not blueprint:
+                raise NotFoundError("Cluster not found")
 
         cluster = Cluster(
-            name=f"{session_id}-{cluster_db.name}",
+            docker_client=self.clients.docker(),
+            name=f"{session_id}-{blueprint.name}",
             cluster_id=int(session_id),
-            cluster_db_id=cluster_db.id,
+            cluster_db_id=blueprint.id,
+            cluster_db_name=blueprint.name,
+            net_ingress_kbit=blueprint.net_ingress_kbit,
+            net_egress_kbit=blueprint.net_egress_kbit,
         )
 
-        for env_db in envs_db:
-            internal_ports = list(env_db.ports or [])
+        allocated_ports: List[int] = []
+        try:
+            self._build(
+                blueprint, cluster, variables, session_id, ttl_seconds, allocated_ports
+            )
+        except Exception:
+            self._rollback(session_id, cluster, allocated_ports)
+            raise
+
+        self.registry.set(session_id, cluster, ttl_seconds=ttl_seconds)
+        cluster.start()
+
+        return RunResult(status="started", access_info=cluster.get_access_info())
+
+    @staticmethod
+    def _cpu_demand(env_bp) -> int:
+        if env_bp.shared:
+            return 0
+        if env_bp.kind == "vm":
+            return env_bp.vcpus
+        # A cpuset narrower than the CPU quota would cap the container below it.
+        return math.ceil(env_bp.limits.cpu_limit or 1)
+
+    def _build(
+        self,
+        blueprint: ClusterBlueprint,
+        cluster: Cluster,
+        variables: dict[str, str],
+        session_id: str,
+        ttl_seconds: int,
+        allocated_ports: List[int],
+    ) -> None:
+        demands = [self._cpu_demand(env_bp) for env_bp in blueprint.environments]
+        placements = self.cpu_placer.allocate(session_id, demands)
+        for env_bp, placement in zip(blueprint.environments, placements):
+            if env_bp.shared:
+                cluster.add_environment(
+                    self.shared_envs.acquire(env_bp, cluster, session_id)
+                )
+                continue
+
+            internal_ports = list(env_bp.ports)
             published_ports = self.port_pool.allocate_many(len(internal_ports))
+            allocated_ports.extend(published_ports)
 
-            if env_db.docker:
+            if env_bp.kind == "docker":
+                with span("image_ready", image=env_bp.image):
+                    self.images.ensure(env_bp.image)
+                self.images.mark_used(env_bp.image)
                 cluster.add_environment(
                     DockerEnvironment(
-                        docker_client=self.docker_client,
-                        name=f"{session_id}-{env_db.name}",
-                        display_name=env_db.name,
-                        image=env_db.docker.image,
+                        docker_client=self.clients.docker(),
+                        name=f"{session_id}-{env_bp.name}",
+                        display_name=env_bp.name,
+                        image=env_bp.image,
                         internal_ports=internal_ports,
                         published_ports=published_ports,
                         variables=variables,
-                        access_info=env_db.access_info,
+                        access_info=env_bp.access_info,
                         docker_network=cluster.docker_network,
+                        placement=placement,
+                        limits=env_bp.limits,
                     )
                 )
-            elif env_db.vm:
+            elif env_bp.kind == "vm":
                 cluster.add_environment(
                     VMEnvironment(
-                        libvirt_client=self.libvirt_client,
-                        name=f"{session_id}-{env_db.name}",
-                        display_name=env_db.name,
-                        template=env_db.vm.template,
-                        base_image_name=env_db.vm.base_image_path.split("/")[-1],
+                        libvirt_pool=self.clients.libvirt_pool(),
+                        base_images=self.base_images,
+                        overlays=self.overlays,
+                        name=f"{session_id}-{env_bp.name}",
+                        display_name=env_bp.name,
+                        template=env_bp.template,
+                        base_image_name=env_bp.base_image_name,
                         internal_ports=internal_ports,
                         published_ports=published_ports,
-                        access_info=env_db.access_info,
+                        access_info=env_bp.access_info,
                         network_name=cluster.network_name,
+                        ttl_seconds=ttl_seconds,
+                        placement=placement,
                     )
                 )
 
-        self.registry.set(session_id, cluster, ttl_seconds=self.ttl_seconds)
-        cluster.start()
-
-        return RunResult(status="started", access_info=cluster.get_access_info())
+    def _rollback(
+        self, session_id: str, cluster: Cluster, allocated_ports: List[int]
+    ) -> None:
+        # Nothing is registered yet, so the TTL reaper would never see this.
+        logger.warning(f"Rolling back session {session_id} after a failed build")
+        self.port_pool.release_many(allocated_ports)
+        self.cpu_placer.release(session_id)
+        with span("rollback"):
+            try:
+                cluster.destroy()
+            except Exception as e:
+                logger.error(f"Failed to tear down cluster {cluster.name}: {e}")
 
     def status(self, session_id: str) -> Dict[str, Any]:
         if not session_id:
@@ -137,6 +257,7 @@ class ClusterService:
             "statuses": result,
         }
 
+    @instrumented("extend")
     def extend_ttl(self, session_id: str) -> None:
         if not session_id:
             raise ValidationError("session_id is required")
@@ -146,6 +267,9 @@ class ClusterService:
             raise NotFoundError("Cluster not found")
 
         cluster, created_at, expires_at = entry
+        deadline = self.overlays.deadline(
+            getattr(env, "image_path", None) for env in cluster.environments
+        )
 
         allow_extend_after = int(os.getenv("CLUSTER_TTL_ALLOW_EXTEND_TIME_SECONDS"))
         extend_by = int(os.getenv("CLUSTER_TTL_EXTEND_SECONDS"))
@@ -163,6 +287,15 @@ class ClusterService:
                     f"try again in {allow_extend_after - elapsed}s"
                 )
 
+        if (
+            deadline is not None
+            and expires_at + timedelta(seconds=extend_by) > deadline
+        ):
+            raise ValidationError(
+                "TTL cannot be extended: this session's storage is RAM-backed "
+                f"and expires at {deadline.isoformat(timespec='seconds')}"
+            )
+
         self.registry.extend_ttl(session_id, extend_by)
 
     def access_info(self, session_id: str) -> Dict[str, Any]:
@@ -175,6 +308,7 @@ class ClusterService:
 
         return {"access_info": cluster.get_access_info()}
 
+    @instrumented("restart")
     def restart(self, session_id: str) -> Dict[str, Any]:
         if not session_id:
             raise ValidationError("session_id is required")
@@ -186,10 +320,15 @@ class ClusterService:
         cluster.restart()
         return {"status": "stopped"}
 
+    @instrumented("stop")
     def stop(self, session_id: str) -> Dict[str, Any]:
         if not session_id:
             raise ValidationError("session_id is required")
 
+        with TRACER.trace(session_id, "stop"):
+            return self._stop(session_id)
+
+    def _stop(self, session_id: str) -> Dict[str, Any]:
         cluster = self.registry.pop(session_id)
         if not cluster:
             raise NotFoundError("Cluster is not running")
@@ -198,75 +337,79 @@ class ClusterService:
         for env in cluster.environments:
             used_ports.extend(list(getattr(env, "published_ports", []) or []))
         self.port_pool.release_many(used_ports)
+        self.cpu_placer.release(session_id)
 
-        cluster.destroy()
+        with phase("teardown"):
+            cluster.destroy()
         return {"status": "stopped"}
 
     def running_clusters(self) -> List[Dict[str, Any]]:
         result = []
         for session_id, (cluster, _, _) in self.registry.items():
-            cluster_id = cluster.db_id
-            cluster_db = ClusterModel.query.filter_by(id=cluster_id).first()
-            if not cluster_db:
-                continue
-
             result.append(
                 {
                     "session_id": session_id,
-                    "cluster_name": cluster_db.name,
-                    "cluster_id": cluster_id,
+                    "cluster_name": cluster.db_name,
+                    "cluster_id": cluster.db_id,
                 }
             )
         return result
 
-    def resources_summary(self) -> Dict[str, Any]:
-        host_cpu_percent = psutil.cpu_percent(interval=0.1)
-        vm = psutil.virtual_memory()
-        net = psutil.net_io_counters()
-
-        overall = {"cpu": host_cpu_percent, "memory": 0, "network": {"rx": 0, "tx": 0}}
-        clusters_list = []
-
-        now = datetime.now()
+    def session_trace(self, session_id: str) -> Dict[str, Any]:
+        if not session_id:
+            raise ValidationError("session_id is required")
 
-        for session_id, (cluster, _, expires_at) in self.registry.items():
-            try:
-                res = cluster.get_resource_usage()
-                total = res.get("total", {})
-
-                cluster_id = cluster.db_id
-                cluster_db = ClusterModel.query.filter_by(id=cluster_id).first()
-
-                clusters_list.append(
-                    {
-                        "session_id": str(session_id),
-                        "cluster_id": str(cluster_id),
-                        "cluster_name": cluster_db.name if cluster_db else None,
-                        "ttl_remaining_seconds": self._ttl_remaining_seconds(
-                            expires_at, now=now
-                        ),
-                        "resources": total,
-                    }
-                )
+        traces = TRACER.get(session_id)
+        if not traces:
+            raise NotFoundError("No traces recorded for session")
+        return {"session_id": session_id, "traces": traces}
 
-                overall["memory"] += int(total.get("memory", 0) or 0)
-                overall["network"]["rx"] += int(
-                    total.get("network", {}).get("rx", 0) or 0
-                )
-                overall["network"]["tx"] += int(
-                    total.get("network", {}).get("tx", 0) or 0
-                )
-            except Exception as e:
-                print(f"Failed to read resources for cluster {session_id}: {e}")
-                continue
+    def resources_summary(self) -> Dict[str, Any]:
+        snapshot = self.sampler.snapshot
+        summary = snapshot.to_summary()
+        summary["storage"] = self.overlays.usage()
+        summary["numa"] = self.cpu_placer.usage()
+        sampled = dict(snapshot.shared)
+        shared = self.shared_envs.usage()
+        for entry in shared:
+            usage = sampled.get(entry["name"])
+            entry["usage"] = usage.as_dict() if usage is not None else None
+        summary["shared"] = shared
+        return summary
+
+    def resources_history(
+        self,
+        scope: str,
+        key: str | None,
+        metric: str | None,
+        start: float,
+        end: float,
+        agg: str = "avg",
+        step: int | None = None,
+    ) -> Dict[str, Any]:
+        history = self.sampler.history
+        if history is None:
+            raise NotFoundError("Resource history is disabled")
+        if scope not in HISTORY_SCOPES:
+            raise ValidationError(f"scope must be one of: {', '.join(HISTORY_SCOPES)}")
+        if scope == "host":
+            key = "host"
+
+        if not key or not metric:
+            series = [
+                {"key": k, "metric": m}
+                for _, k, m in history.keys(scope)
+                if not key or k == key
+            ]
+            return {"scope": scope, "series": series}
+
+        try:
+            result = history.query(
+                (scope, key, metric), start=start, end=end, agg=agg, step=step
+            )
+        except ValueError as e:
+            raise ValidationError(str(e))
+        if result is None:
+            raise NotFoundError(f"No history for {scope} {key} {metric}")
 
-        return {
-            "host": {
-                "cpu_percent": host_cpu_percent,
-                "memory_percent": float(vm.percent),
-                "memory_total": int(vm.total),
-                "network": {"rx": int(net.bytes_recv), "tx": int(net.bytes_sent)},
-            },
-            "overall": overall,
-            "clusters": clusters_list,
-        }
+        return {"scope": scope, "key": key, "metric": metric, **result}
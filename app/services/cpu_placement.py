@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from app.utils.host_topology import HostTopology, format_cpulist, parse_cpulist
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CpuAssignment:
+    node: int
+    cpus: tuple[int, ...]
+
+    @property
+    def cpuset(self) -> str:
+        return format_cpulist(self.cpus)
+
+    @property
+    def mems(self) -> str:
+        return str(self.node)
+
+
+class CpuPlacer:
+    def __init__(
+        self,
+        topology: HostTopology,
+        *,
+        enabled: bool,
+        reserved_cpus: Iterable[int] = (),
+        max_share: int = 1,
+    ):
+        self.topology = topology
+        self.enabled = enabled
+        self.max_share = max(1, max_share)
+
+        reserved = set(reserved_cpus)
+        self._cpus: Dict[int, tuple[int, ...]] = {
+            node.id: tuple(c for c in node.cpus if c not in reserved)
+            for node in topology.nodes
+        }
+        self._lock = threading.Lock()
+        self._load: Dict[int, int] = {
+            c: 0 for cpus in self._cpus.values() for c in cpus
+        }
+        self._sessions: Dict[str, List[Optional[CpuAssignment]]] = {}
+
+    @classmethod
+    def from_env(cls) -> "CpuPlacer":
+        enabled = bool(int(os.getenv("CPU_PINNING", "0")))
+        return cls(
+            HostTopology.from_sysfs() if enabled else HostTopology(nodes=()),
+            enabled=enabled,
+            reserved_cpus=parse_cpulist(os.getenv("CPU_RESERVED", "")),
+            max_share=int(os.getenv("CPU_MAX_SHARE", "4")),
+        )
+
+    def _headroom(self, node_id: int) -> int:
+        return sum(self.max_share - self._load[c] for c in self._cpus[node_id])
+
+    def allocate(
+        self, session_id: str, demands: List[int]
+    ) -> List[Optional[CpuAssignment]]:
+        if not self.enabled or not demands:
+            return [None] * len(demands)
+
+        total = sum(demands)
+        with self._lock:
+            # Whole sessions stay on one node so their traffic and memory
+            # never cross the interconnect.
+            fitting = [
+                node_id
+                for node_id, cpus in self._cpus.items()
+                if max(demands) <= len(cpus) and self._headroom(node_id) >= total
+            ]
+            if not fitting:
+                logger.warning(
+                    f"No NUMA node can host session {session_id} ({total} CPUs), "
+                    f"leaving it unpinned"
+                )
+                return [None] * len(demands)
+
+            node_id = max(fitting, key=lambda n: (self._headroom(n), -n))
+            assignments = []
+            for demand in demands:
+                cpus = sorted(
+                    (c for c in self._cpus[node_id] if self._load[c] < self.max_share),
+                    key=lambda c: (self._load[c], c),
+                )[:demand]
+                for c in cpus:
+                    self._load[c] += 1
+                assignments.append(
+                    CpuAssignment(node=node_id, cpus=tuple(sorted(cpus)))
+                )
+            self._sessions[session_id] = assignments
+
+        logger.debug("Placed session %s on NUMA node %s", session_id, node_id)
+        return assignments
+
+    def release(self, session_id: str) -> None:
+        with self._lock:
+            for assignment in self._sessions.pop(session_id, []):
+                if assignment is None:
+                    continue
+                for c in assignment.cpus:
+                    self._load[c] = max(0, self._load[c] - 1)
+
+    def usage(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "node": node_id,
+                    "cpus": len(cpus),
+                    "assigned": sum(self._load[c] for c in cpus),
+                    "capacity": len(cpus) * self.max_share,
+                }
+                for node_id, cpus in self._cpus.items()
+            ]
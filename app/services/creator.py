@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import logging
 from dataclasses import dataclass
 from sqlalchemy.exc import IntegrityError
 
@@ -10,11 +11,24 @@ from app.models import (
     DockerEnvironment as DockerEnvModel,
     VMEnvironment as VMEnvModel,
 )
+from app.services.blueprint_cache import LocalInvalidationBus
+from app.services.images import ImageManager
 from app.services.repository import (
     ClusterRepository,
     EnvironmentRepository,
     ClusterEnvironmentRepository,
 )
+from app.utils.domain_template import TemplateError, compile_template
+from app.utils.domain_tuning import (
+    NO_TUNING,
+    TuningError,
+    apply_limits,
+    apply_profile,
+)
+from app.utils.resource_limits import LimitsError, ResourceLimits
+
+
+logger = logging.getLogger(__name__)
 
 
 class ValidationError(RuntimeError):
@@ -35,6 +49,8 @@ class CreateDockerEnvCmd:
     image: str
     ports: list[int]
     access_info: str
+    limits: ResourceLimits = ResourceLimits()
+    shared: bool = False
 
 
 @dataclass(frozen=True)
@@ -44,12 +60,16 @@ class CreateVMEnvCmd:
     base_image_path: str
     ports: list[int]
     access_info: str
+    tuning_profile: str = NO_TUNING
+    limits: ResourceLimits = ResourceLimits()
 
 
 @dataclass(frozen=True)
 class CreateClusterCmd:
     name: str
     environment_ids: list[int]
+    net_ingress_kbit: int | None = None
+    net_egress_kbit: int | None = None
 
 
 class CreatorService:
@@ -59,10 +79,14 @@ class CreatorService:
         clusters: ClusterRepository,
         envs: EnvironmentRepository,
         links: ClusterEnvironmentRepository,
+        notifier: LocalInvalidationBus,
+        images: ImageManager,
     ):
         self.clusters = clusters
         self.envs = envs
         self.links = links
+        self.notifier = notifier
+        self.images = images
 
     def create_docker_env(self, cmd: CreateDockerEnvCmd) -> Environment:
         name = (cmd.name or "").strip()
@@ -70,22 +94,34 @@ class CreatorService:
             raise ValidationError("Environment name is required.")
         if not cmd.image:
             raise ValidationError("Docker image is required.")
+        try:
+            cmd.limits.validate()
+        except LimitsError as e:
+            raise ValidationError(str(e))
 
         env = Environment(
             name=name.replace(" ", "-"),
             ports=list(cmd.ports or []),
             access_info=cmd.access_info,
+            shared=cmd.shared,
+            **cmd.limits.as_dict(),
         )
         env.docker = DockerEnvModel(image=cmd.image)
 
         try:
             self.envs.add(env)
             db.session.commit()
-            return env
         except Exception:
             db.session.rollback()
             raise
 
+        try:
+            self.images.prefetch([cmd.image])
+        except Exception as e:
+            # The environment exists; the image is retried by the next cycle.
+            logger.warning(f"Could not schedule prefetch of {cmd.image}: {e}")
+        return env
+
     def create_vm_env(self, cmd: CreateVMEnvCmd) -> Environment:
         name = (cmd.name or "").strip()
         if not name:
@@ -94,13 +130,24 @@ class CreatorService:
             raise ValidationError("VM template is required.")
         if not cmd.base_image_path:
             raise ValidationError("Base image path is required.")
+        try:
+            cmd.limits.validate()
+            template = apply_profile(cmd.template, cmd.tuning_profile, None)
+            compile_template(apply_limits(template, cmd.limits))
+        except (TemplateError, TuningError, LimitsError) as e:
+            raise ValidationError(str(e))
 
         env = Environment(
             name=name.replace(" ", "-"),
             ports=list(cmd.ports or []),
             access_info=cmd.access_info,
+            **cmd.limits.as_dict(),
+        )
+        env.vm = VMEnvModel(
+            template=cmd.template,
+            base_image_path=cmd.base_image_path,
+            tuning_profile=cmd.tuning_profile,
         )
-        env.vm = VMEnvModel(template=cmd.template, base_image_path=cmd.base_image_path)
 
         try:
             self.envs.add(env)
@@ -117,7 +164,15 @@ class CreatorService:
         if self.clusters.get_by_name(name):
             raise AlreadyExistsError(f"Cluster named '{name}' already exists.")
 
-        cluster = Cluster(name=name)
+        for value in (cmd.net_ingress_kbit, cmd.net_egress_kbit):
+            if value is not None and value <= 0:
+                raise ValidationError("Bandwidth limits must be positive.")
+
+        cluster = Cluster(
+            name=name,
+            net_ingress_kbit=cmd.net_ingress_kbit,
+            net_egress_kbit=cmd.net_egress_kbit,
+        )
         try:
             self.clusters.add(cluster)
             db.session.flush()
@@ -132,6 +187,7 @@ class CreatorService:
 
                 self.links.add_links(cluster_id=cluster.id, env_ids=found_ids)
 
+            self.notifier.publish(f"cluster:{cluster.id}")
             db.session.commit()
             return cluster
         except Exception:
@@ -144,6 +200,7 @@ class CreatorService:
             raise NotFoundError("Environment not found")
 
         try:
+            self.notifier.publish(f"environment:{env.id}")
             self.envs.delete(env)
             db.session.commit()
         except IntegrityError as e:
@@ -156,6 +213,7 @@ class CreatorService:
             raise NotFoundError("Cluster not found")
 
         try:
+            self.notifier.publish(f"cluster:{cluster.id}")
             self.clusters.delete(cluster)
             db.session.commit()
         except IntegrityError as e:
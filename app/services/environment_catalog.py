@@ -1,32 +1,166 @@
 from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
 import xml.etree.ElementTree as ET
 
+import libvirt
+
+from app.services.clients import ClientProvider
+
+logger = logging.getLogger(__name__)
+
+DOCKER = "docker"
+VM = "vm"
+
+DOCKER_IMAGE_ACTIONS = {"pull", "tag", "untag", "delete", "import", "load"}
+LIBVIRT_CATALOG_EVENTS = {
+    libvirt.VIR_DOMAIN_EVENT_DEFINED,
+    libvirt.VIR_DOMAIN_EVENT_UNDEFINED,
+    libvirt.VIR_DOMAIN_EVENT_STARTED,
+    libvirt.VIR_DOMAIN_EVENT_STOPPED,
+}
+EVENT_RETRY_SECONDS = 5
+
 
 class EnvironmentCatalog:
-    def __init__(self, *, docker_client, libvirt_client):
-        self.docker_client = docker_client
-        self.libvirt_client = libvirt_client
+    def __init__(self, *, clients: ClientProvider, ttl_seconds: float):
+        self.clients = clients
+        self.ttl_seconds = ttl_seconds
 
-    def list_docker_image_tags(self) -> list[str]:
-        images = self.docker_client.images.list()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._entries: dict[str, tuple[float, object]] = {}
+        self._dirty: set[str] = set()
+        self._pid = None
+        self._watched_conn: libvirt.virConnect | None = None
+
+    @classmethod
+    def from_env(cls, clients: ClientProvider) -> "EnvironmentCatalog":
+        return cls(
+            clients=clients,
+            ttl_seconds=float(os.getenv("CATALOG_TTL_SECONDS", "60")),
+        )
+
+    def _load_docker_image_tags(self) -> list[str]:
+        images = self.clients.docker().images.list()
         tags: list[str] = []
         for img in images:
             for tag in getattr(img, "tags", []) or []:
                 tags.append(tag)
         return sorted(set(tags))
 
-    def list_vm_images(self) -> dict[str, str]:
+    def _load_vm_images(self) -> dict[str, str]:
         out: dict[str, str] = {}
-        for name in self.libvirt_client.listDefinedDomains():
-            dom = self.libvirt_client.lookupByName(name)
-            xml = dom.XMLDesc()
-            tree = ET.fromstring(xml)
+        conn = self.clients.libvirt()
+        for dom in conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE):
+            tree = ET.fromstring(dom.XMLDesc())
 
             for disk in tree.findall("./devices/disk"):
                 if disk.get("device") != "disk":
                     continue
                 source = disk.find("source")
                 if source is not None and "file" in source.attrib:
-                    out[name] = source.get("file")
+                    out[dom.name()] = source.get("file")
                     break
         return out
+
+    def _loaders(self):
+        return {DOCKER: self._load_docker_image_tags, VM: self._load_vm_images}
+
+    def _refresh(self, kind: str):
+        with self._lock:
+            self._dirty.discard(kind)
+        value = self._loaders()[kind]()
+        with self._lock:
+            self._entries[kind] = (time.monotonic(), value)
+        logger.debug("Refreshed %s catalog", kind)
+        return value
+
+    def _get(self, kind: str):
+        self.start()
+        with self._lock:
+            entry = self._entries.get(kind)
+        if entry is None:
+            return self._refresh(kind)
+        # Stale entries are served while the refresher catches up.
+        if kind in self._dirty or time.monotonic() - entry[0] > self.ttl_seconds:
+            self._wake.set()
+        return entry[1]
+
+    def list_docker_image_tags(self) -> list[str]:
+        return self._get(DOCKER)
+
+    def list_vm_images(self) -> dict[str, str]:
+        return self._get(VM)
+
+    def invalidate(self, kind: str) -> None:
+        with self._lock:
+            self._dirty.add(kind)
+        self._wake.set()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self._watch_libvirt()
+            except libvirt.libvirtError as e:
+                logger.warning(f"Could not watch libvirt domain events: {e}")
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    kind
+                    for kind, (loaded_at, _) in self._entries.items()
+                    if kind in self._dirty or now - loaded_at >= self.ttl_seconds
+                ]
+            for kind in due:
+                try:
+                    self._refresh(kind)
+                except Exception as e:
+                    logger.error(f"Failed to refresh {kind} catalog: {e}")
+            self._wake.wait(self.ttl_seconds)
+            self._wake.clear()
+
+    def _watch_docker(self):
+        while True:
+            try:
+                for event in self.clients.docker().events(
+                    decode=True, filters={"type": "image"}
+                ):
+                    if event.get("Action") in DOCKER_IMAGE_ACTIONS:
+                        self.invalidate(DOCKER)
+            except Exception as e:
+                logger.warning(f"Docker event stream ended: {e}")
+            # Events may have been missed while disconnected.
+            self.invalidate(DOCKER)
+            time.sleep(EVENT_RETRY_SECONDS)
+
+    def _watch_libvirt(self):
+        conn = self._watched_conn
+        if conn is not None and conn.isAlive():
+            return
+        conn = self.clients.libvirt()
+        conn.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_lifecycle, None
+        )
+        self._watched_conn = conn
+        # Anything defined before the callback was registered went unseen.
+        self.invalidate(VM)
+
+    def _on_lifecycle(self, conn, dom, event, detail, opaque):
+        if event in LIBVIRT_CATALOG_EVENTS:
+            self.invalidate(VM)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._watched_conn = None
+        threading.Thread(
+            target=self._refresh_loop, name="catalog-refresh", daemon=True
+        ).start()
+        threading.Thread(
+            target=self._watch_docker, name="catalog-docker-events", daemon=True
+        ).start()
@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import IO, Any, Iterator, List, Optional
+
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db
+from app.models import (
+    Cluster,
+    ClusterEnvironment,
+    DockerEnvironment as DockerEnvModel,
+    Environment,
+    VMEnvironment as VMEnvModel,
+)
+from app.services.blueprint_cache import LocalInvalidationBus
+from app.services.creator import ValidationError
+from app.services.images import ImageManager
+from app.services.repository import ClusterRepository
+from app.utils.domain_template import TemplateError, compile_template
+from app.utils.domain_tuning import (
+    NO_TUNING,
+    TuningError,
+    apply_limits,
+    apply_profile,
+)
+from app.utils.resource_limits import LimitsError, ResourceLimits
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+EXPORT_PAGE_SIZE = 200
+
+
+def iter_documents(stream: IO[str], read_size: int = READ_SIZE) -> Iterator[Any]:
+    # Accepts one object, a top-level array, or concatenated/NDJSON objects,
+    # holding at most one document plus one read in memory.
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    in_array = False
+    eof = False
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+            pos += 1
+        if pos < len(buf) and not in_array and buf[pos] == "[":
+            in_array = True
+            pos += 1
+            continue
+        if pos < len(buf) and in_array and buf[pos] == "]":
+            in_array = False
+            pos += 1
+            continue
+
+        if pos < len(buf):
+            try:
+                doc, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                if end < len(buf) or eof:
+                    yield doc
+                    pos = end
+                    continue
+                # A number may continue in the next chunk.
+
+        if eof:
+            return
+        chunk = stream.read(read_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+@dataclass(frozen=True)
+class EnvironmentDef:
+    name: str
+    kind: str
+    ports: tuple[int, ...]
+    access_info: str
+    image: Optional[str] = None
+    template: Optional[str] = None
+    base_image_path: Optional[str] = None
+    tuning_profile: str = NO_TUNING
+    limits: ResourceLimits = ResourceLimits()
+    shared: bool = False
+
+
+@dataclass(frozen=True)
+class ClusterDef:
+    name: str
+    environments: tuple[EnvironmentDef, ...]
+    net_ingress_kbit: Optional[int] = None
+    net_egress_kbit: Optional[int] = None
+
+
+@dataclass
+class ImportReport:
+    clusters_created: int = 0
+    clusters_updated: int = 0
+    environments_created: int = 0
+    environments_updated: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def _ports(raw) -> tuple[int, ...]:
+    ports = []
+    for p in raw or []:
+        port = p.get("internal") if isinstance(p, dict) else p
+        if not isinstance(port, int) or not 1 <= port <= 65535:
+            raise ValidationError(f"invalid port: {p!r}")
+        ports.append(port)
+    return tuple(ports)
+
+
+def _parse_environment(raw: dict, check_files: bool) -> EnvironmentDef:
+    name = (raw.get("name") or "").strip().replace(" ", "-")
+    if not name:
+        raise ValidationError("environment name is required")
+    kind = raw.get("type")
+    try:
+        limits = ResourceLimits.from_mapping(raw.get("limits") or {})
+    except LimitsError as e:
+        raise ValidationError(f"{name}: {e}")
+    common = dict(
+        name=name,
+        ports=_ports(raw.get("ports")),
+        access_info=raw.get("access_info") or "",
+        limits=limits,
+    )
+
+    if kind == "docker":
+        image = (raw.get("image") or "").strip()
+        if not image or any(c.isspace() for c in image):
+            raise ValidationError(f"{name}: invalid docker image {image!r}")
+        shared = raw.get("shared", False)
+        if not isinstance(shared, bool):
+            raise ValidationError(f"{name}: shared must be true or false")
+        return EnvironmentDef(kind="docker", image=image, shared=shared, **common)
+
+    if kind == "vm":
+        if raw.get("shared"):
+            raise ValidationError(f"{name}: only docker environments can be shared")
+        template = raw.get("template")
+        if template is None and raw.get("template_path"):
+            try:
+                with open(raw["template_path"]) as f:
+                    template = f.read()
+            except OSError as e:
+                raise ValidationError(f"{name}: cannot read template: {e}")
+        if not template:
+            raise ValidationError(f"{name}: VM template is required")
+        tuning_profile = raw.get("tuning_profile") or NO_TUNING
+        try:
+            tuned = apply_profile(template, tuning_profile, None)
+            compile_template(apply_limits(tuned, limits))
+        except (TemplateError, TuningError) as e:
+            raise ValidationError(f"{name}: {e}")
+
+        base_image_path = (raw.get("base_image_path") or "").strip()
+        if not base_image_path:
+            raise ValidationError(f"{name}: base image path is required")
+        if check_files:
+            # Sessions resolve base images by file name under VM_BASE_IMAGES_PATH.
+            local = os.path.join(
+                os.getenv("VM_BASE_IMAGES_PATH", ""), os.path.basename(base_image_path)
+            )
+            if not os.path.isfile(local):
+                raise ValidationError(f"{name}: base image {local} does not exist")
+        return EnvironmentDef(
+            kind="vm",
+            template=template,
+            base_image_path=base_image_path,
+            tuning_profile=tuning_profile,
+            **common,
+        )
+
+    raise ValidationError(f"{name}: unknown environment type {kind!r}")
+
+
+def parse_cluster(raw: Any, check_files: bool = True) -> ClusterDef:
+    if not isinstance(raw, dict):
+        raise ValidationError("cluster definition must be an object")
+    name = (raw.get("name") or "").strip()
+    if not name:
+        raise ValidationError("cluster name is required")
+    try:
+        envs = tuple(
+            _parse_environment(e, check_files) for e in raw.get("environments") or []
+        )
+    except ValidationError as e:
+        raise ValidationError(f"cluster {name}: {e}")
+    names = [e.name for e in envs]
+    if len(names) != len(set(names)):
+        raise ValidationError(f"cluster {name}: duplicate environment names")
+    bandwidth = raw.get("bandwidth") or {}
+    for key in ("net_ingress_kbit", "net_egress_kbit"):
+        value = bandwidth.get(key)
+        if value is not None and (not isinstance(value, int) or value <= 0):
+            raise ValidationError(f"cluster {name}: invalid {key} {value!r}")
+    return ClusterDef(
+        name=name,
+        environments=envs,
+        net_ingress_kbit=bandwidth.get("net_ingress_kbit"),
+        net_egress_kbit=bandwidth.get("net_egress_kbit"),
+    )
+
+
+def dump_cluster(cluster: Cluster) -> dict:
+    envs = []
+    for env in sorted(cluster.environments, key=lambda e: (e.name, e.id)):
+        out = {"name": env.name}
+        if env.docker:
+            out.update(type="docker", image=env.docker.image)
+            if env.shared:
+                out["shared"] = True
+        elif env.vm:
+            out.update(
+                type="vm",
+                template=env.vm.template,
+                base_image_path=env.vm.base_image_path,
+                tuning_profile=env.vm.tuning_profile,
+            )
+        else:
+            continue
+        out["ports"] = [{"internal": p} for p in env.ports or []]
+        if env.access_info:
+            out["access_info"] = env.access_info
+        limits = ResourceLimits.from_model(env)
+        if not limits.is_empty():
+            out["limits"] = {k: v for k, v in limits.as_dict().items() if v is not None}
+        envs.append(out)
+    out = {"name": cluster.name, "environments": envs}
+    bandwidth = {
+        key: getattr(cluster, key)
+        for key in ("net_ingress_kbit", "net_egress_kbit")
+        if getattr(cluster, key) is not None
+    }
+    if bandwidth:
+        out["bandwidth"] = bandwidth
+    return out
+
+
+class FixtureService:
+    def __init__(
+        self,
+        *,
+        clusters: ClusterRepository,
+        notifier: LocalInvalidationBus,
+        images: ImageManager,
+        batch_size: int,
+    ):
+        self.clusters = clusters
+        self.notifier = notifier
+        self.images = images
+        self.batch_size = max(1, batch_size)
+
+    def validate(self, stream: IO[str], check_files: bool = True) -> List[str]:
+        errors = []
+        try:
+            for i, raw in enumerate(iter_documents(stream)):
+                try:
+                    parse_cluster(raw, check_files)
+                except ValidationError as e:
+                    errors.append(f"#{i}: {e}")
+        except json.JSONDecodeError as e:
+            errors.append(f"invalid JSON: {e}")
+        return errors
+
+    def import_stream(self, stream: IO[str], check_files: bool = True) -> ImportReport:
+        # Everything is validated before the first write, so a bad
+        # definition deep in a large file does not leave a partial import.
+        report = ImportReport(errors=self.validate(stream, check_files))
+        if report.errors:
+            return report
+        stream.seek(0)
+
+        batch: List[ClusterDef] = []
+        for raw in iter_documents(stream):
+            batch.append(parse_cluster(raw, check_files=False))
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch, report)
+                batch = []
+        if batch:
+            self._import_batch(batch, report)
+        return report
+
+    @staticmethod
+    def _apply(env: Environment, d: EnvironmentDef) -> None:
+        env.ports = list(d.ports)
+        env.access_info = d.access_info
+        env.shared = d.shared
+        for key, value in d.limits.as_dict().items():
+            setattr(env, key, value)
+        if d.kind == "docker":
+            env.vm = None
+            if env.docker is None:
+                env.docker = DockerEnvModel(image=d.image)
+            else:
+                env.docker.image = d.image
+        else:
+            env.docker = None
+            if env.vm is None:
+                env.vm = VMEnvModel(
+                    template=d.template,
+                    base_image_path=d.base_image_path,
+                    tuning_profile=d.tuning_profile,
+                )
+            else:
+                env.vm.template = d.template
+                env.vm.base_image_path = d.base_image_path
+                env.vm.tuning_profile = d.tuning_profile
+
+    def _import_batch(self, batch: List[ClusterDef], report: ImportReport) -> None:
+        # Later duplicates of a cluster name win, as they would one by one.
+        defs = {d.name: d for d in batch}
+        existing = {
+            c.name: c
+            for c in Cluster.query.options(
+                selectinload(Cluster.environments).options(
+                    selectinload(Environment.docker), selectinload(Environment.vm)
+                )
+            ).filter(Cluster.name.in_(list(defs)))
+        }
+
+        try:
+            touched = []
+            updated_envs = []
+            for name, d in defs.items():
+                cluster = existing.get(name)
+                if cluster is None:
+                    cluster = Cluster(name=name)
+                    db.session.add(cluster)
+                    report.clusters_created += 1
+                    current = {}
+                else:
+                    report.clusters_updated += 1
+                    current = {e.name: e for e in cluster.environments}
+                cluster.net_ingress_kbit = d.net_ingress_kbit
+                cluster.net_egress_kbit = d.net_egress_kbit
+
+                for env_def in d.environments:
+                    env = current.get(env_def.name)
+                    if env is None:
+                        env = Environment(name=env_def.name)
+                        db.session.add(
+                            ClusterEnvironment(cluster=cluster, environment=env)
+                        )
+                        report.environments_created += 1
+                    else:
+                        report.environments_updated += 1
+                        updated_envs.append(env)
+                    self._apply(env, env_def)
+                touched.append(cluster)
+
+            db.session.flush()
+            for cluster in touched:
+                self.notifier.publish(f"cluster:{cluster.id}")
+            # Environment rows can be linked to clusters outside this batch.
+            for env in updated_envs:
+                self.notifier.publish(f"environment:{env.id}")
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        self.images.prefetch(
+            sorted({e.image for d in defs.values() for e in d.environments if e.image})
+        )
+        logger.info(f"Imported batch of {len(defs)} cluster definitions")
+
+    def export(self) -> Iterator[str]:
+        yield "[\n"
+        first = True
+        after = None
+        while True:
+            page = self.clusters.list_page(after=after, limit=EXPORT_PAGE_SIZE)
+            for cluster in page.items:
+                yield ("" if first else ",\n") + json.dumps(dump_cluster(cluster))
+                first = False
+            # Keep the identity map from growing with the catalog.
+            db.session.expunge_all()
+            if page.next_cursor is None:
+                break
+            after = page.next_cursor
+        yield "\n]\n"
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import fnmatch
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+from docker.errors import APIError, ImageNotFound
+
+from app.models import DockerEnvironment as DockerEnvModel
+from app.services.clients import ClientProvider
+from app.utils.metrics import IMAGE_PULLS, IMAGES_EVICTED
+
+logger = logging.getLogger(__name__)
+
+READY = "ready"
+PULLING = "pulling"
+MISSING = "missing"
+FAILED = "failed"
+
+
+def split_image(image: str) -> tuple[str, str]:
+    repo, sep, tag = image.rpartition(":")
+    if not sep or "/" in tag:
+        return image, "latest"
+    return repo, tag
+
+
+def normalize(image: str) -> str:
+    repo, tag = split_image(image)
+    return f"{repo}:{tag}"
+
+
+class ImagePullError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class ImageStatus:
+    image: str
+    state: str
+    size: int = 0
+    error: Optional[str] = None
+
+
+class ImageManager:
+    def __init__(
+        self,
+        *,
+        clients: ClientProvider,
+        max_workers: int,
+        min_free_bytes: int,
+        target_free_bytes: int,
+        check_interval_seconds: float,
+        pull_timeout_seconds: float,
+        exclude: Iterable[str] = (),
+    ):
+        self.clients = clients
+        self.pull_timeout_seconds = pull_timeout_seconds
+        self.min_free_bytes = min_free_bytes
+        self.target_free_bytes = max(target_free_bytes, min_free_bytes)
+        self.check_interval_seconds = check_interval_seconds
+        self.exclude = [p for p in exclude if p]
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-pull"
+        )
+        self._lock = threading.Lock()
+        self._pulls: Dict[str, Future] = {}
+        self._errors: Dict[str, str] = {}
+        self._last_used: Dict[str, float] = {}
+        self._referenced: Set[str] = set()
+        self._started = False
+
+    @classmethod
+    def from_env(cls, clients: ClientProvider) -> "ImageManager":
+        gib = 1024**3
+        return cls(
+            clients=clients,
+            max_workers=int(os.getenv("IMAGE_PULL_WORKERS", "4")),
+            min_free_bytes=int(os.getenv("IMAGE_MIN_FREE_BYTES", str(10 * gib))),
+            target_free_bytes=int(os.getenv("IMAGE_TARGET_FREE_BYTES", str(20 * gib))),
+            check_interval_seconds=float(
+                os.getenv("IMAGE_CHECK_INTERVAL_SECONDS", "300")
+            ),
+            pull_timeout_seconds=float(os.getenv("IMAGE_PULL_TIMEOUT_SECONDS", "600")),
+            exclude=os.getenv("IMAGE_EVICTION_EXCLUDE", "").split(","),
+        )
+
+    @staticmethod
+    def referenced_images() -> Set[str]:
+        rows = DockerEnvModel.query.with_entities(DockerEnvModel.image).distinct()
+        return {image for (image,) in rows if image}
+
+    def _local(self, image: str):
+        try:
+            return self.clients.docker().images.get(image)
+        except ImageNotFound:
+            return None
+
+    def _pull(self, image: str) -> None:
+        started = time.monotonic()
+        try:
+            if self._local(image) is not None:
+                return
+            repo, tag = split_image(image)
+            self.clients.docker().images.pull(repo, tag=tag)
+        except Exception as e:
+            IMAGE_PULLS.inc(result="failed")
+            with self._lock:
+                self._errors[image] = str(e)
+            logger.error(f"Failed to prefetch image {image}: {e}")
+            raise
+
+        IMAGE_PULLS.inc(result="ok")
+        with self._lock:
+            self._errors.pop(image, None)
+        logger.info(f"Prefetched image {image} in {time.monotonic() - started:.1f}s")
+
+    def _forget(self, image: str, future: Future) -> None:
+        with self._lock:
+            if self._pulls.get(image) is future:
+                del self._pulls[image]
+
+    def _submit(self, image: str) -> Future:
+        # Keyed by the normalized reference so "nginx" and "nginx:latest"
+        # share one pull.
+        image = normalize(image)
+        with self._lock:
+            future = self._pulls.get(image)
+            if future is not None:
+                return future
+            future = self._pulls[image] = self._executor.submit(self._pull, image)
+        future.add_done_callback(lambda f: self._forget(image, f))
+        return future
+
+    def prefetch(self, images: Iterable[str]) -> None:
+        # The local lookup happens on a pull worker, never on the caller.
+        for image in {normalize(image) for image in images}:
+            self._submit(image)
+
+    def ensure(self, image: str, timeout: float | None = None) -> None:
+        # Joins an in-flight prefetch; only pulls inline when nothing did.
+        image = normalize(image)
+        with self._lock:
+            future = self._pulls.get(image)
+        if future is None and self._local(image) is None:
+            logger.warning(f"Image {image} was not prefetched, pulling on demand")
+            future = self._submit(image)
+        if future is None:
+            return
+        timeout = self.pull_timeout_seconds if timeout is None else timeout
+        try:
+            future.result(timeout)
+        except FutureTimeout:
+            raise ImagePullError(f"Image {image} is still pulling after {timeout:.0f}s")
+        except Exception as e:
+            raise ImagePullError(f"Failed to pull image {image}: {e}")
+
+    def mark_used(self, image: str) -> None:
+        with self._lock:
+            self._last_used[normalize(image)] = time.time()
+
+    def statuses(self, images: Iterable[str]) -> List[ImageStatus]:
+        result = []
+        for image in sorted(set(images)):
+            with self._lock:
+                pulling = normalize(image) in self._pulls
+                error = self._errors.get(normalize(image))
+            if pulling:
+                result.append(ImageStatus(image, PULLING))
+                continue
+            local = self._local(image)
+            if local is not None:
+                result.append(
+                    ImageStatus(image, READY, size=local.attrs.get("Size", 0))
+                )
+            else:
+                result.append(
+                    ImageStatus(image, FAILED if error else MISSING, error=error)
+                )
+        return result
+
+    def _free_bytes(self) -> int:
+        root = self.clients.docker().info().get("DockerRootDir", "/var/lib/docker")
+        return shutil.disk_usage(root).free
+
+    def _evictable(self, referenced: Set[str]) -> list:
+        docker = self.clients.docker()
+        in_use = {c.attrs.get("Image") for c in docker.containers.list(all=True)}
+
+        candidates = []
+        for image in docker.images.list():
+            tags = image.tags or []
+            if image.id in in_use or not referenced.isdisjoint(tags):
+                continue
+            if any(fnmatch.fnmatch(t, p) for t in tags for p in self.exclude):
+                continue
+            with self._lock:
+                last_used = max(
+                    (self._last_used.get(t, 0.0) for t in tags), default=0.0
+                )
+            candidates.append((last_used, image.attrs.get("Created", ""), image))
+
+        candidates.sort(key=lambda c: (c[0], c[1]))
+        return [image for _, _, image in candidates]
+
+    def evict_if_needed(self, referenced: Set[str] | None = None) -> List[str]:
+        free = self._free_bytes()
+        if free >= self.min_free_bytes:
+            return []
+
+        with self._lock:
+            referenced = self._referenced if referenced is None else referenced
+        referenced = {normalize(image) for image in referenced}
+
+        evicted = []
+        for image in self._evictable(referenced):
+            if free >= self.target_free_bytes:
+                break
+            try:
+                self.clients.docker().images.remove(image.id)
+            except APIError as e:
+                logger.warning(f"Could not evict image {image.id}: {e}")
+                continue
+            IMAGES_EVICTED.inc()
+            evicted.append(", ".join(image.tags) or image.id)
+            free = self._free_bytes()
+
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} unused images: {evicted}")
+        return evicted
+
+    def _loop(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    referenced = self.referenced_images()
+                with self._lock:
+                    self._referenced = referenced
+                self.prefetch(referenced)
+                self.evict_if_needed(referenced)
+            except Exception as e:
+                logger.exception(f"Image manager cycle failed: {e}")
+            time.sleep(self.check_interval_seconds)
+
+    def start(self, app) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(
+            target=self._loop, args=(app,), name="image-manager", daemon=True
+        ).start()
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import libvirt
+
+from app.services.clients import ClientProvider
+from app.services.registry import ClusterRegistry
+from app.utils.metrics import OVERLAY_GC_DELETED, OVERLAY_GC_RECLAIMED, PHASE_SECONDS
+from app.utils.overlay_placement import OverlayPlacer
+
+logger = logging.getLogger(__name__)
+
+OVERLAY_SUFFIX = ".qcow2"
+
+
+@dataclass(frozen=True)
+class GCReport:
+    finished_at: float
+    duration_seconds: float
+    scanned: int
+    orphans: int
+    deleted: int
+    reclaimed_bytes: int
+
+
+def domain_disk_paths(conn: libvirt.virConnect) -> Set[str]:
+    paths = set()
+    for domain in conn.listAllDomains(0):
+        try:
+            root = ET.fromstring(domain.XMLDesc(0))
+        except libvirt.libvirtError:
+            # Undefined between listing and lookup.
+            continue
+        for source in root.findall("./devices/disk/source"):
+            if source.get("file"):
+                paths.add(os.path.realpath(source.get("file")))
+    return paths
+
+
+class OverlayCollector:
+    def __init__(
+        self,
+        *,
+        registry: ClusterRegistry,
+        overlays: OverlayPlacer,
+        clients: ClientProvider,
+        grace_seconds: float,
+        batch_size: int,
+        batch_pause_seconds: float,
+        interval_seconds: float,
+    ):
+        self.registry = registry
+        self.overlays = overlays
+        self.clients = clients
+        self.grace_seconds = grace_seconds
+        self.batch_size = max(1, batch_size)
+        self.batch_pause_seconds = batch_pause_seconds
+        self.interval_seconds = interval_seconds
+
+        self._lock = threading.Lock()
+        self._started = False
+        self.last_report: Optional[GCReport] = None
+
+    @classmethod
+    def from_env(
+        cls,
+        *,
+        registry: ClusterRegistry,
+        overlays: OverlayPlacer,
+        clients: ClientProvider,
+    ) -> "OverlayCollector":
+        return cls(
+            registry=registry,
+            overlays=overlays,
+            clients=clients,
+            grace_seconds=float(os.getenv("OVERLAY_GC_GRACE_SECONDS", "3600")),
+            batch_size=int(os.getenv("OVERLAY_GC_BATCH_SIZE", "20")),
+            batch_pause_seconds=float(os.getenv("OVERLAY_GC_BATCH_PAUSE_SECONDS", "1")),
+            interval_seconds=float(os.getenv("OVERLAY_GC_INTERVAL_SECONDS", "600")),
+        )
+
+    def _live_paths(self) -> Set[str]:
+        live = set(self.overlays.placed())
+        for _, (cluster, _, _) in self.registry.items():
+            for env in cluster.environments:
+                path = getattr(env, "image_path", None)
+                if path:
+                    live.add(path)
+        # Domains from other workers or a previous process still own their disks.
+        live |= domain_disk_paths(self.clients.libvirt())
+        return {os.path.realpath(p) for p in live}
+
+    def _scan(self) -> List[Tuple[str, float, int]]:
+        found = []
+        for root in self.overlays.roots:
+            try:
+                entries = os.scandir(root.path)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if not entry.name.endswith(OVERLAY_SUFFIX):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    found.append((entry.path, st.st_mtime, st.st_blocks * 512))
+        return found
+
+    def collect(self) -> GCReport:
+        started = time.monotonic()
+        with PHASE_SECONDS.time(phase="overlay_gc_scan"):
+            found = self._scan()
+            live = self._live_paths()
+
+        cutoff = time.time() - self.grace_seconds
+        orphans = [
+            (path, size)
+            for path, mtime, size in sorted(found, key=lambda f: f[1])
+            if mtime < cutoff and os.path.realpath(path) not in live
+        ]
+
+        deleted = reclaimed = 0
+        for i in range(0, len(orphans), self.batch_size):
+            if i:
+                time.sleep(self.batch_pause_seconds)
+            # Re-check each batch so a session started mid-run keeps its disk.
+            live = self._live_paths()
+            for path, size in orphans[i : i + self.batch_size]:
+                if os.path.realpath(path) in live:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.error(f"Failed to remove orphaned overlay {path}: {e}")
+                    continue
+                deleted += 1
+                reclaimed += size
+                OVERLAY_GC_DELETED.inc()
+                OVERLAY_GC_RECLAIMED.inc(size)
+                logger.debug("Removed orphaned overlay %s", path)
+
+        report = GCReport(
+            finished_at=time.time(),
+            duration_seconds=round(time.monotonic() - started, 3),
+            scanned=len(found),
+            orphans=len(orphans),
+            deleted=deleted,
+            reclaimed_bytes=reclaimed,
+        )
+        self.last_report = report
+        if deleted:
+            logger.info(
+                f"Overlay GC removed {deleted} orphaned overlays, reclaimed {reclaimed} bytes"
+            )
+        return report
+
+    def report(self) -> Optional[Dict[str, Any]]:
+        report = self.last_report
+        return asdict(report) if report else None
+
+    def _loop(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                # Without the domain list nothing can be proven orphaned.
+                logger.exception(f"Overlay GC cycle failed: {e}")
+            time.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._loop, name="overlay-gc", daemon=True).start()
@@ -28,6 +28,10 @@ class PortPool:
                 self._available.remove(p)
             return chosen
 
+    def available_count(self) -> int:
+        with self._lock:
+            return len(self._available)
+
     def release_many(self, ports: Iterable[int]) -> None:
         with self._lock:
             for p in ports:
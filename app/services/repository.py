@@ -1,8 +1,67 @@
 from __future__ import annotations
-from typing import Iterable, Optional, Sequence
+import base64
+import json
+from dataclasses import dataclass
+from typing import Generic, Iterable, Optional, Sequence, TypeVar
+
+from sqlalchemy import or_, tuple_
+from sqlalchemy.orm import selectinload
 
 from app.extensions import db
-from app.models import Cluster, Environment, ClusterEnvironment
+from app.models import (
+    Cluster,
+    Environment,
+    ClusterEnvironment,
+    DockerEnvironment,
+    VMEnvironment,
+)
+
+T = TypeVar("T")
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Page(Generic[T]):
+    items: Sequence[T]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(name: str, id: int) -> str:
+    raw = json.dumps([name, id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, id = json.loads(raw)
+        return str(name), int(id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid page cursor: {cursor}") from e
+
+
+def _like(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _keyset_page(query, name_col, id_col, after: Optional[str], limit: int) -> Page:
+    # (name, id) keysets walk the composite index instead of OFFSET scans.
+    if after:
+        query = query.filter(tuple_(name_col, id_col) > decode_cursor(after))
+    rows = query.order_by(name_col.asc(), id_col.asc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].name, rows[-1].id)
+    return Page(items=rows, next_cursor=next_cursor)
+
+
+def _environment_loaders():
+    return (selectinload(Environment.docker), selectinload(Environment.vm))
 
 
 class ClusterRepository:
@@ -12,6 +71,16 @@ class ClusterRepository:
     def get_by_name(self, name: str) -> Optional[Cluster]:
         return Cluster.query.filter_by(name=name).first()
 
+    def list_page(
+        self, *, name: Optional[str] = None, after: Optional[str] = None, limit: int
+    ) -> Page[Cluster]:
+        query = Cluster.query.options(
+            selectinload(Cluster.environments).options(*_environment_loaders())
+        )
+        if name:
+            query = query.filter(Cluster.name.ilike(_like(name), escape="\\"))
+        return _keyset_page(query, Cluster.name, Cluster.id, after, limit)
+
     def add(self, cluster: Cluster) -> None:
         db.session.add(cluster)
 
@@ -25,12 +94,41 @@ class EnvironmentRepository:
 
     def list_all_for_creator(self) -> Sequence[Environment]:
         return (
-            Environment.query.outerjoin(Environment.docker)
-            .outerjoin(Environment.vm)
-            .order_by(Environment.name.asc())
+            Environment.query.options(*_environment_loaders())
+            .order_by(Environment.name.asc(), Environment.id.asc())
             .all()
         )
 
+    def list_page(
+        self,
+        *,
+        name: Optional[str] = None,
+        kind: Optional[str] = None,
+        image: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int,
+    ) -> Page[Environment]:
+        query = Environment.query.options(*_environment_loaders())
+        if name:
+            query = query.filter(Environment.name.ilike(_like(name), escape="\\"))
+        if kind == "docker":
+            query = query.filter(Environment.docker.has())
+        elif kind == "vm":
+            query = query.filter(Environment.vm.has())
+        if image:
+            pattern = _like(image)
+            query = query.filter(
+                or_(
+                    Environment.docker.has(
+                        DockerEnvironment.image.ilike(pattern, escape="\\")
+                    ),
+                    Environment.vm.has(
+                        VMEnvironment.base_image_path.ilike(pattern, escape="\\")
+                    ),
+                )
+            )
+        return _keyset_page(query, Environment.name, Environment.id, after, limit)
+
     def get_by_ids(self, ids: Iterable[int]) -> list[Environment]:
         ids = list(ids)
         if not ids:
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+import psutil
+
+from app.runtime import VMEnvironment, VMStatsCollector
+from app.services.registry import ClusterRegistry
+from app.services.shared_envs import SharedEnvironmentPool
+from app.services.timeseries import TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EnvUsage:
+    cpu: float = 0.0
+    memory: int = 0
+    rx: int = 0
+    tx: int = 0
+    io_read: int = 0
+    io_write: int = 0
+
+    @classmethod
+    def from_dict(cls, usage: dict) -> "EnvUsage":
+        network = usage.get("network", {}) or {}
+        io = usage.get("io", {}) or {}
+        return cls(
+            cpu=float(usage.get("cpu", 0.0) or 0.0),
+            memory=int(usage.get("memory", 0) or 0),
+            rx=int(network.get("rx", 0) or 0),
+            tx=int(network.get("tx", 0) or 0),
+            io_read=int(io.get("read", 0) or 0),
+            io_write=int(io.get("write", 0) or 0),
+        )
+
+    @classmethod
+    def sum(cls, usages) -> "EnvUsage":
+        usages = list(usages)
+        return cls(
+            cpu=round(sum(u.cpu for u in usages), 2),
+            memory=sum(u.memory for u in usages),
+            rx=sum(u.rx for u in usages),
+            tx=sum(u.tx for u in usages),
+            io_read=sum(u.io_read for u in usages),
+            io_write=sum(u.io_write for u in usages),
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "cpu": self.cpu,
+            "memory": self.memory,
+            "network": {"rx": self.rx, "tx": self.tx},
+            "io": {"read": self.io_read, "write": self.io_write},
+        }
+
+
+@dataclass(frozen=True)
+class HostUsage:
+    cpu_percent: float = 0.0
+    memory_percent: float = 0.0
+    memory_total: int = 0
+    rx: int = 0
+    tx: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "cpu_percent": self.cpu_percent,
+            "memory_percent": self.memory_percent,
+            "memory_total": self.memory_total,
+            "network": {"rx": self.rx, "tx": self.tx},
+        }
+
+
+@dataclass(frozen=True)
+class ClusterUsage:
+    session_id: str
+    cluster_id: int | None
+    cluster_name: str | None
+    expires_at: datetime
+    environments: Tuple[Tuple[str, EnvUsage], ...]
+    total: EnvUsage
+
+
+@dataclass(frozen=True)
+class ResourceSnapshot:
+    taken_at: datetime | None
+    duration_seconds: float
+    host: HostUsage
+    clusters: Tuple[ClusterUsage, ...]
+    # Shared environments by container name, not counted against any session.
+    shared: Tuple[Tuple[str, EnvUsage], ...] = ()
+
+    @classmethod
+    def empty(cls) -> "ResourceSnapshot":
+        return cls(taken_at=None, duration_seconds=0.0, host=HostUsage(), clusters=())
+
+    def to_summary(self, now: datetime | None = None) -> Dict[str, Any]:
+        now = now or datetime.now()
+
+        overall = {
+            "cpu": self.host.cpu_percent,
+            "memory": 0,
+            "network": {"rx": 0, "tx": 0},
+            "io": {"read": 0, "write": 0},
+        }
+        clusters_list = []
+        for cluster in self.clusters:
+            clusters_list.append(
+                {
+                    "session_id": cluster.session_id,
+                    "cluster_id": str(cluster.cluster_id),
+                    "cluster_name": cluster.cluster_name,
+                    "ttl_remaining_seconds": max(
+                        0, int((cluster.expires_at - now).total_seconds())
+                    ),
+                    "resources": cluster.total.as_dict(),
+                }
+            )
+            overall["memory"] += cluster.total.memory
+            overall["network"]["rx"] += cluster.total.rx
+            overall["network"]["tx"] += cluster.total.tx
+            overall["io"]["read"] += cluster.total.io_read
+            overall["io"]["write"] += cluster.total.io_write
+
+        return {
+            "sampled_at": self.taken_at.isoformat() if self.taken_at else None,
+            "host": self.host.as_dict(),
+            "overall": overall,
+            "clusters": clusters_list,
+        }
+
+
+class ResourceSampler:
+    def __init__(
+        self,
+        *,
+        registry: ClusterRegistry,
+        interval_seconds: float,
+        max_workers: int,
+        history: TimeSeriesStore | None = None,
+        shared_envs: SharedEnvironmentPool | None = None,
+    ):
+        self.registry = registry
+        self.history = history
+        self.shared_envs = shared_envs
+        self.interval_seconds = interval_seconds
+        self.vm_collector = VMStatsCollector()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="resource-sampler"
+        )
+        self._snapshot = ResourceSnapshot.empty()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        # The first non-blocking call only establishes the reference point.
+        psutil.cpu_percent(interval=None)
+
+    @property
+    def snapshot(self) -> ResourceSnapshot:
+        return self._snapshot
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(
+            target=self._sample_loop, name="resource-sampler-loop", daemon=True
+        ).start()
+
+    def _sample_loop(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self._snapshot = self.sample()
+                if self.history is not None:
+                    self._record_history(self._snapshot)
+            except Exception as e:
+                logger.exception(f"Resource sampling failed: {e}")
+            elapsed = time.monotonic() - started
+            time.sleep(max(0.0, self.interval_seconds - elapsed))
+
+    @staticmethod
+    def _usage_points(scope: str, key: str, usage: EnvUsage):
+        yield (scope, key, "cpu"), usage.cpu
+        yield (scope, key, "memory"), usage.memory
+        yield (scope, key, "network_rx"), usage.rx
+        yield (scope, key, "network_tx"), usage.tx
+        yield (scope, key, "io_read"), usage.io_read
+        yield (scope, key, "io_write"), usage.io_write
+
+    def _record_history(self, snapshot: ResourceSnapshot) -> None:
+        host = snapshot.host
+        points = [
+            (("host", "host", "cpu"), host.cpu_percent),
+            (("host", "host", "memory_percent"), host.memory_percent),
+            (("host", "host", "network_rx"), host.rx),
+            (("host", "host", "network_tx"), host.tx),
+        ]
+        for cluster in snapshot.clusters:
+            points.extend(
+                self._usage_points("session", cluster.session_id, cluster.total)
+            )
+            for display_name, usage in cluster.environments:
+                points.extend(
+                    self._usage_points(
+                        "environment", f"{cluster.session_id}/{display_name}", usage
+                    )
+                )
+        self.history.record(snapshot.taken_at.timestamp(), points)
+
+    @staticmethod
+    def _sample_host() -> HostUsage:
+        vm = psutil.virtual_memory()
+        net = psutil.net_io_counters()
+        return HostUsage(
+            cpu_percent=psutil.cpu_percent(interval=None),
+            memory_percent=float(vm.percent),
+            memory_total=int(vm.total),
+            rx=int(net.bytes_recv),
+            tx=int(net.bytes_sent),
+        )
+
+    def _collect(
+        self, futures: dict, vm_future, vm_keys: dict
+    ) -> Dict[Tuple[str, str], EnvUsage]:
+        deadline = time.monotonic() + self.interval_seconds
+        usage = {}
+
+        vm_usage = {}
+        try:
+            vm_usage = vm_future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            logger.warning("Bulk VM resource sampling timed out")
+        except Exception as e:
+            logger.error(f"Failed to read VM resources: {e}")
+        for domain_name, key in vm_keys.items():
+            usage[key] = EnvUsage.from_dict(vm_usage.get(domain_name) or {})
+
+        for key, future in futures.items():
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                usage[key] = EnvUsage.from_dict(result or {})
+            except FutureTimeout:
+                logger.warning(f"Resource sampling of {key[1]} timed out")
+                usage[key] = EnvUsage()
+            except Exception as e:
+                logger.error(f"Failed to read resources for {key[1]}: {e}")
+                usage[key] = EnvUsage()
+        return usage
+
+    def sample(self) -> ResourceSnapshot:
+        started = time.monotonic()
+        entries = self.registry.items()
+
+        futures = {}
+        vm_envs = []
+        vm_keys = {}
+        for session_id, (cluster, _, _) in entries:
+            for env in cluster.environments:
+                key = (session_id, env.display_name)
+                if isinstance(env, VMEnvironment):
+                    vm_envs.append(env)
+                    vm_keys[env.name] = key
+                else:
+                    futures[key] = self._executor.submit(env.get_resource_usage)
+
+        shared_envs = []
+        if self.shared_envs is not None:
+            shared_envs = self.shared_envs.started_environments()
+        for env in shared_envs:
+            futures[(None, env.name)] = self._executor.submit(env.get_resource_usage)
+
+        # All VM domains are fetched with a single bulk libvirt call.
+        vm_future = self._executor.submit(self.vm_collector.collect, vm_envs)
+
+        host = self._sample_host()
+        usage = self._collect(futures, vm_future, vm_keys)
+
+        clusters = []
+        for session_id, (cluster, _, expires_at) in entries:
+            per_env = tuple(
+                (env.display_name, usage[(session_id, env.display_name)])
+                for env in cluster.environments
+            )
+            total = EnvUsage.sum(u for _, u in per_env)
+            clusters.append(
+                ClusterUsage(
+                    session_id=str(session_id),
+                    cluster_id=cluster.db_id,
+                    cluster_name=cluster.db_name,
+                    expires_at=expires_at,
+                    environments=per_env,
+                    total=total,
+                )
+            )
+
+        return ResourceSnapshot(
+            taken_at=datetime.now(),
+            duration_seconds=time.monotonic() - started,
+            host=host,
+            clusters=tuple(clusters),
+            shared=tuple((env.name, usage[(None, env.name)]) for env in shared_envs),
+        )
@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Set
+
+from docker.errors import APIError, NotFound
+
+from app.models.status import EnvStatus
+from app.runtime import DockerEnvironment
+from app.services.blueprint_cache import EnvironmentBlueprint
+from app.services.clients import ClientProvider
+from app.services.images import ImageManager
+from app.services.ports import PortPool
+from app.utils.networking import ensure_docker_network
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+EMPTY_USAGE = {"cpu": 0.0, "memory": 0, "network": {"rx": 0, "tx": 0}}
+
+
+@dataclass(eq=False)
+class _SharedEntry:
+    id: int
+    env: DockerEnvironment
+    # Shared by every entry built for this environment id, so a new
+    # container is never started while the previous one is being removed.
+    lock: threading.Lock
+    leases: Set["SharedEnvironmentLease"] = field(default_factory=set)
+    started: bool = False
+
+
+class SharedEnvironmentLease:
+    # Stands in for a shared environment inside one session's cluster.
+    # Published ports belong to the pool, so session teardown never
+    # returns them to the port pool.
+
+    def __init__(
+        self,
+        pool: "SharedEnvironmentPool",
+        entry: _SharedEntry,
+        cluster,
+        session_id: str,
+    ):
+        self.pool = pool
+        self.entry = entry
+        self.shared = entry.env
+        self.cluster = cluster
+        self.session_id = session_id
+        self.name = self.shared.name
+        self.display_name = self.shared.display_name
+        self.published_ports: List[int] = []
+
+    @property
+    def ip(self):
+        return self.shared.ip
+
+    def start(self):
+        self.pool._attach(self)
+
+    def restart(self):
+        logger.info(f"Not restarting shared environment {self.name} for one session")
+
+    def status(self) -> EnvStatus:
+        return self.shared.status()
+
+    def get_access_info(self):
+        return self.shared.get_access_info()
+
+    def get_resource_usage(self) -> dict:
+        # Reported once by the pool rather than against every session.
+        return dict(EMPTY_USAGE)
+
+    def destroy(self):
+        self.pool.release(self)
+
+
+class SharedEnvironmentPool:
+    def __init__(
+        self,
+        *,
+        clients: ClientProvider,
+        port_pool: PortPool,
+        images: ImageManager,
+        network_name: str,
+    ):
+        self.clients = clients
+        self.port_pool = port_pool
+        self.images = images
+        self.network_name = network_name
+        self._lock = threading.Lock()
+        self._entries: Dict[int, _SharedEntry] = {}
+        self._env_locks: Dict[int, threading.Lock] = {}
+
+    @classmethod
+    def from_env(
+        cls, *, clients: ClientProvider, port_pool: PortPool, images: ImageManager
+    ) -> "SharedEnvironmentPool":
+        return cls(
+            clients=clients,
+            port_pool=port_pool,
+            images=images,
+            network_name=os.getenv("SHARED_ENV_NETWORK", "venvshared"),
+        )
+
+    def acquire(
+        self, env_bp: EnvironmentBlueprint, cluster, session_id: str
+    ) -> SharedEnvironmentLease:
+        with self._lock:
+            entry = self._entries.get(env_bp.id)
+        # Building talks to Docker, so it must not hold up other sessions.
+        built = self._build(env_bp) if entry is None else None
+
+        with self._lock:
+            entry = self._entries.get(env_bp.id)
+            if entry is None:
+                entry = self._entries[env_bp.id] = _SharedEntry(
+                    id=env_bp.id,
+                    env=built,
+                    lock=self._env_locks.setdefault(env_bp.id, threading.Lock()),
+                )
+                built = None
+            lease = SharedEnvironmentLease(self, entry, cluster, session_id)
+            entry.leases.add(lease)
+
+        if built is not None:
+            # Another session installed this environment first.
+            self.port_pool.release_many(built.published_ports)
+        return lease
+
+    def _build(self, env_bp: EnvironmentBlueprint) -> DockerEnvironment:
+        docker = self.clients.docker()
+        published_ports = self.port_pool.allocate_many(len(env_bp.ports))
+        try:
+            network = ensure_docker_network(docker, self.network_name)
+        except Exception:
+            self.port_pool.release_many(published_ports)
+            raise
+        return DockerEnvironment(
+            docker_client=docker,
+            name=f"shared-{env_bp.name}-{env_bp.id}",
+            display_name=env_bp.name,
+            image=env_bp.image,
+            internal_ports=list(env_bp.ports),
+            published_ports=published_ports,
+            # Identical for every session, so no session variables.
+            variables={},
+            access_info=env_bp.access_info,
+            docker_network=network,
+            limits=env_bp.limits,
+        )
+
+    def _start(self, entry: _SharedEntry) -> None:
+        env = entry.env
+        with span("image_ready", image=env.image):
+            self.images.ensure(env.image)
+        self.images.mark_used(env.image)
+        try:
+            # Left behind by a previous process; nothing can be attached to it.
+            env.docker_client.containers.get(env.name).remove(force=True)
+        except NotFound:
+            pass
+        with span("shared_env_start", environment=env.display_name):
+            env.start()
+        entry.started = True
+        logger.info(f"Started shared environment {env.name}")
+
+    def _attach(self, lease: SharedEnvironmentLease) -> None:
+        entry = lease.entry
+        with entry.lock:
+            if lease not in entry.leases:
+                raise RuntimeError(f"Lease on {lease.name} was already released")
+            if not entry.started:
+                self._start(entry)
+        network = lease.cluster.docker_network
+        if network is None:
+            return
+        try:
+            # Session containers reach the service by its environment name.
+            network.connect(entry.env.container, aliases=[lease.display_name])
+        except APIError as e:
+            logger.error(f"Failed to attach {lease.name} to {network.name}: {e}")
+            raise
+
+    def release(self, lease: SharedEnvironmentLease) -> None:
+        entry = lease.entry
+        network = lease.cluster.docker_network
+        if network is not None and entry.env.container is not None:
+            try:
+                # Docker refuses to remove a network with endpoints left.
+                network.disconnect(entry.env.container, force=True)
+            except APIError as e:
+                logger.warning(
+                    f"Failed to detach {lease.name} from {network.name}: {e}"
+                )
+
+        with self._lock:
+            if lease not in entry.leases:
+                return
+            entry.leases.discard(lease)
+            if entry.leases:
+                return
+            del self._entries[entry.id]
+            # Taken before a new entry for the same id can be attached.
+            entry.lock.acquire()
+
+        try:
+            if entry.env.container is not None:
+                with span("shared_env_destroy", environment=entry.env.display_name):
+                    entry.env.destroy()
+        except APIError as e:
+            logger.error(f"Failed to remove shared environment {entry.env.name}: {e}")
+        finally:
+            entry.lock.release()
+            self.port_pool.release_many(entry.env.published_ports)
+        logger.info(f"Removed shared environment {entry.env.name}, no sessions left")
+
+    def started_environments(self) -> List[DockerEnvironment]:
+        with self._lock:
+            return [entry.env for entry in self._entries.values() if entry.started]
+
+    def usage(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries.values())
+        return [
+            {
+                "name": entry.env.name,
+                "sessions": len({lease.session_id for lease in entry.leases}),
+                "leases": len(entry.leases),
+            }
+            for entry in entries
+        ]
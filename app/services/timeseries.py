@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+AGGREGATIONS = ("avg", "min", "max", "sum", "last", "count")
+
+logger = logging.getLogger(__name__)
+
+SeriesKey = Tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class Resolution:
+    step_seconds: int
+    retention_seconds: int
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self.retention_seconds // self.step_seconds)
+
+    @classmethod
+    def parse_many(cls, spec: str, min_step_seconds: int = 1) -> List["Resolution"]:
+        # "5:600,60:86400" -> 5 s buckets for 10 min, 1 min buckets for 24 h.
+        # Buckets finer than the sampling interval would mostly stay empty,
+        # so steps are raised to min_step_seconds.
+        retention: Dict[int, int] = {}
+        for part in (spec or "").split(","):
+            if not part.strip():
+                continue
+            step, _, seconds = part.partition(":")
+            step = max(int(step), min_step_seconds, 1)
+            retention[step] = max(retention.get(step, 0), int(seconds))
+        if not retention:
+            raise ValueError("At least one time-series resolution is required")
+        return [cls(step, retention[step]) for step in sorted(retention)]
+
+
+@dataclass(frozen=True)
+class Bucket:
+    timestamp: float
+    minimum: float
+    maximum: float
+    total: float
+    count: int
+    last: float
+
+    def value(self, agg: str) -> float:
+        if agg == "avg":
+            return self.total / self.count if self.count else 0.0
+        if agg == "min":
+            return self.minimum
+        if agg == "max":
+            return self.maximum
+        if agg == "sum":
+            return self.total
+        if agg == "last":
+            return self.last
+        return float(self.count)
+
+    @staticmethod
+    def merge(timestamp: float, buckets: List["Bucket"]) -> "Bucket":
+        return Bucket(
+            timestamp=timestamp,
+            minimum=min(b.minimum for b in buckets),
+            maximum=max(b.maximum for b in buckets),
+            total=sum(b.total for b in buckets),
+            count=sum(b.count for b in buckets),
+            last=buckets[-1].last,
+        )
+
+
+class RingBuffer:
+    __slots__ = (
+        "resolution",
+        "_timestamps",
+        "_mins",
+        "_maxs",
+        "_sums",
+        "_lasts",
+        "_counts",
+        "_head",
+        "_size",
+    )
+
+    def __init__(self, resolution: Resolution):
+        capacity = resolution.capacity
+        self.resolution = resolution
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._mins = array("d", bytes(8 * capacity))
+        self._maxs = array("d", bytes(8 * capacity))
+        self._sums = array("d", bytes(8 * capacity))
+        self._lasts = array("d", bytes(8 * capacity))
+        self._counts = array("L", bytes(array("L").itemsize * capacity))
+        self._head = -1
+        self._size = 0
+
+    def add(self, timestamp: float, value: float) -> None:
+        step = self.resolution.step_seconds
+        bucket = timestamp - (timestamp % step)
+
+        if self._size and self._timestamps[self._head] == bucket:
+            i = self._head
+            self._mins[i] = min(self._mins[i], value)
+            self._maxs[i] = max(self._maxs[i], value)
+            self._sums[i] += value
+            self._lasts[i] = value
+            self._counts[i] += 1
+            return
+
+        if self._size and bucket < self._timestamps[self._head]:
+            return
+
+        self._head = (self._head + 1) % len(self._timestamps)
+        self._size = min(self._size + 1, len(self._timestamps))
+        i = self._head
+        self._timestamps[i] = bucket
+        self._mins[i] = self._maxs[i] = self._sums[i] = self._lasts[i] = value
+        self._counts[i] = 1
+
+    def oldest(self) -> Optional[float]:
+        if not self._size:
+            return None
+        capacity = len(self._timestamps)
+        return self._timestamps[(self._head - self._size + 1) % capacity]
+
+    def buckets(self, start: float, end: float) -> List[Bucket]:
+        capacity = len(self._timestamps)
+        result = []
+        for offset in range(self._size - 1, -1, -1):
+            i = (self._head - offset) % capacity
+            ts = self._timestamps[i]
+            if ts + self.resolution.step_seconds <= start or ts > end:
+                continue
+            result.append(
+                Bucket(
+                    timestamp=ts,
+                    minimum=self._mins[i],
+                    maximum=self._maxs[i],
+                    total=self._sums[i],
+                    count=self._counts[i],
+                    last=self._lasts[i],
+                )
+            )
+        return result
+
+
+class Series:
+    __slots__ = ("tiers",)
+
+    def __init__(self, resolutions: Iterable[Resolution]):
+        self.tiers = [RingBuffer(r) for r in resolutions]
+
+    def add(self, timestamp: float, value: float) -> None:
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+
+    def tier_for(self, start: float) -> RingBuffer:
+        # Finest tier that still holds data reaching back to `start`.
+        for tier in self.tiers:
+            oldest = tier.oldest()
+            if oldest is not None and oldest <= start:
+                return tier
+        for tier in reversed(self.tiers):
+            if tier.oldest() is not None:
+                return tier
+        return self.tiers[-1]
+
+
+class TimeSeriesStore:
+    def __init__(self, *, resolutions: List[Resolution], max_series: int):
+        self.resolutions = resolutions
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._series: "OrderedDict[SeriesKey, Series]" = OrderedDict()
+        self._over_cap = False
+
+    def record(self, timestamp: float, points: Iterable[Tuple[SeriesKey, float]]):
+        with self._lock:
+            written = set()
+            for key, value in points:
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = Series(self.resolutions)
+                else:
+                    self._series.move_to_end(key)
+                series.add(timestamp, float(value))
+                written.add(key)
+
+            # Least recently written series (long-gone sessions) go first;
+            # anything written just now is live and is never evicted.
+            while len(self._series) > self.max_series:
+                key = next(iter(self._series))
+                if key in written:
+                    break
+                del self._series[key]
+
+            over_cap = len(self._series) > self.max_series
+            if over_cap and not self._over_cap:
+                logger.warning(
+                    f"{len(self._series)} live time series exceed the cap of "
+                    f"{self.max_series}; raise RESOURCE_HISTORY_MAX_SERIES"
+                )
+            self._over_cap = over_cap
+
+    def keys(self, scope: str | None = None) -> List[SeriesKey]:
+        with self._lock:
+            return [k for k in self._series if scope is None or k[0] == scope]
+
+    def query(
+        self,
+        key: SeriesKey,
+        *,
+        start: float,
+        end: float,
+        agg: str = "avg",
+        step: int | None = None,
+    ) -> Optional[Dict]:
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{agg}'")
+        if end < start:
+            raise ValueError("end must not be before start")
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            tier = series.tier_for(start)
+            buckets = tier.buckets(start, end)
+
+        native_step = tier.resolution.step_seconds
+        step = max(native_step, int(step or native_step))
+        if step != native_step:
+            grouped: Dict[float, List[Bucket]] = {}
+            for b in buckets:
+                grouped.setdefault(b.timestamp - (b.timestamp % step), []).append(b)
+            buckets = [Bucket.merge(ts, bs) for ts, bs in grouped.items()]
+
+        return {
+            "step_seconds": step,
+            "aggregation": agg,
+            "points": [[b.timestamp, b.value(agg)] for b in buckets],
+        }
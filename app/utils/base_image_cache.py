@@ -0,0 +1,290 @@
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.utils.metrics import BASE_IMAGE_CACHE
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+CHUNK_SIZE = 4 * 1024 * 1024
+FAILURE_BACKOFF_SECONDS = 60
+QCOW2_MAGIC = b"QFI\xfb"
+
+
+class BaseImageCacheError(RuntimeError):
+    pass
+
+
+@dataclass
+class CacheEntry:
+    path: str
+    size: int
+    refs: int = 0
+
+
+def reflink(src: str, dst: str) -> bool:
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_with_digest(src: str, dst: str) -> str:
+    digest = hashlib.sha256()
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        os.posix_fadvise(s.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while chunk := s.read(CHUNK_SIZE):
+            digest.update(chunk)
+            d.write(chunk)
+        d.flush()
+        os.fsync(d.fileno())
+    return digest.hexdigest()
+
+
+def qcow2_backing_file(path: str) -> str | None:
+    # Header: magic, version, backing_file_offset (u64), backing_file_size (u32).
+    try:
+        with open(path, "rb") as f:
+            header = f.read(20)
+            if len(header) < 20 or header[:4] != QCOW2_MAGIC:
+                return None
+            offset, size = struct.unpack(">QI", header[8:20])
+            if not offset or not size:
+                return None
+            f.seek(offset)
+            backing = f.read(size).decode(errors="replace")
+    except OSError:
+        return None
+    return os.path.realpath(os.path.join(os.path.dirname(path), backing))
+
+
+def warm(path: str, length: int) -> None:
+    # Boot reads the qcow2 header, L1/L2 tables and the first clusters.
+    if length <= 0:
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+class BaseImageCache:
+    def __init__(
+        self,
+        cache_dir: str | None,
+        budget_bytes: int,
+        warm_bytes: int,
+        overlay_dirs: tuple[str, ...] = (),
+    ):
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir else None
+        self.budget_bytes = budget_bytes
+        self.warm_bytes = warm_bytes
+        self.overlay_dirs = tuple(overlay_dirs)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._by_path: dict[str, str] = {}
+        # Keys being copied in the background, with their size.
+        self._pending: dict[str, int] = {}
+        self._failed: dict[str, float] = {}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_existing()
+
+    @classmethod
+    def from_env(cls, overlay_dirs: tuple[str, ...] = ()) -> "BaseImageCache":
+        return cls(
+            cache_dir=os.getenv("VM_BASE_CACHE_PATH") or None,
+            budget_bytes=int(os.getenv("VM_BASE_CACHE_BYTES", str(50 * 1024**3))),
+            warm_bytes=int(os.getenv("VM_BASE_CACHE_WARM_BYTES", str(256 * 1024**2))),
+            overlay_dirs=overlay_dirs,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cache_dir)
+
+    def _load_existing(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            files.append((st.st_atime, name, path, st.st_size))
+
+        for _, name, path, size in sorted(files):
+            self._entries[name] = CacheEntry(path=path, size=size)
+            self._by_path[path] = name
+
+    @staticmethod
+    def _key(source: str) -> str:
+        st = os.stat(source)
+        ident = f"{os.path.realpath(source)}:{st.st_size}:{st.st_mtime_ns}"
+        digest = hashlib.sha256(ident.encode()).hexdigest()[:16]
+        return f"{os.path.basename(source)}.{digest}"
+
+    @staticmethod
+    def _expected_digest(source: str) -> str | None:
+        try:
+            with open(f"{source}.sha256") as f:
+                return f.read().split()[0].lower()
+        except (OSError, IndexError):
+            return None
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(e.size for e in self._entries.values())
+
+    def _backed_paths(self) -> set[str]:
+        # Refcounts only cover this process. Overlays left by a previous
+        # process or another worker still read their base through the cache.
+        backed = set()
+        for overlay_dir in self.overlay_dirs:
+            try:
+                entries = os.scandir(overlay_dir)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        backing = qcow2_backing_file(entry.path)
+                        if backing:
+                            backed.add(backing)
+        return backed
+
+    def _make_room(self, size: int) -> bool:
+        used = sum(e.size for e in self._entries.values())
+        used += sum(self._pending.values())
+        backed = None
+        for key in list(self._entries):
+            if used + size <= self.budget_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refs > 0:
+                continue
+            if backed is None:
+                backed = self._backed_paths()
+            if os.path.realpath(entry.path) in backed:
+                continue
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            del self._entries[key]
+            self._by_path.pop(entry.path, None)
+            used -= entry.size
+            logger.info(f"Evicted cached base image {entry.path}")
+        return used + size <= self.budget_bytes
+
+    def _populate(self, source: str, key: str) -> CacheEntry:
+        final = os.path.join(self.cache_dir, key)
+        tmp = f"{final}.tmp"
+        expected = self._expected_digest(source)
+
+        try:
+            if reflink(source, tmp):
+                actual = file_digest(tmp) if expected else None
+            else:
+                actual = copy_with_digest(source, tmp)
+                if expected:
+                    actual = file_digest(tmp)
+
+            if expected and actual != expected:
+                raise BaseImageCacheError(
+                    f"Checksum mismatch caching {source}: expected {expected}, got {actual}"
+                )
+            os.replace(tmp, final)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        logger.info(f"Cached base image {source} as {final}")
+        return CacheEntry(path=final, size=os.path.getsize(final))
+
+    def _populate_in_background(self, source: str, key: str) -> None:
+        entry = None
+        try:
+            entry = self._populate(source, key)
+        except (OSError, BaseImageCacheError) as e:
+            logger.error(f"Failed to cache base image {source}: {e}")
+        finally:
+            with self._lock:
+                if entry is not None:
+                    self._entries[key] = entry
+                    self._by_path[entry.path] = key
+                else:
+                    self._failed[key] = time.monotonic() + FAILURE_BACKOFF_SECONDS
+                self._pending.pop(key, None)
+
+    def acquire(self, source: str) -> str:
+        if not self.enabled:
+            return source
+
+        key = self._key(source)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                copying = key in self._pending
+                if copying or time.monotonic() < self._failed.get(key, 0.0):
+                    BASE_IMAGE_CACHE.inc(result="bypass")
+                    return source
+
+                size = os.path.getsize(source)
+                if not self._make_room(size):
+                    BASE_IMAGE_CACHE.inc(result="bypass")
+                    logger.warning(f"Base image cache full, using {source} directly")
+                    return source
+                self._pending[key] = size
+                BASE_IMAGE_CACHE.inc(result="miss")
+            else:
+                self._entries.move_to_end(key)
+                entry.refs += 1
+                BASE_IMAGE_CACHE.inc(result="hit")
+
+        if entry is None:
+            # Copying a multi-GB image must not hold up the launch; this VM
+            # uses the source and later ones get the cached copy.
+            threading.Thread(
+                target=self._populate_in_background,
+                args=(source, key),
+                name=f"base-image-cache-{key}",
+                daemon=True,
+            ).start()
+            return source
+
+        try:
+            warm(entry.path, self.warm_bytes)
+        except OSError as e:
+            logger.debug("Could not warm %s: %s", entry.path, e)
+        return entry.path
+
+    def release(self, path: str) -> None:
+        with self._lock:
+            key = self._by_path.get(path)
+            entry = self._entries.get(key) if key else None
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
@@ -0,0 +1,131 @@
+import os
+import time
+from dataclasses import dataclass
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+class CgroupUnavailable(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class CgroupSample:
+    taken_at: float
+    cpu_usage_usec: int
+    memory: int
+    io_read: int
+    io_write: int
+    rx: int
+    tx: int
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _read_flat_keyed(path: str) -> dict[str, int]:
+    result = {}
+    for line in _read_text(path).splitlines():
+        key, _, value = line.partition(" ")
+        if value:
+            result[key] = int(value)
+    return result
+
+
+def find_cgroup_dir(pid: int, root: str = CGROUP_ROOT) -> str | None:
+    try:
+        content = _read_text(f"/proc/{pid}/cgroup")
+    except OSError:
+        return None
+
+    for line in content.splitlines():
+        # cgroup v2 has a single unified hierarchy entry: "0::/path"
+        if line.startswith("0::"):
+            path = os.path.join(root, line[3:].lstrip("/"))
+            if os.path.isfile(os.path.join(path, "cpu.stat")):
+                return path
+    return None
+
+
+def read_memory(cgroup_dir: str) -> int:
+    current = int(_read_text(os.path.join(cgroup_dir, "memory.current")))
+    stat = _read_flat_keyed(os.path.join(cgroup_dir, "memory.stat"))
+    return max(0, current - stat.get("inactive_file", 0))
+
+
+def read_cpu_usage_usec(cgroup_dir: str) -> int:
+    return _read_flat_keyed(os.path.join(cgroup_dir, "cpu.stat")).get("usage_usec", 0)
+
+
+def read_io(cgroup_dir: str) -> tuple[int, int]:
+    path = os.path.join(cgroup_dir, "io.stat")
+    if not os.path.exists(path):
+        return 0, 0
+
+    rbytes = wbytes = 0
+    for line in _read_text(path).splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            if key == "rbytes":
+                rbytes += int(value)
+            elif key == "wbytes":
+                wbytes += int(value)
+    return rbytes, wbytes
+
+
+def read_netns_counters(pid: int) -> tuple[int, int]:
+    rx = tx = 0
+    lines = _read_text(f"/proc/{pid}/net/dev").splitlines()[2:]
+    for line in lines:
+        iface, _, data = line.partition(":")
+        if iface.strip() == "lo":
+            continue
+        fields = data.split()
+        rx += int(fields[0])
+        tx += int(fields[8])
+    return rx, tx
+
+
+class CgroupStatsReader:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.cgroup_dir = find_cgroup_dir(pid)
+        if self.cgroup_dir is None:
+            raise CgroupUnavailable(f"No cgroup v2 directory found for pid {pid}")
+        self._previous: CgroupSample | None = None
+
+    def sample(self) -> CgroupSample:
+        try:
+            io_read, io_write = read_io(self.cgroup_dir)
+            rx, tx = read_netns_counters(self.pid)
+            return CgroupSample(
+                taken_at=time.monotonic(),
+                cpu_usage_usec=read_cpu_usage_usec(self.cgroup_dir),
+                memory=read_memory(self.cgroup_dir),
+                io_read=io_read,
+                io_write=io_write,
+                rx=rx,
+                tx=tx,
+            )
+        except (OSError, ValueError, IndexError) as e:
+            raise CgroupUnavailable(f"Failed to read cgroup {self.cgroup_dir}: {e}")
+
+    def read(self) -> dict:
+        current = self.sample()
+        previous, self._previous = self._previous, current
+
+        cpu = 0.0
+        if previous is not None:
+            elapsed_usec = (current.taken_at - previous.taken_at) * 1_000_000
+            if elapsed_usec > 0:
+                used = current.cpu_usage_usec - previous.cpu_usage_usec
+                cpu = max(0.0, used / elapsed_usec * 100.0)
+
+        return {
+            "cpu": round(cpu, 2),
+            "memory": current.memory,
+            "network": {"rx": current.rx, "tx": current.tx},
+            "io": {"read": current.io_read, "write": current.io_write},
+        }
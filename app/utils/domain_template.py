@@ -0,0 +1,46 @@
+import re
+import uuid
+from dataclasses import dataclass
+
+REQUIRED_PLACEHOLDERS = (
+    "{{VM_NAME}}",
+    "{{DISK_IMAGE}}",
+    "{{VM_UUID}}",
+    "{{NETWORK_NAME}}",
+)
+
+_SLOT = re.compile(r"\{\{(VM_NAME|DISK_IMAGE|VM_UUID|NETWORK_NAME)\}\}")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    # Literal text alternates with slot names: text, slot, text, ..., text.
+    parts: tuple[str, ...]
+
+    def render(self, **values: str) -> str:
+        out = list(self.parts)
+        for i in range(1, len(out), 2):
+            out[i] = values[out[i]]
+        return "".join(out)
+
+
+def compile_template(template: str) -> CompiledTemplate:
+    missing = [ph for ph in REQUIRED_PLACEHOLDERS if ph not in template]
+    if missing:
+        raise TemplateError(f"XML template is missing placeholders: {missing}")
+    return CompiledTemplate(parts=tuple(_SLOT.split(template)))
+
+
+def render(
+    template: CompiledTemplate, name: str, image_path: str, network_name: str
+) -> str:
+    return template.render(
+        VM_NAME=name,
+        DISK_IMAGE=image_path,
+        VM_UUID=str(uuid.uuid4()),
+        NETWORK_NAME=network_name,
+    )
@@ -0,0 +1,403 @@
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from string import ascii_lowercase
+from typing import Callable, Optional
+
+from app.utils.resource_limits import CPU_PERIOD_US, ResourceLimits
+
+logger = logging.getLogger(__name__)
+
+NO_TUNING = "none"
+QEMU_NS = "http://libvirt.org/schemas/domain/qemu/1.0"
+CAPABILITIES_TTL_SECONDS = 300
+# Headroom for QEMU itself on top of guest RAM under <memtune><hard_limit>.
+QEMU_OVERHEAD_MIB = 256
+
+_UNIT_KIB = {
+    "b": 1 / 1024,
+    "bytes": 1 / 1024,
+    "k": 1,
+    "kib": 1,
+    "kb": 1000 / 1024,
+    "m": 1024,
+    "mib": 1024,
+    "mb": 1000**2 / 1024,
+    "g": 1024**2,
+    "gib": 1024**2,
+    "gb": 1000**3 / 1024,
+}
+
+
+ET.register_namespace("qemu", QEMU_NS)
+
+
+class TuningError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class TuningProfile:
+    name: str
+    disk_cache: str = "none"
+    disk_io: str = "native"
+    disk_discard: Optional[str] = None
+    # Guests without virtio drivers (e.g. stock Windows) cannot boot once
+    # their disks move to the virtio bus, nor get a lease on a virtio NIC,
+    # so both are opt-in.
+    virtio_disks: bool = False
+    virtio_nics: bool = False
+    iothreads: int = 1
+    nic_queues: Optional[int] = None
+    cpu_mode: str = "host-passthrough"
+    hugepages: bool = False
+    balloon_autodeflate: bool = False
+
+
+PROFILES = {
+    "balanced": TuningProfile("balanced"),
+    "io-heavy": TuningProfile(
+        "io-heavy",
+        disk_discard="unmap",
+        virtio_disks=True,
+        virtio_nics=True,
+        iothreads=2,
+        nic_queues=4,
+        hugepages=True,
+    ),
+    # Oversubscribed hosts: thread-pool AIO, no pinned memory, reclaimable RAM.
+    "dense": TuningProfile(
+        "dense",
+        disk_io="threads",
+        iothreads=0,
+        cpu_mode="host-model",
+        balloon_autodeflate=True,
+    ),
+}
+
+PROFILE_NAMES = (NO_TUNING, *PROFILES)
+
+
+@dataclass(frozen=True)
+class HostCapabilities:
+    cpu_modes: frozenset
+    iothreads: bool
+    disk_buses: frozenset
+    hugepage_size_kib: int
+    hugepage_free_kib: int
+
+
+def probe_host(conn) -> HostCapabilities:
+    domcaps = ET.fromstring(conn.getDomainCapabilities(None, None, None, None, 0))
+    cpu_modes = frozenset(
+        m.get("name")
+        for m in domcaps.findall("./cpu/mode")
+        if m.get("supported") == "yes"
+    )
+    iothreads = domcaps.find("./iothreads")
+    disk_buses = frozenset(
+        v.text for v in domcaps.findall("./devices/disk/enum[@name='bus']/value")
+    )
+
+    caps = ET.fromstring(conn.getCapabilities())
+    sizes = sorted(
+        int(p.get("size"))
+        for p in caps.findall("./host/cpu/pages")
+        if p.get("unit", "KiB") == "KiB" and int(p.get("size")) > 4
+    )
+    cells = len(caps.findall("./host/topology/cells/cell")) or 1
+    size = free = 0
+    if sizes:
+        size = sizes[0]
+        pages = conn.getFreePages([size], 0, cells, 0) or {}
+        free = sum(counts.get(size, 0) for counts in pages.values()) * size
+
+    return HostCapabilities(
+        cpu_modes=cpu_modes,
+        iothreads=iothreads is not None and iothreads.get("supported") == "yes",
+        disk_buses=disk_buses,
+        hugepage_size_kib=size,
+        hugepage_free_kib=free,
+    )
+
+
+def capabilities_loader(connect: Callable) -> Callable[[], Optional[HostCapabilities]]:
+    lock = threading.Lock()
+    cached: list = [0.0, None]
+
+    def load() -> Optional[HostCapabilities]:
+        with lock:
+            if (
+                cached[1] is not None
+                and time.monotonic() - cached[0] < CAPABILITIES_TTL_SECONDS
+            ):
+                return cached[1]
+            try:
+                cached[:] = [time.monotonic(), probe_host(connect())]
+            except Exception as e:
+                logger.warning(f"Could not probe host capabilities: {e}")
+            return cached[1]
+
+    return load
+
+
+def _memory_kib(root: ET.Element) -> int:
+    mem = root.find("memory")
+    if mem is None or not (mem.text or "").strip():
+        return 0
+    factor = _UNIT_KIB.get(mem.get("unit", "KiB").lower(), 1)
+    return int(int(mem.text.strip()) * factor)
+
+
+def _child(parent: ET.Element, tag: str, **attrib) -> ET.Element:
+    elem = parent.find(tag)
+    if elem is None:
+        elem = ET.SubElement(parent, tag)
+    for key, value in attrib.items():
+        elem.set(key, value)
+    return elem
+
+
+def _tune_disks(devices: ET.Element, profile: TuningProfile, caps) -> None:
+    virtio = profile.virtio_disks and (caps is None or "virtio" in caps.disk_buses)
+    taken = {t.get("dev") for t in devices.findall("disk/target")}
+    for disk in devices.findall("disk"):
+        if disk.get("device", "disk") != "disk":
+            continue
+        target = disk.find("target")
+        if virtio and target is not None and target.get("bus") != "virtio":
+            dev = target.get("dev") or ""
+            target.set("bus", "virtio")
+            if dev[:2] in ("hd", "sd"):
+                renamed = next(
+                    name
+                    for name in (f"vd{dev[2:]}", *(f"vd{c}" for c in ascii_lowercase))
+                    if name not in taken
+                )
+                taken.add(renamed)
+                target.set("dev", renamed)
+            address = disk.find("address")
+            if address is not None and address.get("type") == "drive":
+                disk.remove(address)
+
+        driver = _child(disk, "driver")
+        driver.set("name", driver.get("name", "qemu"))
+        driver.set("cache", profile.disk_cache)
+        # O_DIRECT is required for native AIO.
+        if profile.disk_io == "native" and profile.disk_cache not in (
+            "none",
+            "directsync",
+        ):
+            driver.set("io", "threads")
+        else:
+            driver.set("io", profile.disk_io)
+        if profile.disk_discard:
+            driver.set("discard", profile.disk_discard)
+        # libvirt only accepts an iothread on virtio-blk disks.
+        on_virtio = target is not None and target.get("bus") == "virtio"
+        if on_virtio and profile.iothreads and (caps is None or caps.iothreads):
+            driver.set("iothread", "1")
+        else:
+            driver.attrib.pop("iothread", None)
+
+
+def _tune_interfaces(devices: ET.Element, profile: TuningProfile) -> None:
+    for interface in devices.findall("interface"):
+        if profile.virtio_nics:
+            _child(interface, "model", type="virtio")
+        model = interface.find("model")
+        # Multiqueue is a virtio-net feature; emulated NICs reject it.
+        if model is None or model.get("type") != "virtio":
+            continue
+        if profile.nic_queues:
+            _child(interface, "driver", name="vhost", queues=str(profile.nic_queues))
+
+
+def _tune_cpu(root: ET.Element, profile: TuningProfile, caps) -> None:
+    modes = [profile.cpu_mode, "host-model"]
+    mode = next((m for m in modes if caps is not None and m in caps.cpu_modes), None)
+    if mode is None:
+        return
+    cpu = _child(root, "cpu", mode=mode)
+    cpu.attrib.pop("match", None)
+    for tag in ("model", "vendor", "feature"):
+        for elem in cpu.findall(tag):
+            cpu.remove(elem)
+    if mode == "host-passthrough":
+        cpu.set("check", "none")
+
+
+def _tune_memory(root: ET.Element, devices, profile: TuningProfile, caps) -> None:
+    if profile.hugepages and caps is not None and caps.hugepage_size_kib:
+        memory = _memory_kib(root)
+        if 0 < memory <= caps.hugepage_free_kib:
+            backing = _child(root, "memoryBacking")
+            _child(backing, "hugepages")
+        else:
+            logger.info(
+                f"Not enough free hugepages for {profile.name} profile "
+                f"({caps.hugepage_free_kib} KiB free, {memory} KiB needed)"
+            )
+
+    if profile.balloon_autodeflate:
+        _balloon(devices)
+
+
+def _balloon(devices: ET.Element) -> ET.Element:
+    balloon = _child(devices, "memballoon", model="virtio")
+    balloon.set("autodeflate", "on")
+    balloon.set("freePageReporting", "on")
+    return balloon
+
+
+def apply_profile(
+    template: str, profile_name: str, caps: Optional[HostCapabilities]
+) -> str:
+    if not profile_name or profile_name == NO_TUNING:
+        return template
+    profile = PROFILES.get(profile_name)
+    if profile is None:
+        raise TuningError(f"Unknown tuning profile: {profile_name}")
+    try:
+        root = ET.fromstring(template)
+    except ET.ParseError as e:
+        raise TuningError(f"Template is not valid XML: {e}")
+
+    devices = _child(root, "devices")
+    _tune_disks(devices, profile, caps)
+    _tune_interfaces(devices, profile)
+    _tune_cpu(root, profile, caps)
+    _tune_memory(root, devices, profile, caps)
+
+    if profile.iothreads and (caps is None or caps.iothreads):
+        _child(root, "iothreads").text = str(profile.iothreads)
+    else:
+        iothreads = root.find("iothreads")
+        if iothreads is not None:
+            root.remove(iothreads)
+
+    return ET.tostring(root, encoding="unicode")
+
+
+def enable_ballooning(template: str, stats_period_seconds: int) -> str:
+    try:
+        root = ET.fromstring(template)
+    except ET.ParseError as e:
+        raise TuningError(f"Template is not valid XML: {e}")
+
+    balloon = _balloon(_child(root, "devices"))
+    _child(balloon, "stats", period=str(stats_period_seconds))
+
+    # Hugepage-backed guests cannot be merged by KSM anyway.
+    backing = root.find("memoryBacking")
+    if backing is not None and backing.find("hugepages") is None:
+        for elem in backing.findall("nosharepages"):
+            backing.remove(elem)
+        if not len(backing):
+            root.remove(backing)
+
+    return ET.tostring(root, encoding="unicode")
+
+
+def _set_text(parent: ET.Element, tag: str, value) -> None:
+    _child(parent, tag).text = str(value)
+
+
+def apply_limits(template: str, limits: ResourceLimits) -> str:
+    if limits.is_empty():
+        return template
+    try:
+        root = ET.fromstring(template)
+    except ET.ParseError as e:
+        raise TuningError(f"Template is not valid XML: {e}")
+
+    if limits.cpu_shares or limits.cpu_limit:
+        cputune = _child(root, "cputune")
+        if limits.cpu_shares:
+            _set_text(cputune, "shares", limits.cpu_shares)
+        if limits.cpu_limit:
+            # The global pair caps the whole domain; period/quota are per vCPU.
+            _set_text(cputune, "global_period", CPU_PERIOD_US)
+            _set_text(cputune, "global_quota", int(limits.cpu_limit * CPU_PERIOD_US))
+
+    if limits.memory_limit_mb:
+        # The cgroup limit covers the whole QEMU process, so one at or below
+        # guest RAM gets the VM OOM-killed by its own cgroup.
+        required_mb = -(-_memory_kib(root) // 1024) + QEMU_OVERHEAD_MIB
+        if limits.memory_limit_mb < required_mb:
+            raise TuningError(
+                f"memory_limit_mb must be at least {required_mb} for this VM "
+                f"(guest memory plus {QEMU_OVERHEAD_MIB} MiB for QEMU)"
+            )
+        memtune = _child(root, "memtune")
+        _child(memtune, "hard_limit", unit="KiB").text = str(
+            limits.memory_limit_mb * 1024
+        )
+
+    if limits.io_weight:
+        _set_text(_child(root, "blkiotune"), "weight", limits.io_weight)
+
+    throttles = (
+        ("read_bytes_sec", limits.io_read_bps),
+        ("write_bytes_sec", limits.io_write_bps),
+        ("read_iops_sec", limits.io_read_iops),
+        ("write_iops_sec", limits.io_write_iops),
+    )
+    if any(value for _, value in throttles):
+        for disk in _child(root, "devices").findall("disk"):
+            if disk.get("device", "disk") != "disk":
+                continue
+            iotune = _child(disk, "iotune")
+            for tag, value in throttles:
+                if value:
+                    _set_text(iotune, tag, value)
+
+    if limits.has_bandwidth():
+        # Interface bandwidth is from the guest's side and in KiB/s; libvirt
+        # re-applies it to the tap device on every boot.
+        for interface in _child(root, "devices").findall("interface"):
+            bandwidth = _child(interface, "bandwidth")
+            for tag, kbit in (
+                ("inbound", limits.net_ingress_kbit),
+                ("outbound", limits.net_egress_kbit),
+            ):
+                if kbit:
+                    _child(bandwidth, tag, average=str(max(1, kbit // 8)))
+
+    return ET.tostring(root, encoding="unicode")
+
+
+def vcpu_count(template: str) -> int:
+    try:
+        vcpu = ET.fromstring(template).find("vcpu")
+        return max(1, int(vcpu.text.strip())) if vcpu is not None else 1
+    except (ET.ParseError, ValueError, AttributeError):
+        return 1
+
+
+def apply_placement(domain_xml: str, cpus: tuple[int, ...], node: int) -> str:
+    root = ET.fromstring(domain_xml)
+    cpuset = ",".join(str(c) for c in cpus)
+
+    # Shares and quotas set by resource limits stay in place.
+    cputune = _child(root, "cputune")
+    for tag in ("vcpupin", "emulatorpin", "iothreadpin"):
+        for elem in cputune.findall(tag):
+            cputune.remove(elem)
+    for vcpu in range(vcpu_count(domain_xml)):
+        ET.SubElement(
+            cputune, "vcpupin", vcpu=str(vcpu), cpuset=str(cpus[vcpu % len(cpus)])
+        )
+    ET.SubElement(cputune, "emulatorpin", cpuset=cpuset)
+    if root.find("iothreads") is not None:
+        ET.SubElement(cputune, "iothreadpin", iothread="1", cpuset=cpuset)
+
+    numatune = root.find("numatune")
+    if numatune is not None:
+        root.remove(numatune)
+    numatune = ET.SubElement(root, "numatune")
+    ET.SubElement(numatune, "memory", mode="strict", nodeset=str(node))
+
+    return ET.tostring(root, encoding="unicode")
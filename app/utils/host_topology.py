@@ -0,0 +1,63 @@
+import glob
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cpulist(text: str) -> tuple[int, ...]:
+    cpus: set[int] = set()
+    for part in (text or "").strip().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return tuple(sorted(cpus))
+
+
+def format_cpulist(cpus: Iterable[int]) -> str:
+    return ",".join(str(c) for c in sorted(cpus))
+
+
+@dataclass(frozen=True)
+class NumaNode:
+    id: int
+    cpus: tuple[int, ...]
+    memory_kib: int
+
+
+@dataclass(frozen=True)
+class HostTopology:
+    nodes: tuple[NumaNode, ...]
+
+    @classmethod
+    def from_sysfs(cls, root: str = "/sys") -> "HostTopology":
+        online = set(os.sched_getaffinity(0))
+        nodes = []
+        for path in sorted(glob.glob(f"{root}/devices/system/node/node[0-9]*")):
+            node_id = int(re.search(r"node(\d+)$", path).group(1))
+            try:
+                with open(f"{path}/cpulist") as f:
+                    cpus = tuple(c for c in parse_cpulist(f.read()) if c in online)
+                memory = 0
+                with open(f"{path}/meminfo") as f:
+                    for line in f:
+                        if "MemTotal:" in line:
+                            memory = int(line.split()[-2])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping NUMA node {path}: {e}")
+                continue
+            if cpus:
+                nodes.append(NumaNode(id=node_id, cpus=cpus, memory_kib=memory))
+
+        if not nodes:
+            # Kernels without NUMA support expose no node directories.
+            nodes = [NumaNode(id=0, cpus=tuple(sorted(online)), memory_kib=0)]
+        return cls(nodes=tuple(nodes))
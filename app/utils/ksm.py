@@ -0,0 +1,87 @@
+import logging
+import os
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+KSM_PATH = "/sys/kernel/mm/ksm"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+_STATS = ("pages_shared", "pages_sharing", "pages_unshared", "full_scans")
+
+
+class KsmTuner:
+    def __init__(
+        self,
+        *,
+        enabled: bool,
+        pages_to_scan: int,
+        sleep_millisecs: int,
+        merge_across_nodes: bool,
+        path: str = KSM_PATH,
+    ):
+        self.enabled = enabled
+        self.pages_to_scan = pages_to_scan
+        self.sleep_millisecs = sleep_millisecs
+        self.merge_across_nodes = merge_across_nodes
+        self.path = path
+
+    @classmethod
+    def from_env(cls) -> "KsmTuner":
+        return cls(
+            enabled=bool(int(os.getenv("KSM_ENABLED", "0"))),
+            pages_to_scan=int(os.getenv("KSM_PAGES_TO_SCAN", "1000")),
+            sleep_millisecs=int(os.getenv("KSM_SLEEP_MILLISECS", "20")),
+            # Cross-node merging undoes NUMA pinning for the pages it shares.
+            merge_across_nodes=bool(int(os.getenv("KSM_MERGE_ACROSS_NODES", "0"))),
+        )
+
+    def _read(self, name: str) -> Optional[int]:
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, name: str, value: int) -> bool:
+        try:
+            with open(os.path.join(self.path, name), "w") as f:
+                f.write(str(value))
+            return True
+        except OSError as e:
+            logger.warning(f"Could not set KSM {name}={value}: {e}")
+            return False
+
+    def apply(self) -> None:
+        if not self.enabled:
+            return
+        if not os.path.isdir(self.path):
+            logger.warning(f"KSM is not available on this host ({self.path} missing)")
+            return
+
+        self._write("pages_to_scan", self.pages_to_scan)
+        self._write("sleep_millisecs", self.sleep_millisecs)
+        if self._read("merge_across_nodes") != int(self.merge_across_nodes):
+            # The kernel only accepts this while no pages are merged, and
+            # unmerging (run=2) would affect every process on the host.
+            if self._read("pages_shared"):
+                logger.warning(
+                    "Leaving KSM merge_across_nodes unchanged: pages are already "
+                    "merged. Set run=2 and restart to apply it."
+                )
+            else:
+                self._write("merge_across_nodes", int(self.merge_across_nodes))
+        if self._write("run", 1):
+            logger.info(
+                f"KSM running: pages_to_scan={self.pages_to_scan}, "
+                f"sleep_millisecs={self.sleep_millisecs}"
+            )
+
+    def stats(self) -> Optional[Dict[str, int]]:
+        if self._read("run") is None:
+            return None
+        stats = {name: self._read(name) or 0 for name in _STATS}
+        stats["run"] = self._read("run")
+        # Every sharing page beyond the one kept is memory not allocated.
+        stats["saved_bytes"] = stats["pages_sharing"] * PAGE_SIZE
+        return stats
@@ -0,0 +1,34 @@
+import logging
+import os
+import threading
+
+import libvirt
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_registered = False
+_running_pid = None
+
+
+def _run_loop():
+    while True:
+        try:
+            libvirt.virEventRunDefaultImpl()
+        except libvirt.libvirtError as e:
+            logger.error(f"libvirt event loop iteration failed: {e}")
+
+
+def ensure_event_loop() -> None:
+    global _registered, _running_pid
+
+    with _lock:
+        # The implementation must be registered before any connection is
+        # opened; the runner thread has to be restarted after a fork.
+        if not _registered:
+            libvirt.virEventRegisterDefaultImpl()
+            _registered = True
+        if _running_pid == os.getpid():
+            return
+        _running_pid = os.getpid()
+        threading.Thread(target=_run_loop, name="libvirt-events", daemon=True).start()
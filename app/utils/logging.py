@@ -1,25 +1,120 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from app.utils.tracing import current_span
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener: QueueListener | None = None
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock version folds the traceback into msg; render it into
+        # exc_text instead so formatters keep it apart from the message.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Runs on the emitting thread, where the trace context is still set.
+        span = current_span()
+        record.session_id = span.trace.session_id if span else None
+        record.phase = span.name if span else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "file": f"{record.filename}:{record.lineno}",
+            "thread": record.threadName,
+        }
+        if getattr(record, "session_id", None):
+            entry["session_id"] = record.session_id
+        if getattr(record, "phase", None):
+            entry["phase"] = record.phase
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def _parse_levels(spec: str) -> dict[str, str]:
+    levels = {}
+    for part in (spec or "").split(","):
+        name, _, level = part.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _build_formatter(fmt: str) -> logging.Formatter:
+    if fmt == "json":
+        return JsonFormatter()
+    return logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
 
 
 def setup_logging(debug: bool = True):
-    log_format = "%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s"
-    date_format = "%Y-%m-%d %H:%M:%S"
+    global _listener
+
+    level = os.getenv("LOG_LEVEL", "DEBUG" if debug else "INFO").upper()
+
+    if debug:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(_build_formatter(os.getenv("LOG_FORMAT", "text")))
+    else:
+        handler = RotatingFileHandler(
+            os.getenv("LOG_FILE_PATH"),
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        )
+        handler.setFormatter(_build_formatter(os.getenv("LOG_FORMAT", "json")))
+
+    # Request and poll threads only enqueue; a single listener thread writes.
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
 
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(level)
 
     if logger.hasHandlers():
         logger.handlers.clear()
+    logger.addHandler(queue_handler)
 
-    if debug:
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.DEBUG)
-        console_handler.setFormatter(logging.Formatter(log_format, date_format))
-        logger.addHandler(console_handler)
-    else:
-        file_handler = logging.FileHandler(os.getenv("LOG_FILE_PATH"))
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(logging.Formatter(log_format, date_format))
-        logger.addHandler(file_handler)
+    for name, logger_level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _stop_listener()
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
@@ -0,0 +1,289 @@
+import functools
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = ""):
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in values
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+
+        lines = []
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(
+                    self.labelnames, key, f'le="{_format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LIFECYCLE_CALLS = REGISTRY.register(
+    Counter(
+        "venvmanager_lifecycle_calls_total",
+        "Session lifecycle calls by operation.",
+        ["operation"],
+    )
+)
+LIFECYCLE_FAILURES = REGISTRY.register(
+    Counter(
+        "venvmanager_lifecycle_failures_total",
+        "Session lifecycle calls that raised, by operation.",
+        ["operation"],
+    )
+)
+PHASE_SECONDS = REGISTRY.register(
+    Histogram(
+        "venvmanager_phase_duration_seconds",
+        "Duration of provisioning and teardown phases.",
+        ["phase"],
+    )
+)
+LIVE_SESSIONS = REGISTRY.register(
+    Gauge("venvmanager_live_sessions", "Sessions currently in the registry.")
+)
+REGISTRY_ENVIRONMENTS = REGISTRY.register(
+    Gauge(
+        "venvmanager_registry_environments",
+        "Environments held by all registered sessions.",
+    )
+)
+FREE_PORTS = REGISTRY.register(
+    Gauge("venvmanager_free_ports", "Published ports still available.")
+)
+BOOTING_VMS = REGISTRY.register(
+    Gauge("venvmanager_booting_vms", "VMs waiting for a DHCP lease.")
+)
+SOCAT_PROCESSES = REGISTRY.register(
+    Gauge("venvmanager_socat_processes", "Running socat port forwarders.")
+)
+IMAGE_PULLS = REGISTRY.register(
+    Counter(
+        "venvmanager_image_pulls_total",
+        "Background image pulls by result.",
+        ["result"],
+    )
+)
+IMAGES_EVICTED = REGISTRY.register(
+    Counter(
+        "venvmanager_images_evicted_total",
+        "Unused images removed under disk pressure.",
+    )
+)
+BASE_IMAGE_CACHE = REGISTRY.register(
+    Counter(
+        "venvmanager_base_image_cache_total",
+        "Base image cache lookups by result (hit, miss, bypass).",
+        ["result"],
+    )
+)
+OVERLAY_BYTES = REGISTRY.register(
+    Gauge(
+        "venvmanager_overlay_bytes",
+        "Allocated bytes of live VM overlays by storage root.",
+        ["root"],
+    )
+)
+OVERLAY_PLACEMENTS = REGISTRY.register(
+    Counter(
+        "venvmanager_overlay_placements_total",
+        "Overlay placements by storage root kind (disk, tmpfs, none).",
+        ["kind"],
+    )
+)
+OVERLAY_GC_DELETED = REGISTRY.register(
+    Counter(
+        "venvmanager_overlay_gc_deleted_total",
+        "Orphaned VM overlays removed by the garbage collector.",
+    )
+)
+OVERLAY_GC_RECLAIMED = REGISTRY.register(
+    Counter(
+        "venvmanager_overlay_gc_reclaimed_bytes_total",
+        "Bytes reclaimed by removing orphaned VM overlays.",
+    )
+)
+
+BALLOON_ADJUSTMENTS = REGISTRY.register(
+    Counter(
+        "venvmanager_balloon_adjustments_total",
+        "VM balloon resizes by direction (shrink, grow).",
+        ["direction"],
+    )
+)
+BALLOON_RECLAIMED = REGISTRY.register(
+    Gauge(
+        "venvmanager_balloon_reclaimed_bytes",
+        "Guest memory currently returned to the host by balloons.",
+    )
+)
+KSM_SAVED = REGISTRY.register(
+    Gauge(
+        "venvmanager_ksm_saved_bytes",
+        "Memory deduplicated by kernel samepage merging.",
+    )
+)
+
+
+def instrumented(operation: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            LIFECYCLE_CALLS.inc(operation=operation)
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                LIFECYCLE_FAILURES.inc(operation=operation)
+                raise
+
+        return wrapper
+
+    return decorator
@@ -9,6 +9,8 @@ from typing import Optional
 
 from app.config import Config
 
+logger = logging.getLogger(__name__)
+
 MAX_NETWORKS = Config.MAX_NETWORKS
 
 IFACE_XML = """
@@ -103,13 +105,20 @@ def create_docker_network(
         )
 
     except APIError as e:
-        logging.exception(f"Network creation failed (maybe it exists?): {e}")
+        logger.exception(f"Network creation failed (maybe it exists?): {e}")
         try:
             return docker_client.networks.get(docker_network_name)
         except NotFound:
             return None
 
 
+def ensure_docker_network(docker_client: DockerClient, name: str) -> Network:
+    try:
+        return docker_client.networks.get(name)
+    except NotFound:
+        return docker_client.networks.create(name=name, driver="bridge")
+
+
 def remove_docker_network(docker_network: Optional[Network]) -> bool:
     if docker_network is None:
         return False
@@ -126,7 +135,7 @@ def forward_port(
 ) -> subprocess.Popen:
     try:
         cmd = f"socat TCP-LISTEN:{host_port},fork,reuseaddr TCP:{vm_ip}:{vm_port}"
-        logging.debug(f"Starting socat: {cmd}")
+        logger.debug("Starting socat: %s", cmd)
 
         if debug:
             proc: subprocess.Popen = subprocess.Popen(shlex.split(cmd))
@@ -137,5 +146,5 @@ def forward_port(
         return proc
 
     except Exception as e:
-        logging.error(f"Failed to start socat forwarding: {e}")
+        logger.error(f"Failed to start socat forwarding: {e}")
         raise RuntimeError(f"socat failed: {e}")
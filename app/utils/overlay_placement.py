@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from app.utils.base_image_cache import reflink
+from app.utils.metrics import OVERLAY_BYTES, OVERLAY_PLACEMENTS
+
+logger = logging.getLogger(__name__)
+
+DISK = "disk"
+TMPFS = "tmpfs"
+
+
+class NoOverlayCapacityError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class StorageRoot:
+    path: str
+    weight: float = 1.0
+    kind: str = DISK
+    max_ttl_seconds: int | None = None
+    reserve_bytes: int = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StorageRoot":
+        kind = data.get("kind", DISK)
+        if kind not in (DISK, TMPFS):
+            raise ValueError(f"Unknown overlay root kind: {kind}")
+        return cls(
+            path=data["path"],
+            weight=float(data.get("weight", 1.0)),
+            kind=kind,
+            max_ttl_seconds=data.get("max_ttl_seconds"),
+            reserve_bytes=int(data.get("reserve_bytes", 0)),
+        )
+
+
+def supports_reflink(path: str) -> bool:
+    try:
+        with tempfile.NamedTemporaryFile(dir=path) as src:
+            src.write(b"\0" * 4096)
+            src.flush()
+            dst = f"{src.name}.clone"
+            try:
+                return reflink(src.name, dst)
+            finally:
+                if os.path.exists(dst):
+                    os.remove(dst)
+    except OSError:
+        return False
+
+
+class DeviceLoad:
+    def __init__(self, path: str, min_interval: float = 1.0):
+        st = os.stat(path)
+        self._stat_path = (
+            f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}/stat"
+        )
+        self._min_interval = min_interval
+        self._previous: tuple[float, int] | None = None
+        self._utilization = 0.0
+
+    def utilization(self) -> float:
+        # Field 10 of the block stat file is milliseconds spent doing I/O.
+        now = time.monotonic()
+        if self._previous and now - self._previous[0] < self._min_interval:
+            return self._utilization
+        try:
+            with open(self._stat_path) as f:
+                io_ticks = int(f.read().split()[9])
+        except (OSError, IndexError, ValueError):
+            return 0.0
+
+        if self._previous is not None:
+            elapsed_ms = (now - self._previous[0]) * 1000
+            busy_ms = io_ticks - self._previous[1]
+            self._utilization = min(1.0, max(0.0, busy_ms / elapsed_ms))
+        self._previous = (now, io_ticks)
+        return self._utilization
+
+
+class OverlayPlacer:
+    def __init__(self, roots: list[StorageRoot], expected_bytes: int):
+        if not roots:
+            raise ValueError("At least one overlay root is required")
+        self.roots = roots
+        self.expected_bytes = expected_bytes
+
+        self._lock = threading.Lock()
+        self._placed: dict[str, StorageRoot] = {}
+        self._deadlines: dict[str, datetime] = {}
+        self._load: dict[str, DeviceLoad] = {}
+        self._reflink: dict[str, bool] = {}
+        for root in roots:
+            os.makedirs(root.path, exist_ok=True)
+            self._reflink[root.path] = root.kind == DISK and supports_reflink(root.path)
+            if root.kind == DISK:
+                self._load[root.path] = DeviceLoad(root.path)
+
+    @classmethod
+    def from_env(cls) -> "OverlayPlacer":
+        spec = os.getenv("VM_OVERLAY_ROOTS")
+        if spec:
+            roots = [StorageRoot.from_dict(r) for r in json.loads(spec)]
+        else:
+            roots = [StorageRoot(path=os.getenv("VM_OVERLAYS_PATH"))]
+        return cls(
+            roots,
+            expected_bytes=int(
+                os.getenv("VM_OVERLAY_EXPECTED_BYTES", str(2 * 1024**3))
+            ),
+        )
+
+    @staticmethod
+    def _allocated(path: str) -> int:
+        try:
+            return os.stat(path).st_blocks * 512
+        except FileNotFoundError:
+            return 0
+
+    def _committed(self, root: StorageRoot) -> int:
+        # Overlays grow after placement, so each one holds the rest of the
+        # expected size against its root until it is released.
+        return sum(
+            max(0, self.expected_bytes - self._allocated(path))
+            for path, r in self._placed.items()
+            if r is root
+        )
+
+    def _score(self, root: StorageRoot) -> float | None:
+        usage = shutil.disk_usage(root.path)
+        available = usage.free - root.reserve_bytes - self._committed(root)
+        if available < self.expected_bytes:
+            return None
+        load = self._load[root.path].utilization() if root.path in self._load else 0.0
+        return root.weight * (available / usage.total) * (1.0 - 0.9 * load)
+
+    def place(self, name: str, ttl_seconds: int | None = None) -> str:
+        with self._lock:
+            # Short sessions go to RAM when a tmpfs root will take them.
+            tiers = (
+                [
+                    r
+                    for r in self.roots
+                    if r.kind == TMPFS
+                    and ttl_seconds is not None
+                    and r.max_ttl_seconds is not None
+                    and ttl_seconds <= r.max_ttl_seconds
+                ],
+                [r for r in self.roots if r.kind == DISK],
+            )
+            for tier in tiers:
+                scored = [(s, r) for r in tier if (s := self._score(r)) is not None]
+                if scored:
+                    root = max(scored, key=lambda sr: sr[0])[1]
+                    path = os.path.join(root.path, f"{name}.qcow2")
+                    self._placed[path] = root
+                    if root.kind == TMPFS:
+                        self._deadlines[path] = datetime.now() + timedelta(
+                            seconds=root.max_ttl_seconds
+                        )
+                    OVERLAY_PLACEMENTS.inc(kind=root.kind)
+                    logger.debug("Placed overlay %s on %s", name, root.path)
+                    return path
+
+        OVERLAY_PLACEMENTS.inc(kind="none")
+        raise NoOverlayCapacityError(f"No overlay root has room for {name}")
+
+    def can_reflink(self, overlay_path: str, base_image_path: str) -> bool:
+        with self._lock:
+            root = self._placed.get(overlay_path)
+        if root is None or not self._reflink.get(root.path):
+            return False
+        return os.stat(root.path).st_dev == os.stat(base_image_path).st_dev
+
+    def release(self, overlay_path: str) -> None:
+        with self._lock:
+            self._placed.pop(overlay_path, None)
+            self._deadlines.pop(overlay_path, None)
+
+    def deadline(self, overlay_paths: Iterable[str | None]) -> datetime | None:
+        # RAM-backed overlays must not outlive their root's max_ttl_seconds.
+        with self._lock:
+            deadlines = [
+                self._deadlines[p] for p in overlay_paths if p in self._deadlines
+            ]
+        return min(deadlines, default=None)
+
+    def placed(self) -> set[str]:
+        with self._lock:
+            return set(self._placed)
+
+    def usage(self) -> list[dict]:
+        with self._lock:
+            placed = list(self._placed.items())
+
+        result = []
+        for root in self.roots:
+            paths = [p for p, r in placed if r is root]
+            disk = shutil.disk_usage(root.path)
+            load = self._load.get(root.path)
+            overlay_bytes = sum(self._allocated(p) for p in paths)
+            OVERLAY_BYTES.set(overlay_bytes, root=root.path)
+            result.append(
+                {
+                    "path": root.path,
+                    "kind": root.kind,
+                    "weight": root.weight,
+                    "reflink": self._reflink.get(root.path, False),
+                    "free_bytes": disk.free,
+                    "total_bytes": disk.total,
+                    "io_utilization": round(load.utilization(), 3) if load else 0.0,
+                    "overlays": len(paths),
+                    "overlay_bytes": overlay_bytes,
+                }
+            )
+        return result
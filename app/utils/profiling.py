@@ -0,0 +1,81 @@
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, duration: float, interval: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+
+        try:
+            own_ident = threading.get_ident()
+            stacks: Counter = Counter()
+            deadline = time.monotonic() + duration
+
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(labels))] += 1
+                time.sleep(interval)
+
+            return "".join(
+                f"{stack} {count}\n" for stack, count in stacks.most_common()
+            )
+        finally:
+            self._lock.release()
+
+
+class AllocationProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def diff(self, duration: float, top: int, frames: int) -> list[dict]:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("An allocation snapshot is already running")
+
+        started_here = not tracemalloc.is_tracing()
+        try:
+            if started_here:
+                tracemalloc.start(frames)
+            baseline = tracemalloc.take_snapshot()
+            time.sleep(duration)
+            current = tracemalloc.take_snapshot()
+
+            stats = current.compare_to(baseline, "traceback")[:top]
+            return [
+                {
+                    "size_diff": stat.size_diff,
+                    "size": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                    "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback],
+                }
+                for stat in stats
+            ]
+        finally:
+            # Tracing only runs while a request asked for it.
+            if started_here:
+                tracemalloc.stop()
+            self._lock.release()
@@ -0,0 +1,88 @@
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, Optional
+
+CPU_PERIOD_US = 100_000
+
+
+class LimitsError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    cpu_limit: Optional[float] = None
+    cpu_shares: Optional[int] = None
+    memory_limit_mb: Optional[int] = None
+    pids_limit: Optional[int] = None
+    io_weight: Optional[int] = None
+    io_read_bps: Optional[int] = None
+    io_write_bps: Optional[int] = None
+    io_read_iops: Optional[int] = None
+    io_write_iops: Optional[int] = None
+    net_ingress_kbit: Optional[int] = None
+    net_egress_kbit: Optional[int] = None
+
+    @classmethod
+    def from_mapping(cls, data: Dict[str, Any]) -> "ResourceLimits":
+        values = {}
+        for f in fields(cls):
+            raw = data.get(f.name)
+            if raw is None or (isinstance(raw, str) and not raw.strip()):
+                continue
+            try:
+                values[f.name] = float(raw) if f.name == "cpu_limit" else int(raw)
+            except (TypeError, ValueError):
+                raise LimitsError(f"{f.name} must be a number, got {raw!r}")
+        limits = cls(**values)
+        limits.validate()
+        return limits
+
+    @classmethod
+    def from_model(cls, env) -> "ResourceLimits":
+        return cls(**{f.name: getattr(env, f.name, None) for f in fields(cls)})
+
+    def validate(self) -> None:
+        for name, value in self.as_dict().items():
+            if value is not None and value <= 0:
+                raise LimitsError(f"{name} must be positive")
+        if self.cpu_shares is not None and not 2 <= self.cpu_shares <= 262144:
+            raise LimitsError("cpu_shares must be between 2 and 262144")
+        if self.io_weight is not None and not 10 <= self.io_weight <= 1000:
+            raise LimitsError("io_weight must be between 10 and 1000")
+        if self.memory_limit_mb is not None and self.memory_limit_mb < 6:
+            raise LimitsError("memory_limit_mb must be at least 6")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def is_empty(self) -> bool:
+        return all(v is None for v in self.as_dict().values())
+
+    def has_bandwidth(self) -> bool:
+        return bool(self.net_ingress_kbit or self.net_egress_kbit)
+
+    def docker_run_options(self, io_device: Optional[str] = None) -> Dict[str, Any]:
+        options: Dict[str, Any] = {}
+        if self.cpu_limit:
+            options["nano_cpus"] = int(self.cpu_limit * 1_000_000_000)
+        if self.cpu_shares:
+            options["cpu_shares"] = self.cpu_shares
+        if self.memory_limit_mb:
+            options["mem_limit"] = self.memory_limit_mb * 1024 * 1024
+            # Equal to mem_limit: no swap on top of the limit.
+            options["memswap_limit"] = options["mem_limit"]
+        if self.pids_limit:
+            options["pids_limit"] = self.pids_limit
+        if self.io_weight:
+            options["blkio_weight"] = self.io_weight
+        # Throttles are per block device; without one they cannot be expressed.
+        if io_device:
+            for key, value in (
+                ("device_read_bps", self.io_read_bps),
+                ("device_write_bps", self.io_write_bps),
+                ("device_read_iops", self.io_read_iops),
+                ("device_write_iops", self.io_write_iops),
+            ):
+                if value:
+                    options[key] = [{"Path": io_device, "Rate": value}]
+        return options
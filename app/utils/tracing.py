@@ -0,0 +1,224 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.utils.metrics import PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "started_at",
+        "duration",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str | None, attributes):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.started_at = time.time()
+        self.duration: float | None = None
+        self.attributes = dict(attributes)
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_offset_ms": round(
+                (self.started_at - self.trace.started_at) * 1000, 3
+            ),
+            "duration_ms": (
+                round(self.duration * 1000, 3) if self.duration is not None else None
+            ),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self, session_id: str, operation: str):
+        self.trace_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.operation = operation
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def open_span(self, name: str, parent_id: str | None, attributes) -> Span:
+        span = Span(self, name, parent_id, attributes)
+        with self._lock:
+            self.spans.append(span)
+            self._open += 1
+        return span
+
+    def close_span(self, span: Span) -> bool:
+        span.duration = time.time() - span.started_at
+        with self._lock:
+            self._open -= 1
+            return self._open == 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [s.as_dict() for s in self.spans]
+        root = self.spans[0]
+        return {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "operation": self.operation,
+            "started_at": self.started_at,
+            "duration_ms": spans[0]["duration_ms"],
+            "complete": all(s["duration_ms"] is not None for s in spans),
+            "status": "error" if root.error else "ok",
+            "spans": spans,
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class Tracer:
+    def __init__(self, max_sessions: int = 1000, traces_per_session: int = 10):
+        self.max_sessions = max_sessions
+        self.traces_per_session = traces_per_session
+        self.export_path: str | None = None
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._traces: "OrderedDict[str, deque[Trace]]" = OrderedDict()
+
+    def configure(
+        self,
+        *,
+        max_sessions: int,
+        traces_per_session: int,
+        export_path: str | None = None,
+    ) -> None:
+        self.max_sessions = max_sessions
+        self.traces_per_session = traces_per_session
+        self.export_path = export_path or None
+
+    def _store(self, trace: Trace) -> None:
+        with self._lock:
+            traces = self._traces.get(trace.session_id)
+            if traces is None:
+                traces = self._traces[trace.session_id] = deque(
+                    maxlen=self.traces_per_session
+                )
+            else:
+                self._traces.move_to_end(trace.session_id)
+            traces.append(trace)
+            while len(self._traces) > self.max_sessions:
+                self._traces.popitem(last=False)
+
+    def _export(self, trace: Trace) -> None:
+        if not self.export_path:
+            return
+        try:
+            line = json.dumps(trace.as_dict(), default=str)
+            with self._export_lock, open(self.export_path, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.error(f"Failed to export trace {trace.trace_id}: {e}")
+
+    @contextmanager
+    def _run_span(self, trace: Trace, name: str, parent_id: str | None, attributes):
+        with self.enter(trace.open_span(name, parent_id, attributes)) as span:
+            yield span
+
+    def open_span(self, name: str, **attributes) -> Optional[Span]:
+        # Opened now but entered later, e.g. by a worker thread: the trace
+        # stays open until the span is entered and closed.
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return parent.trace.open_span(name, parent.span_id, attributes)
+
+    @contextmanager
+    def enter(self, span: Optional[Span]):
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            # Spans may outlive the request (e.g. VM boot polling), so a
+            # trace is exported once its last open span closes.
+            if span.trace.close_span(span):
+                self._export(span.trace)
+
+    @contextmanager
+    def trace(self, session_id: str, operation: str, **attributes):
+        parent = _current_span.get()
+        if parent is not None:
+            with self._run_span(parent.trace, operation, parent.span_id, attributes):
+                yield parent.trace
+            return
+
+        trace = Trace(str(session_id), operation)
+        self._store(trace)
+        with self._run_span(trace, operation, None, attributes):
+            yield trace
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        with self._run_span(parent.trace, name, parent.span_id, attributes) as span:
+            yield span
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._traces.get(str(session_id), ()))
+        return [t.as_dict() for t in traces]
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes):
+    return TRACER.span(name, **attributes)
+
+
+def open_span(name: str, **attributes) -> Optional[Span]:
+    return TRACER.open_span(name, **attributes)
+
+
+def enter_span(span: Optional[Span]):
+    return TRACER.enter(span)
+
+
+@contextmanager
+def phase(name: str, **attributes):
+    with TRACER.span(name, **attributes) as s, PHASE_SECONDS.time(phase=name):
+        yield s
@@ -0,0 +1,82 @@
+import logging
+import os
+import shlex
+import subprocess
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+INGRESS_HANDLE = "ffff:"
+SHAPER_LATENCY = "50ms"
+MIN_BURST_BYTES = 15000
+
+
+def _burst_bytes(rate_kbit: int) -> int:
+    # Roughly 10ms of traffic; tbf needs at least one MTU-sized packet.
+    return max(MIN_BURST_BYTES, rate_kbit * 1000 // 8 // 100)
+
+
+def _tc(cmd: str, check: bool = True) -> bool:
+    args = ["tc", *shlex.split(cmd)]
+    result = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(
+            result.returncode, args, stderr=result.stderr
+        )
+    return result.returncode == 0
+
+
+def clear_shaping(dev: str) -> None:
+    _tc(f"qdisc del dev {dev} root", check=False)
+    _tc(f"qdisc del dev {dev} handle {INGRESS_HANDLE} ingress", check=False)
+
+
+def shape_interface(
+    dev: str, ingress_kbit: Optional[int], egress_kbit: Optional[int]
+) -> bool:
+    # Directions are from the point of view of whatever sits behind `dev`
+    # (a cluster bridge or a container): traffic towards it leaves the
+    # host-side device and is shaped; traffic from it arrives there and
+    # can only be policed.
+    if not ingress_kbit and not egress_kbit:
+        return False
+    try:
+        clear_shaping(dev)
+        if ingress_kbit:
+            _tc(
+                f"qdisc add dev {dev} root tbf rate {ingress_kbit}kbit "
+                f"burst {_burst_bytes(ingress_kbit)} latency {SHAPER_LATENCY}"
+            )
+        if egress_kbit:
+            _tc(f"qdisc add dev {dev} handle {INGRESS_HANDLE} ingress")
+            _tc(
+                f"filter add dev {dev} parent {INGRESS_HANDLE} protocol all "
+                f"prio 1 u32 match u32 0 0 police rate {egress_kbit}kbit "
+                f"burst {_burst_bytes(egress_kbit)} drop"
+            )
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", b"") or b""
+        logger.error(f"Failed to shape {dev}: {e} {stderr.decode(errors='replace')}")
+        return False
+
+    logger.debug(
+        "Shaped %s: ingress=%skbit egress=%skbit", dev, ingress_kbit, egress_kbit
+    )
+    return True
+
+
+def host_veth(pid: int, container_dev: str = "eth0") -> Optional[str]:
+    # The container's end records the ifindex of its host-side peer.
+    try:
+        with open(f"/proc/{pid}/root/sys/class/net/{container_dev}/iflink") as f:
+            peer = f.read().strip()
+    except OSError:
+        return None
+    for dev in os.listdir("/sys/class/net"):
+        try:
+            with open(f"/sys/class/net/{dev}/ifindex") as f:
+                if f.read().strip() == peer:
+                    return dev
+        except OSError:
+            continue
+    return None
@@ -2,8 +2,16 @@ import os
 import subprocess
 import logging
 
+from app.utils.base_image_cache import reflink
 
-def create_overlay(base_image_path, image_path):
+logger = logging.getLogger(__name__)
+
+
+def create_overlay(base_image_path, image_path, clone=False):
+    # A reflinked copy shares extents with the base and needs no backing chain.
+    if clone and reflink(base_image_path, image_path):
+        logger.debug("Cloned overlay: %s", image_path)
+        return
     subprocess.run(
         [
             "qemu-img",
@@ -18,19 +26,19 @@ def create_overlay(base_image_path, image_path):
         ],
         check=True,
     )
-    logging.debug(f"Created overlay: {image_path}")
+    logger.debug("Created overlay: %s", image_path)
 
 
 def remove_overlay(image_path) -> bool:
     if os.path.exists(image_path):
         try:
             os.remove(image_path)
-            logging.debug(f"Removed overlay: {image_path}")
+            logger.debug("Removed overlay: %s", image_path)
             return True
 
         except OSError as e:
-            logging.error(f"Failed to remove overlay: {image_path}: {e}")
+            logger.error(f"Failed to remove overlay: {image_path}: {e}")
             return False
     else:
-        logging.warning(f"Tried to remove non-existing overlay: {image_path}")
+        logger.warning(f"Tried to remove non-existing overlay: {image_path}")
         return True